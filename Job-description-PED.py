@@ -1,114 +1,207 @@
 import requests
-import json
 import time
 import os
-import pandas as pd
+import argparse
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import metrics
+from http_utils import request_with_retries, mount_pool, MultipartFileStream, UploadProgress
+from tracking_store import open_store, TrackingStore, SUBMIT_ERROR
+from sharding import select_shard, shard_path, shard_paths, add_shard_arguments, SHARD_BY
+from json_bundle import PayloadReader
 
 url= "http://127.0.0.1:4205/v1"
-log_file = "job_tracking_log.csv"
-
-# Draft creation
-
-if os.path.exists(log_file):
-    df_log = pd.read_csv(log_file)
-else:
-    df_log = pd.DataFrame(columns=[
-        "filename", "draft_id", "job_id", "status", 
-        "start_time", "pdb_size_bytes"
-    ])
-
-for file in os.listdir("pdb_files"):
-    if file.endswith(".pdb"):
+log_file = "job_tracking_log.csv"     # CSV export of the tracking store
+tracking_db = "job_tracking.sqlite"
+pdb_folder = "pdb_files"
+desc_folder = "jsonFiles"             # description JSONs or bundles (json_bundle.py)
+
+MAX_IN_FLIGHT = 4      # files submitted concurrently (draft + description + upload)
+STAGE_RETRIES = 3      # retries per stage on connection errors, 429 and 5xx
+UPLOAD_TIMEOUT = 3600  # seconds
+GZIP_UPLOAD = False    # compress PDBs on the fly (only if the PED server accepts .pdb.gz)
+
+session = requests.Session()  # connection pool sized to --in-flight in main()
+
+
+def ped_post(endpoint, **kwargs):
+    """POST to the PED API with retries; raises for error responses."""
+    response = request_with_retries(session, "POST", f"{url}/{endpoint}",
+                                    retries=STAGE_RETRIES, rate_limit=False, **kwargs)
+    response.raise_for_status()
+    return response
+
+
+def existing_job(draft_id):
+    """Job of the draft's first ensemble (e001) if the PDB was already uploaded, else None."""
+    response = request_with_retries(session, "GET", f"{url}/drafts/{draft_id}/ensembles/e001",
+                                    retries=STAGE_RETRIES, rate_limit=False, timeout=60)
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    return response.json().get("job")
+
+
+def submit_pdb(file, description_data, gzip=GZIP_UPLOAD, row=None):
+    """
+    Creates a draft, posts its description and uploads the PDB (ensemble job).
+    Fills in and returns the tracking log row of the file. The draft_id of the row is
+    set as soon as the draft exists (kept if a later stage fails); a draft_id already
+    in the row (failed earlier run) is reused instead of creating a new draft, and its
+    PDB is only uploaded if the draft has no ensemble yet.
+    """
+    row = row if row is not None else {"filename": file}
+    pdb_file_path = os.path.join(pdb_folder, file)
+    row["start_time"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    pdb_size = os.path.getsize(pdb_file_path)
+    row["pdb_size_bytes"] = pdb_size
+
+    # Draft creation (not retried once sent: a retry could create a second draft)
+    draft_id = row.get("draft_id")
+    reused = bool(draft_id)
+    if reused:
+        print(f"[{file}] Reusing draft {draft_id} of the failed submission")
+    else:
+        with metrics.timer("ped_stage_seconds", stage="draft"):
+            draft_id = ped_post("drafts", idempotent=False, timeout=60).json()['draft_id']
+        row["draft_id"] = draft_id
+        print(f"[{file}] Draft created successfully! Draft ID: {draft_id}")
+
+    with metrics.timer("ped_stage_seconds", stage="description"):
+        ped_post(f"drafts/{draft_id}/description", json=description_data, timeout=60)
+    print(f"[{file}] Description updated successfully!")
+
+    # The upload of a failed submission may have reached the server (e.g. timed out)
+    job = existing_job(draft_id) if reused else None
+    if job is not None:
+        print(f"[{file}] Draft {draft_id} already has its ensemble (job {job['job_id']}), not uploaded again")
+    else:
+        # JOB CREATION (streamed from disk; not retried once sent: a retry could create a second job)
+        progress = UploadProgress(file, total=pdb_size)
+        with metrics.timer("ped_stage_seconds", stage="upload"), \
+                MultipartFileStream('pdbfile', pdb_file_path, gzip=gzip, progress=progress) as body:
+            job = ped_post(f"drafts/{draft_id}/ensembles", data=body, idempotent=False,
+                           headers={"Content-Type": body.content_type},
+                           timeout=UPLOAD_TIMEOUT).json()['job']
+        metrics.observe("ped_upload_size_bytes", pdb_size, buckets=metrics.SIZE_BUCKETS)
+        progress.report()
+        print(f"[{file}] Job created successfully! Job ID: {job['job_id']}")
+    job_id = job['job_id']
+    job_status = job['status']
+
+    row["job_id"] = job_id
+    row["status"] = job_status
+    return row
+
+
+def main(in_flight=MAX_IN_FLIGHT, gzip=GZIP_UPLOAD, shard=None, shard_by=SHARD_BY):
+    mount_pool(session, in_flight)
+    # Each shard has its own tracking store and log; files already in the merged store are skipped too
+    shard_log_file = shard_path(log_file, shard)
+    store = open_store(shard_path(tracking_db, shard), shard_log_file)
+    merged = TrackingStore(tracking_db) if shard is not None and os.path.exists(tracking_db) else None
+
+    files = sorted(f for f in os.listdir(pdb_folder) if f.endswith(".pdb"))
+    files = select_shard(files, pdb_folder, shard, by=shard_by)
+    if shard is not None:
+        print(f"🧩 Shard {shard[0]}/{shard[1]} ({shard_by}): {len(files)} PDBs")
+
+    # Files to submit, with their description JSON and tracking row
+    pending = []
+    descriptions = PayloadReader(desc_folder, "description")
+    for file in files:
         print("PDB file found:", file)
-        pdb_file_path = os.path.join("pdb_files", file)
-        print(f"\n🚀 Processing: {file}")
-
-        # Find matching JSON description file in jsonFiles folder
-        desc_filename = os.path.splitext(file)[0] + ".json"
-        desc_filepath = os.path.join("jsonFiles", desc_filename)
-        if not os.path.exists(desc_filepath):
-            print(f"❌ Description file not found for {file}: {desc_filepath}")
-            continue
 
-        with open(desc_filepath, "r") as Description_file:
-            Description_file_Data = json.load(Description_file)
+        # Find matching description in jsonFiles folder (JSON file or bundle entry)
+        desc_name = os.path.splitext(file)[0]
+        if desc_name not in descriptions:
+            print(f"❌ Description file not found for {file}: {descriptions.location(desc_name)}")
+            continue
 
-        if file in df_log['filename'].values:
+        # Failed submissions are retried (with the draft they created, if any)
+        row = store.get(file)
+        if row is None and merged is not None:
+            row = merged.get(file)
+        if row is not None and row["status"] != SUBMIT_ERROR:
             print(f"⏭️ Skipping already processed: {file}")
             continue
 
-        start_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        print("Start time:", start_time)
-        pdb_size = os.path.getsize(pdb_file_path)
-
         try:
-            request_draft = requests.post(url + "drafts")
-            json_data = request_draft.json()
-            draft_id = json_data['draft_id']
-            print("Draft ID:", draft_id)
-            print('Draft created successfully!')
-
-            request_description = requests.post(url + "drafts/" + draft_id + "/description", json=Description_file_Data)
-            print("Description updated successfully!")
-
-            # JOB CREATION 
-            with open(pdb_file_path, "rb") as pdb_file:
-                file_data = {'pdbfile': pdb_file}
-                request_job = requests.post(url + "drafts/" + draft_id + "/ensembles", files=file_data)
-                request_job_data = request_job.json()
-
-                job_id = request_job_data['job']['job_id']
-                job_status = request_job_data['job']['status']
-                print("Job ID:", job_id)
-                print("Job created successfully!")
-
-        except requests.exceptions.RequestException as e:
-            print(f"❌ Error processing {file}: {e}")
+            description_data = descriptions.load(desc_name)
+        except Exception as e:
+            print(f"❌ Cannot read description of {file} ({descriptions.location(desc_name)}): {e}")
             continue
+        pending.append((file, description_data, {"filename": file,
+                                                 "draft_id": row["draft_id"] if row is not None else None}))
+    descriptions.close()
+
+    print(f"\n🚀 Submitting {len(pending)} PDBs ({in_flight} in flight)")
+    start = time.time()
+    progress = metrics.progress(len(pending), "PDBs")
+
+    # Drafts and uploads run concurrently; the tracking store is only written from this thread
+    with ThreadPoolExecutor(in_flight) as pool:
+        futures = {pool.submit(submit_pdb, file, data, gzip, row): row for file, data, row in pending}
+        for future in as_completed(futures):
+            row = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                # Recorded (with the draft, if created) so that the next run retries it
+                print(f"❌ Error processing {row['filename']}: {e}")
+                row["status"] = SUBMIT_ERROR
+                store.add(row)
+                metrics.count("pdbs_total", result="error")
+                progress.advance()
+                continue
+
+            # Committed after each file (safe for large batches or crashes)
+            store.add(row)
+            metrics.count("pdbs_total", result="submitted")
+            progress.advance(n_bytes=row["pdb_size_bytes"])
+    progress.close()
+
+    store.export_csv(shard_log_file)
+    print(f"\n📄 Tracking log exported to {shard_log_file} ({len(store)} rows)")
+    print(f"🎯 Done in {time.time() - start:.1f} s")
+
+
+def merge_shards(n_shards):
+    """
+    Adds the rows of the shard tracking stores 0..N-1 to the tracking store (replacing failed
+    or earlier submissions, see TrackingStore.merge) and exports the log.
+    """
+    store = open_store(tracking_db, log_file)
+    for path in shard_paths(tracking_db, n_shards):
+        if not os.path.exists(path):
+            print(f"⚠️  Missing shard tracking store: {path}")
+            continue
+        shard_store = TrackingStore(path)
+        print(f"📥 {path}: {store.merge(shard_store)} rows added or updated")
+        shard_store.close()
+    store.export_csv(log_file)
+    print(f"📄 Tracking log exported to {log_file} ({len(store)} rows)")
 
-        df_log = pd.concat([df_log, pd.DataFrame([{
-            "filename": file,
-            "draft_id": draft_id,
-            "job_id": job_id,
-            "status": job_status,
-            "start_time": start_time,
-            "pdb_size_bytes": pdb_size
-        }])], ignore_index=True)
-
-        # Save after each iteration (safe for large batches or crashes)
-        df_log.to_csv(log_file, index=False)
-
-
-
-
-# while True:
-#     try:
-#         response = requests.get(url+'drafts/'+draft_id+'/ensembles/e001')
-#         response.raise_for_status()  # raise an error for bad responses (4xx or 5xx)
-
-#         data = response.json()
-#         status = data.get("job", {}).get("status")
-
-#         print(f"Current status: {status}")
-
-#         if status == "job finished normally":
-#             print("✅ Job completed!")
-#             break
-#         elif status and "deleted" in status.lower():
-#             print("⚠️ Job was deleted.")
-#             break
-#         else:
-#             # Wait before polling again (e.g., 5 seconds)
-#             time.sleep(10)
-
-#     except requests.RequestException as e:
-#         print(f"Request failed: {e}")
-#         time.sleep(10)  # optional: retry after a pause
 
+def add_arguments(parser):
+    parser.add_argument("--in-flight", type=int, default=MAX_IN_FLIGHT,
+                        help=f"Files submitted concurrently (default: {MAX_IN_FLIGHT})")
+    parser.add_argument("--gzip", action="store_true",
+                        help="Compress PDBs on the fly during upload (sent as .pdb.gz)")
+    add_shard_arguments(parser)
+    metrics.add_metrics_arguments(parser)
 
 
+def run(args):
+    with metrics.session(args, "Job-description-PED"):
+        if args.merge_shards:
+            merge_shards(args.merge_shards)
+        else:
+            main(in_flight=args.in_flight, gzip=args.gzip, shard=args.shard, shard_by=args.shard_by)
 
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create PED drafts, post descriptions and upload PDB ensembles.")
+    add_arguments(parser)
+    run(parser.parse_args())
 
- 
\ No newline at end of file
@@ -17,10 +17,16 @@ Output:
 """
 
 import os
+import mmap
+import argparse
 import warnings
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
+import metrics
+from ensemble_index import EnsembleIndex, count_first_model_residues
+from sharding import select_shard, shard_path, shard_paths, add_shard_arguments, SHARD_BY
 
 # === CONFIGURATION ===
 folders = [
@@ -33,6 +39,9 @@ seq_bins = list(range(0, 2551, 50))  # 0–50, 51–100, ...
 seq_labels = [f"{i+1}-{i+50}" for i in seq_bins[:-1]]
 seq_labels.append(">2500")
 
+# Parallel scan (processes); 1 = serial
+WORKERS = os.cpu_count() or 1
+
 # Suppress unhelpful warnings
 warnings.filterwarnings("ignore", category=FutureWarning)
 
@@ -40,61 +49,99 @@ warnings.filterwarnings("ignore", category=FutureWarning)
 # === CORE FUNCTION ===
 def analyze_pdb(path):
     """Compute file size and protein length for the first model."""
-    size_mb = os.path.getsize(path) / (1024**2)
-    residues = set()
-    model_started = False
+    size = os.path.getsize(path)
+    size_mb = size / (1024**2)
+    if size == 0:
+        return size_mb, 0
 
-    with open(path, "r") as f:
-        for line in f:
-            if line.startswith("MODEL") and not model_started:
-                model_started = True
-            elif line.startswith("ATOM"):
-                res_id = line[21:22].strip() + line[22:26].strip()
-                residues.add(res_id)
-            elif line.startswith("ENDMDL") and model_started:
-                break
+    # Only the pages up to the first ENDMDL are read from disk; if no MODEL tag
+    # is found, all ATOM lines are used
+    with metrics.timer("pdb_parse_seconds", step="analyze"), \
+            open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return size_mb, count_first_model_residues(mm)
 
-    # If no MODEL tag found, use all ATOM lines
-    if not model_started:
-        with open(path, "r") as f:
-            residues = {line[21:22].strip() + line[22:26].strip()
-                        for line in f if line.startswith("ATOM")}
 
-    return size_mb, len(residues)
+def _analyze_task(path):
+    """analyze_pdb for the process pool; errors are returned instead of raised."""
+    try:
+        return analyze_pdb(path), None
+    except Exception as e:
+        return None, e
 
 
-# === MAIN WORKFLOW ===
-for folder in folders:
+def get_results_location(folder):
+    """Returns (project_name, results_dir) for a completed_* folder."""
     parent_folder = os.path.dirname(folder)
-    project_name = os.path.basename(parent_folder)
-    results_dir = os.path.join(parent_folder, "results")
-    os.makedirs(results_dir, exist_ok=True)
-
-    pdb_files = [f for f in os.listdir(folder) if f.endswith(".pdb")]
-    total_pdbs = len(pdb_files)
-
-    print("\n" + "=" * 65)
-    print(f"📁 Processing folder: {project_name}")
-    print("=" * 65)
-    print(f"Path: {folder}")
-    print(f"Total PDB files detected: {total_pdbs}\n")
-
-    # === ANALYSIS ===
-    data = []
-    for i, f in enumerate(pdb_files, start=1):
-        path = os.path.join(folder, f)
-        print(f"  🔹 Analyzing {f} ({i}/{total_pdbs})...", end="\r")
-        try:
-            size_mb, length = analyze_pdb(path)
-            data.append({"file": f, "size_MB": size_mb, "avg_length": length})
-        except Exception as e:
-            print(f"\n  ⚠️ Error analyzing {f}: {e}")
-
-    df = pd.DataFrame(data)
-    print(f"\n✅ Completed analysis of {len(df)} PDBs.\n")
+    return os.path.basename(parent_folder), os.path.join(parent_folder, "results")
+
+
+# === MAIN WORKFLOW ===
+def main(workers=WORKERS, index_path=None, shard=None, shard_by=SHARD_BY):
+    index = EnsembleIndex(index_path) if index_path else None
+
+    for folder in folders:
+        project_name, results_dir = get_results_location(folder)
+        os.makedirs(results_dir, exist_ok=True)
+
+        pdb_files = [f for f in os.listdir(folder) if f.endswith(".pdb")]
+        if shard is not None:
+            n_all = len(pdb_files)
+            pdb_files = select_shard(pdb_files, folder, shard, by=shard_by, index_path=index_path)
+            print(f"🧩 Shard {shard[0]}/{shard[1]} ({shard_by}): {len(pdb_files)} of {n_all} PDBs")
+        total_pdbs = len(pdb_files)
+
+        print("\n" + "=" * 65)
+        print(f"📁 Processing folder: {project_name}")
+        print("=" * 65)
+        print(f"Path: {folder}")
+        print(f"Total PDB files detected: {total_pdbs}\n")
+
+        # === ANALYSIS ===
+        data = []
+        paths = [os.path.join(folder, f) for f in pdb_files]
+
+        # Files already in the ensemble index (and unchanged) are not read
+        indexed = {}
+        if index is not None:
+            for f, path in zip(pdb_files, paths):
+                record = index.lookup(path)
+                if record is not None:
+                    indexed[f] = ((record["size_bytes"] / (1024**2), record["n_residues"]), None)
+            print(f"🗂️  {len(indexed)}/{total_pdbs} PDBs taken from the ensemble index\n")
+        to_scan = [path for f, path in zip(pdb_files, paths) if f not in indexed]
+
+        progress = metrics.progress(total_pdbs, "PDBs")
+        with ProcessPoolExecutor(max(1, workers)) as pool:
+            scanned = iter(metrics.pool_map(pool, _analyze_task, to_scan, chunksize=64) if workers > 1
+                           else map(_analyze_task, to_scan))
+            for i, f in enumerate(pdb_files, start=1):
+                result, error = indexed[f] if f in indexed else next(scanned)
+                print(f"  🔹 Analyzing {f} ({i}/{total_pdbs})...", end="\r")
+                if error is None:
+                    size_mb, length = result
+                    data.append({"file": f, "size_MB": size_mb, "avg_length": length})
+                    metrics.count("pdbs_total", result="indexed" if f in indexed else "analyzed")
+                    progress.advance(n_bytes=int(size_mb * 1024**2))
+                else:
+                    print(f"\n  ⚠️ Error analyzing {f}: {error}")
+                    metrics.count("pdbs_total", result="error")
+                    progress.advance()
+        progress.close()
+
+        df = pd.DataFrame(data)
+        print(f"\n✅ Completed analysis of {len(df)} PDBs.\n")
+
+        with metrics.timer("write_results_seconds"):
+            write_results(df, results_dir, project_name, shard)
+
+
+def write_results(df, results_dir, project_name, shard=None):
+    """Writes the TSVs, report and plots of one project (per-shard names if shard is given)."""
+    def output_path(name):
+        return shard_path(os.path.join(results_dir, f"{project_name}_{name}"), shard)
 
     # === SAVE DATA ===
-    tsv_path = os.path.join(results_dir, f"{project_name}_ensemble_analysis.tsv")
+    tsv_path = output_path("ensemble_analysis.tsv")
     df.to_csv(tsv_path, sep="\t", index=False)
 
     # === DISTRIBUTIONS ===
@@ -120,12 +167,12 @@ for folder in folders:
     }
 
     pd.DataFrame([summary]).to_csv(
-        os.path.join(results_dir, f"{project_name}_ensemble_summary_stats.tsv"),
+        output_path("ensemble_summary_stats.tsv"),
         sep="\t", index=False
     )
 
     # === REPORT ===
-    report_path = os.path.join(results_dir, f"{project_name}_summary_report.txt")
+    report_path = output_path("summary_report.txt")
     with open(report_path, "w") as report:
         report.write(f"=== Ensemble Analysis Report: {project_name} ===\n\n")
         report.write(f"Total ensembles analyzed: {summary['Total ensembles']}\n\n")
@@ -155,7 +202,7 @@ for folder in folders:
     plt.title(f"Sequence length distribution - {project_name}")
     plt.xticks(ticks=range(len(seq_labels)), labels=seq_labels, rotation=90)
     plt.tight_layout()
-    plt.savefig(os.path.join(results_dir, f"{project_name}_plot_sequence_length_distribution.png"), dpi=200)
+    plt.savefig(output_path("plot_sequence_length_distribution.png"), dpi=200)
     plt.close()
 
     # File size histogram
@@ -165,7 +212,7 @@ for folder in folders:
     plt.ylabel("Number of ensembles")
     plt.title(f"Ensemble file size distribution - {project_name}")
     plt.tight_layout()
-    plt.savefig(os.path.join(results_dir, f"{project_name}_plot_file_size_distribution.png"), dpi=200)
+    plt.savefig(output_path("plot_file_size_distribution.png"), dpi=200)
     plt.close()
 
     # Length vs. size scatter plot
@@ -175,8 +222,52 @@ for folder in folders:
     plt.ylabel("File size (MB)")
     plt.title(f"Protein length vs File size - {project_name}")
     plt.tight_layout()
-    plt.savefig(os.path.join(results_dir, f"{project_name}_plot_seq_length_vs_size.png"), dpi=200)
+    plt.savefig(output_path("plot_seq_length_vs_size.png"), dpi=200)
     plt.close()
 
     print(f"🎯 All results saved under:\n  {results_dir}\n")
     print("-" * 65)
+
+
+def merge_shards(n_shards):
+    """Combines the analysis TSVs of shards 0..N-1 and writes the project outputs from them."""
+    for folder in folders:
+        project_name, results_dir = get_results_location(folder)
+        tsv_path = os.path.join(results_dir, f"{project_name}_ensemble_analysis.tsv")
+        shard_tsvs = shard_paths(tsv_path, n_shards)
+        missing = [p for p in shard_tsvs if not os.path.exists(p)]
+        if missing:
+            print(f"⚠️  {project_name}: missing shard outputs, not merged: {', '.join(missing)}")
+            continue
+
+        df = pd.concat([pd.read_csv(p, sep="\t", float_precision="round_trip") for p in shard_tsvs],
+                       ignore_index=True)
+        # Same row order as an unsharded run (folder listing order)
+        listing = {f: i for i, f in enumerate(f for f in os.listdir(folder) if f.endswith(".pdb"))}
+        df = df.sort_values("file", key=lambda files: files.map(listing).fillna(len(listing)),
+                            kind="stable", ignore_index=True)
+        print(f"🧩 {project_name}: merged {n_shards} shards ({len(df)} PDBs)")
+        write_results(df, results_dir, project_name)
+
+
+def add_arguments(parser):
+    parser.add_argument("--workers", type=int, default=WORKERS,
+                        help=f"Processes used to scan the PDBs (default: {WORKERS})")
+    parser.add_argument("--index", metavar="DB",
+                        help="Take size and length from this ensemble index (see ensemble_index.py)")
+    add_shard_arguments(parser)
+    metrics.add_metrics_arguments(parser)
+
+
+def run(args):
+    with metrics.session(args, "anylisis_ensembles"):
+        if args.merge_shards:
+            merge_shards(args.merge_shards)
+        else:
+            main(workers=args.workers, index_path=args.index, shard=args.shard, shard_by=args.shard_by)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Analyze size and sequence length of PDB ensembles.")
+    add_arguments(parser)
+    run(parser.parse_args())
@@ -2,10 +2,16 @@
 # -*- coding: utf-8 -*-
 
 import os
+import errno
+import heapq
 import shutil
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
+import metrics
+from eventlog import EventLog, add_log_arguments, LOG_LEVEL
 
 # ============================================================
 # CONFIGURATION
@@ -20,6 +26,27 @@ parent_folders = [
 MAX_PDBS_PER_BATCH = 90
 BIN_STEP = 50
 
+# Batch planner: "length" (4 fixed batches ≤600 aa + 50-aa bins beyond) or
+# "packed" (size-balanced batches under the limits below)
+PLANNER = "length"
+MAX_BATCH_MB = 20000       # packed: total size of a batch (a larger single PDB gets its own batch)
+MAX_BATCH_FILES = MAX_PDBS_PER_BATCH  # packed: PDBs per batch
+MAX_LENGTH_SPAN = 300      # packed: max - min sequence length within a batch (aa); None = no limit
+
+# How PDBs are placed in the batch folders:
+#   auto     rename on the same filesystem, symlink across filesystems (no data is copied)
+#   rename   os.rename (same filesystem only)      hardlink  os.link (same filesystem only)
+#   symlink  absolute symlink to the source        reflink   copy-on-write clone (btrfs/XFS), else copy
+#   move     rename, or copy + delete across filesystems (as shutil.move)
+# Copies are written to a temporary <file>.part in the batch folder and renamed into
+# place, so an interrupted run never leaves a partial PDB that a resume would skip.
+MATERIALIZE = "auto"
+MATERIALIZE_THREADS = 16
+JOURNAL_NAME = "materialize_journal.tsv"  # undo journal, in the batches folder
+EVENT_LOG_NAME = "batch_events.jsonl"     # JSON-lines event log (eventlog.py), in the batches folder
+FICLONE = 0x40049409                      # Linux ioctl used for reflinks
+PART_SUFFIX = ".part"                     # temporary name of copies in progress
+
 # Default sequence-length bins (50 aa increments)
 seq_bins = list(range(0, 2551, BIN_STEP))
 seq_labels = [f"{i+1}-{i+BIN_STEP}" for i in seq_bins[:-1]]
@@ -39,61 +66,301 @@ def print_header(title):
 def print_subheader(title):
     print(f"\n--- {title} ---")
 
-def move_batch_files(df_part, batch_dir, log_path):
-    """Move PDBs of a sub-batch with progress reporting."""
-    os.makedirs(batch_dir, exist_ok=True)
-    total = len(df_part)
-
-    with open(log_path, "a") as log:
-        for idx, (_, row) in enumerate(df_part.iterrows(), start=1):
-            src = os.path.join(row["source_pdb_folder"], row["file"])
-            dst = os.path.join(batch_dir, row["file"])
+def reflink_file(src, dst):
+    """
+    Copy-on-write clone of src (btrfs, XFS, ...); falls back to a regular copy.
+    Written to dst.part and renamed onto dst once complete.
+    """
+    tmp = dst + PART_SUFFIX
+    try:
+        try:
+            import fcntl
+            with open(src, "rb") as fsrc, open(tmp, "wb") as fdst:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except (ImportError, OSError):
+            shutil.copy2(src, tmp)
+        os.replace(tmp, dst)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+def move_file(src, dst):
+    """
+    Renames src to dst; across filesystems, copies it to dst.part, renames that onto
+    dst and only then removes src.
+    """
+    try:
+        os.rename(src, dst)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    tmp = dst + PART_SUFFIX
+    try:
+        shutil.copy2(src, tmp)
+        os.replace(tmp, dst)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    os.remove(src)
+
+MATERIALIZE_OPS = {
+    "rename": os.rename,
+    "hardlink": os.link,
+    "symlink": lambda src, dst: os.symlink(os.path.abspath(src), dst),
+    "reflink": reflink_file,
+    "move": move_file,
+}
+
+def choose_strategy(strategy, src_dir, dst_dir):
+    """Resolves "auto": rename when source and batches folder share a filesystem, else symlink."""
+    if strategy != "auto":
+        return strategy
+    return "rename" if os.stat(src_dir).st_dev == os.stat(dst_dir).st_dev else "symlink"
+
+def materialize_batches(plan, output_base, log, strategy=MATERIALIZE, threads=MATERIALIZE_THREADS):
+    """
+    Places the PDBs of every batch in its folder with the chosen strategy, in a thread
+    pool. Each operation is written to the undo journal before it runs, so an
+    interrupted run can be rolled back (--undo) or resumed: PDBs already in their
+    batch folder are skipped. Failed operations are place_failed events of log.
+    """
+    for batch_dir in plan["batch_dir"].unique():
+        os.makedirs(batch_dir, exist_ok=True)
+
+    strategies = {}
+    ops = []
+    for file, source, batch_dir in zip(plan["file"], plan["source_pdb_folder"], plan["batch_dir"]):
+        src = os.path.join(source, file)
+        dst = os.path.join(batch_dir, file)
+        if os.path.lexists(dst):
+            continue
+        if source not in strategies:
+            strategies[source] = choose_strategy(strategy, source, output_base)
+            log.info("strategy", f"  📦 {source} → batches: {strategies[source]}",
+                     source=source, strategy=strategies[source])
+        ops.append((strategies[source], src, dst))
+
+    total = len(ops)
+    log.info("materialize_start", f"  Placing {total} files ({len(plan) - total} already in place)",
+             files=total, in_place=len(plan) - total)
+    errors = 0
+    progress = metrics.progress(total, "files")
+    with open(os.path.join(output_base, JOURNAL_NAME), "a") as journal, ThreadPoolExecutor(threads) as pool:
+        for op, src, dst in ops:
+            journal.write(f"{op}\t{src}\t{dst}\n")
+        journal.flush()
+        os.fsync(journal.fileno())
+
+        futures = [pool.submit(MATERIALIZE_OPS[op], src, dst) for op, src, dst in ops]
+        for future, (op, src, dst) in zip(futures, ops):
             try:
-                shutil.move(src, dst)
+                future.result()
             except Exception as e:
-                log.write(f"[ERROR] Moving {src} -> {dst}: {e}\n")
-            print(f"    Moving file {idx}/{total}", end="\r")
-    print()  # newline after move loop
-
-
-# ============================================================
-# MAIN PROCESSING LOOP
-# ============================================================
-
-for parent in parent_folders:
-    print_header(f"Processing parent folder: {parent}")
-
-    results_dir = os.path.join(parent, "results")
-    os.makedirs(results_dir, exist_ok=True)
-
-    # Detect completed folder
-    completed_dirs = [os.path.join(parent, d) for d in os.listdir(parent) if d.startswith("completed_")]
-    if not completed_dirs:
-        print(f"⚠️  No completed_* folder found. Skipping {parent}.")
-        continue
-    completed_folder = completed_dirs[0]
-
-    # Find TSV
-    main_name = os.path.basename(parent)
-    tsv_path = os.path.join(results_dir, f"{main_name}_ensemble_analysis.tsv")
-    if not os.path.exists(tsv_path):
-        print(f"⚠️  Missing TSV file: {tsv_path}. Skipping.")
-        continue
-
-    print(f"📄  Ensemble TSV: {tsv_path}")
-    print(f"📂  PDB source:  {completed_folder}")
-
-    # Load TSV
-    df = pd.read_csv(tsv_path, sep="\t")
-    df["source_pdb_folder"] = completed_folder
-    df = df.sort_values("avg_length").reset_index(drop=True)
-
-    output_base = os.path.join(results_dir, "batches_by_length")
-    os.makedirs(output_base, exist_ok=True)
-    log_path = os.path.join(output_base, "move_log.txt")
-
-    batch_records = []
-    summary_records = []
+                errors += 1
+                log.error("place_failed", op=op, src=src, dst=dst, error=str(e))
+            progress.advance()
+    progress.close()
+    log.info("materialize_end", files=total, errors=errors)
+    if errors:
+        log.warning("materialize_errors", f"  ⚠️  {errors} files could not be placed "
+                    f"(place_failed events in {log.path or 'the event log, disabled'})", errors=errors)
+    return errors
+
+def undo_materialization(output_base, log):
+    """
+    Rolls back the operations of the undo journal, newest first. Each step checks
+    the current state, so it is safe after an interrupted run or a partial undo;
+    copies left half-written (.part) by an interrupted run are removed.
+    Operations that fail stay in the journal (and are undo_failed events of log).
+    """
+    journal_path = os.path.join(output_base, JOURNAL_NAME)
+    if not os.path.exists(journal_path):
+        log.info("undo_skipped", f"  Nothing to undo ({journal_path} not found)", journal=journal_path)
+        return 0
+    with open(journal_path) as journal:
+        entries = [line.rstrip("\n").split("\t") for line in journal if line.strip()]
+
+    failed = []
+    progress = metrics.progress(len(entries), "files")
+    for op, src, dst in reversed(entries):
+        try:
+            if os.path.exists(dst + PART_SUFFIX):
+                os.remove(dst + PART_SUFFIX)
+            if op in ("rename", "move"):
+                if os.path.exists(dst) and not os.path.exists(src):
+                    shutil.move(dst, src)
+                elif op == "move" and os.path.exists(dst) and os.path.exists(src):
+                    os.remove(dst)  # copied across filesystems, interrupted before src was removed
+            elif op == "hardlink":
+                if os.path.exists(dst) and os.path.exists(src) and os.path.samefile(src, dst):
+                    os.remove(dst)
+            elif op == "symlink":
+                if os.path.islink(dst):
+                    os.remove(dst)
+            elif op == "reflink":
+                if os.path.exists(dst) and os.path.exists(src):
+                    os.remove(dst)
+        except OSError as e:
+            failed.append((op, src, dst))
+            log.error("undo_failed", op=op, src=src, dst=dst, error=str(e))
+        progress.advance()
+    progress.close()
+    log.info("undo_end", operations=len(entries), failed=len(failed))
+
+    # Batch folders left empty are removed
+    for entry in os.scandir(output_base):
+        if entry.is_dir():
+            try:
+                os.rmdir(entry.path)
+            except OSError as e:
+                if e.errno not in (errno.ENOTEMPTY, errno.EEXIST):
+                    raise
+
+    if failed:
+        with open(journal_path, "w") as journal:
+            journal.writelines(f"{op}\t{src}\t{dst}\n" for op, src, dst in reversed(failed))
+        log.warning("undo_errors", f"  ⚠️  {len(failed)} operations could not be undone (kept in {journal_path})",
+                    failed=len(failed))
+    else:
+        os.remove(journal_path)
+    return len(failed)
+
+def length_groups(lengths, max_span):
+    """
+    Splits lengths sorted in ascending order into consecutive groups spanning at most
+    max_span aa. Returns a list of (start, stop) positions.
+    """
+    if max_span is None:
+        return [(0, len(lengths))] if len(lengths) else []
+    groups = []
+    start = 0
+    while start < len(lengths):
+        stop = int(np.searchsorted(lengths, lengths[start] + max_span, side="right"))
+        groups.append((start, stop))
+        start = stop
+    return groups
+
+def first_fit_decreasing(sizes, max_size, max_files):
+    """
+    First-fit-decreasing bin packing. Returns the bin number of each item.
+    A segment tree over the remaining capacity of the bins finds the first bin
+    that fits in O(log n), so 100k items are packed in about a second.
+    """
+    n = len(sizes)
+    bins = np.zeros(n, dtype=np.int64)
+    if n == 0:
+        return bins
+    leaves = 1
+    while leaves < n:
+        leaves *= 2
+    tree = [float(max_size)] * (2 * leaves)  # max remaining capacity below each node
+    counts = [0] * leaves
+    n_bins = 0
+
+    for item in np.argsort(-np.asarray(sizes, dtype=float), kind="stable"):
+        size = float(sizes[item])
+        if size > max_size:
+            # Too large for any batch: alone in a new bin, closed right away
+            b = n_bins
+            remaining = -1.0
+        else:
+            node = 1
+            while node < leaves:
+                node = 2 * node if tree[2 * node] >= size else 2 * node + 1
+            b = node - leaves
+            counts[b] += 1
+            remaining = tree[node] - size if counts[b] < max_files else -1.0
+        bins[item] = b
+        n_bins = max(n_bins, b + 1)
+
+        node = b + leaves
+        tree[node] = remaining
+        node //= 2
+        while node:
+            tree[node] = max(tree[2 * node], tree[2 * node + 1])
+            node //= 2
+    return bins
+
+def balance_bins(sizes, n_bins, max_size, max_files):
+    """
+    Largest-first assignment of items to the least loaded of n_bins bins (LPT), which
+    evens out batch sizes. Items larger than max_size get a bin of their own.
+    Returns the bin number of each item, or None if a bin would exceed the limits.
+    """
+    sizes = np.asarray(sizes, dtype=float)
+    bins = np.zeros(len(sizes), dtype=np.int64)
+    order = np.argsort(-sizes, kind="stable")
+    n_large = int((sizes > max_size).sum())
+    bins[order[:n_large]] = np.arange(n_large)
+    heap = [(0.0, b) for b in range(n_large, n_large + n_bins)]
+    counts = [0] * (n_large + n_bins)
+    for item in order[n_large:]:
+        if not heap:
+            return None
+        load, b = heapq.heappop(heap)
+        load += sizes[item]
+        if load > max_size:
+            return None
+        bins[item] = b
+        counts[b] += 1
+        if counts[b] < max_files:
+            heapq.heappush(heap, (load, b))
+    return bins
+
+def pack_sizes(sizes, max_size, max_files):
+    """
+    Bin numbers for items of the given sizes under both limits: first-fit-decreasing
+    fixes the number of batches, then LPT balances the sizes over that many batches
+    (a few more if needed). Falls back to the first-fit-decreasing result.
+    """
+    ffd = first_fit_decreasing(sizes, max_size, max_files)
+    if len(ffd) == 0:
+        return ffd
+    n_bins = int(ffd.max()) + 1 - int((np.asarray(sizes, dtype=float) > max_size).sum())
+    for extra in range(3):
+        balanced = balance_bins(sizes, n_bins + extra, max_size, max_files)
+        if balanced is not None:
+            return balanced
+    return ffd
+
+def print_imbalance(batch_sizes_mb):
+    """Prints (and returns) the size spread of the planned batches."""
+    sizes = np.asarray(batch_sizes_mb, dtype=float)
+    if len(sizes) == 0:
+        return ""
+    mean = sizes.mean()
+    text = (f"Batches: {len(sizes)} | size min {sizes.min():.2f} MB, mean {mean:.2f} MB, "
+            f"max {sizes.max():.2f} MB | max/mean {sizes.max() / mean if mean else 0:.2f} | "
+            f"CV {sizes.std() / mean if mean else 0:.2f}")
+    print(f"  ⚖️  {text}")
+    return text
+
+def assign_batches(rows, batch_idx, seq_bin, sub_batch, batch_dir):
+    """
+    Adds the seq_bin, sub_batch and batch_dir columns to rows, taking the values of
+    batch batch_idx[k] (positions in the per-batch sequences) for row k.
+    """
+    batch_idx = np.asarray(batch_idx, dtype=np.int64)
+    return rows.assign(
+        seq_bin=np.asarray(seq_bin, dtype=object)[batch_idx],
+        sub_batch=np.asarray(sub_batch, dtype=np.int64)[batch_idx],
+        batch_dir=np.asarray(batch_dir, dtype=object)[batch_idx],
+    )
+
+def concat_plans(parts, df):
+    """Single concat of the plan parts (an empty plan with the same columns if there are none)."""
+    if not parts:
+        return assign_batches(df.iloc[0:0], [], [], [], [])
+    return pd.concat(parts, ignore_index=True)
+
+def make_length_batches(df, output_base):
+    """
+    Original planner: 4 fixed batches for ≤600 aa and 50-aa bins beyond, cut in chunks
+    of MAX_PDBS_PER_BATCH. Returns the plan: the rows of df in batch order, with
+    seq_bin, sub_batch and batch_dir columns.
+    """
+    parts = []
 
     # ============================================================
     # PART 1: FIXED 4 BATCHES FOR ≤600 AA
@@ -102,32 +369,20 @@ for parent in parent_folders:
 
     df_small = df[df["avg_length"] <= 600]
     if not df_small.empty:
-        n = len(df_small)
-        splits = np.array_split(df_small, 4)
-        for i, subset in enumerate(splits, 1):
-            batch_name = f"batch_{i}"
-            batch_dir = os.path.join(output_base, batch_name)
-            print(f"  -> {batch_name}: {len(subset)} files ({subset['avg_length'].min():.0f}–{subset['avg_length'].max():.0f} aa)")
-            move_batch_files(subset, batch_dir, log_path)
-
-            batch_folder_rel = os.path.relpath(batch_dir, start=parent)
-
-            summary_records.append({
-                "seq_bin": f"≤600_small_{i}",
-                "sub_batch": 1,
-                "n_files": len(subset),
-                "total_size_MB": subset["size_MB"].sum(),
-                "avg_length": subset["avg_length"].mean(),
-                "batch_folder": batch_folder_rel
-            })
-
-            for _, row in subset.iterrows():
-                batch_records.append({
-                    "seq_bin": f"≤600_small_{i}",
-                    "sub_batch": 1,
-                    "file": row["file"],
-                    "source_pdb_folder": row["source_pdb_folder"]
-                })
+        # With fewer than 4 PDBs some batches are empty: they are printed, but the plan
+        # has no rows for them, so no folder or summary row is created (the script before
+        # the plan refactor created empty folders with a 0-file summary row)
+        counts = [len(ix) for ix in np.array_split(np.arange(len(df_small)), 4)]
+        ends = np.cumsum(counts)
+        lengths = df_small["avg_length"].to_numpy()
+        for i, (count, end) in enumerate(zip(counts, ends), start=1):
+            subset = lengths[end - count:end]
+            print(f"  -> batch_{i}: {count} files ({subset.min() if count else np.nan:.0f}–{subset.max() if count else np.nan:.0f} aa)")
+        parts.append(assign_batches(
+            df_small, np.repeat(np.arange(4), counts),
+            [f"≤600_small_{i}" for i in range(1, 5)], [1] * 4,
+            [os.path.join(output_base, f"batch_{i}") for i in range(1, 5)],
+        ))
     else:
         print("  No proteins ≤600 aa found.")
 
@@ -137,94 +392,265 @@ for parent in parent_folders:
     print_subheader("Automatic binning for >600 aa")
 
     df_large = df[df["avg_length"] > 600]
-    df_large["seq_bin"] = pd.cut(df_large["avg_length"], bins=bins_edges, labels=seq_labels, right=True)
-
-    for bin_label in seq_labels:
-        df_bin = df_large[df_large["seq_bin"] == bin_label]
-        if df_bin.empty:
-            continue
+    codes = pd.cut(df_large["avg_length"], bins=bins_edges, labels=seq_labels, right=True).cat.codes.to_numpy()
+    order = np.argsort(codes, kind="stable")
+    order = order[codes[order] >= 0]
+    df_large, codes = df_large.iloc[order], codes[order]
+
+    if len(codes):
+        # Position of each row within its 50-aa bin -> chunk of MAX_PDBS_PER_BATCH
+        bin_starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+        bin_counts = np.diff(np.r_[bin_starts, len(codes)])
+        chunk = (np.arange(len(codes)) - np.repeat(bin_starts, bin_counts)) // MAX_PDBS_PER_BATCH
+        n_chunks = np.repeat(-(-bin_counts // MAX_PDBS_PER_BATCH), bin_counts)
+
+        new_batch = np.r_[True, (codes[1:] != codes[:-1]) | (chunk[1:] != chunk[:-1])]
+        batch_starts = np.flatnonzero(new_batch)
+        batch_counts = np.diff(np.r_[batch_starts, len(codes)])
+        labels, sub_batches, dirs = [], [], []
+        for start, count in zip(batch_starts, batch_counts):
+            bin_label, i, n = seq_labels[codes[start]], int(chunk[start]) + 1, int(n_chunks[start])
+            if i == 1:
+                print(f"  Processing bin {bin_label} ({np.sum(codes == codes[start])} PDBs)")
+            safe_label = bin_label.replace(">", "gt").replace(" ", "")
+            part_name = f"batch_{safe_label}_part{i:02}" if n > 1 else f"batch_{safe_label}"
+            print(f"    Creating sub-batch {i}/{n} with {count} files")
+            labels.append(bin_label)
+            sub_batches.append(i)
+            dirs.append(os.path.join(output_base, part_name))
+        parts.append(assign_batches(df_large, np.cumsum(new_batch) - 1, labels, sub_batches, dirs))
+
+    return concat_plans(parts, df)
+
+def make_packed_batches(df, output_base, max_mb=MAX_BATCH_MB,
+                        max_files=MAX_BATCH_FILES, max_span=MAX_LENGTH_SPAN):
+    """
+    Size-balanced planner: PDBs are grouped into length ranges of at most max_span aa,
+    and each range is packed into batches of at most max_mb MB and max_files PDBs
+    (see pack_sizes). Returns the plan, as make_length_batches.
+    """
+    print_subheader(f"Packing batches (≤{max_mb} MB, ≤{max_files} files, "
+                    f"{f'length span ≤{max_span} aa' if max_span else 'any length span'})")
+    parts = []
+
+    lengths = df["avg_length"].to_numpy()
+    sizes = df["size_MB"].to_numpy()
+    for start, stop in length_groups(lengths, max_span):
+        # Batches numbered from 1 in bin order; rows keep their length order within a batch
+        _, bins = np.unique(pack_sizes(sizes[start:stop], max_mb, max_files), return_inverse=True)
+        order = np.argsort(bins, kind="stable")
+        group = df.iloc[start:stop].iloc[order]
+        n_parts = int(bins.max()) + 1
+        label = f"{lengths[start:stop].min():.0f}-{lengths[start:stop].max():.0f}"
+        print(f"  Length range {label} aa: {len(group)} PDBs in {n_parts} batches")
+
+        names = [f"batch_{label}_part{i:02}" if n_parts > 1 else f"batch_{label}" for i in range(1, n_parts + 1)]
+        parts.append(assign_batches(group, bins[order], [label] * n_parts, range(1, n_parts + 1),
+                                    [os.path.join(output_base, name) for name in names]))
+
+    return concat_plans(parts, df)
+
+def summarize_batches(plan, parent):
+    """
+    Assignment and summary tables of a plan (batches are runs of rows with the same
+    batch_dir). Sums are taken per batch slice, so values match pandas' Series.sum().
+    """
+    if plan.empty:
+        return pd.DataFrame(), pd.DataFrame()
+    assignment = plan[["seq_bin", "sub_batch", "file", "source_pdb_folder"]]
+
+    dirs = plan["batch_dir"].to_numpy()
+    starts = np.flatnonzero(np.r_[True, dirs[1:] != dirs[:-1]])
+    ends = np.r_[starts[1:], len(plan)]
+    sizes = plan["size_MB"].to_numpy()
+    lengths = plan["avg_length"].to_numpy()
+    summary = pd.DataFrame({
+        "seq_bin": plan["seq_bin"].to_numpy()[starts],
+        "sub_batch": plan["sub_batch"].to_numpy()[starts],
+        "n_files": ends - starts,
+        "total_size_MB": [sizes[a:b].sum() for a, b in zip(starts, ends)],
+        "avg_length": [lengths[a:b].sum(dtype=np.float64) / (b - a) for a, b in zip(starts, ends)],
+        "batch_folder": [os.path.relpath(d, start=parent) for d in dirs[starts]],
+    })
+    return assignment, summary
+
+def log_plan(log, summary, parent, planner, max_mb, max_files, max_span, imbalance):
+    """Records the plan and one batch event per batch of the summary table."""
+    log.info("plan", parent=parent, planner=planner, max_mb=max_mb, max_files=max_files, max_span=max_span,
+             imbalance=imbalance, batches=len(summary))
+    for s in summary.to_dict("records"):
+        log.info("batch", seq_bin=s["seq_bin"], sub_batch=int(s["sub_batch"]), n_files=int(s["n_files"]),
+                 total_size_MB=float(s["total_size_MB"]), avg_length=float(s["avg_length"]),
+                 batch_folder=s["batch_folder"])
+
+def render_report(records):
+    """Text of the batch report (batch_report_by_length.txt) from plan and batch events."""
+    lines = []
+    for r in records:
+        if r["event"] == "plan":
+            if r["planner"] == "packed":
+                span = f"length span ≤{r['max_span']} aa" if r["max_span"] else "any length span"
+                lines.append(f"Batch generation report (size-balanced: ≤{r['max_mb']} MB, ≤{r['max_files']} files, "
+                             f"{span})\n")
+                lines.append(f"Parent folder: {r['parent']}\n")
+                lines.append(f"{r['imbalance']}\n\n")
+            else:
+                lines.append(f"Batch generation report (≤600 split in 4 fixed batches + 50-aa bins beyond 600)\n")
+                lines.append(f"Parent folder: {r['parent']}\n\n")
+        elif r["event"] == "batch":
+            lines.append(f"  Bin {r['seq_bin']} - part {r['sub_batch']:02}: {r['n_files']} files | "
+                         f"{r['total_size_MB']:.2f} MB | Avg len {r['avg_length']:.1f} aa | "
+                         f"{r['batch_folder']}\n")
+    return lines
 
-        print(f"  Processing bin {bin_label} ({len(df_bin)} PDBs)")
-        n_chunks = int(np.ceil(len(df_bin) / MAX_PDBS_PER_BATCH))
-        df_chunks = [df_bin.iloc[i*MAX_PDBS_PER_BATCH:(i+1)*MAX_PDBS_PER_BATCH] for i in range(n_chunks)]
 
-        for i, df_part in enumerate(df_chunks, start=1):
-            safe_label = bin_label.replace(">", "gt").replace(" ", "")
-            part_name = f"batch_{safe_label}_part{i:02}" if n_chunks > 1 else f"batch_{safe_label}"
-            batch_dir = os.path.join(output_base, part_name)
-
-            print(f"    Creating sub-batch {i}/{n_chunks} with {len(df_part)} files")
-            move_batch_files(df_part, batch_dir, log_path)
-
-            batch_folder_rel = os.path.relpath(batch_dir, start=parent)
-
-            summary_records.append({
-                "seq_bin": bin_label,
-                "sub_batch": i,
-                "n_files": len(df_part),
-                "total_size_MB": df_part["size_MB"].sum(),
-                "avg_length": df_part["avg_length"].mean(),
-                "batch_folder": batch_folder_rel
-            })
-
-            for _, row in df_part.iterrows():
-                batch_records.append({
-                    "seq_bin": bin_label,
-                    "sub_batch": i,
-                    "file": row["file"],
-                    "source_pdb_folder": row["source_pdb_folder"]
-                })
+# ============================================================
+# MAIN PROCESSING LOOP
+# ============================================================
 
-    # ============================================================
-    # SAVE RESULTS
-    # ============================================================
-    assignment_tsv = os.path.join(output_base, "batch_assignment_by_length.tsv")
-    summary_tsv = os.path.join(output_base, "batch_summary_by_length.tsv")
-    report_txt = os.path.join(output_base, "batch_report_by_length.txt")
+def main(planner=PLANNER, max_mb=MAX_BATCH_MB, max_files=MAX_BATCH_FILES, max_span=MAX_LENGTH_SPAN,
+         plan_only=False, strategy=MATERIALIZE, undo=False, event_log=EVENT_LOG_NAME, log_level=LOG_LEVEL,
+         quiet=False, verbose=False):
+    def open_log(output_base):
+        # One event log per batches folder; a relative event_log is taken from it
+        path = os.path.join(output_base, event_log) if event_log and os.path.isdir(output_base) else None
+        return EventLog(path, level=log_level, quiet=quiet, verbose=verbose)
+
+    for parent in parent_folders:
+        print_header(f"Processing parent folder: {parent}")
+
+        results_dir = os.path.join(parent, "results")
+        os.makedirs(results_dir, exist_ok=True)
+        output_base = os.path.join(results_dir, "batches_by_length")
+
+        if undo:
+            print_subheader("Undoing the placement of batch files")
+            with open_log(output_base) as log:
+                undo_materialization(output_base, log)
+            continue
 
-    pd.DataFrame(batch_records).to_csv(assignment_tsv, sep="\t", index=False)
-    pd.DataFrame(summary_records).to_csv(summary_tsv, sep="\t", index=False)
+        # Detect completed folder
+        completed_dirs = [os.path.join(parent, d) for d in os.listdir(parent) if d.startswith("completed_")]
+        if not completed_dirs:
+            print(f"⚠️  No completed_* folder found. Skipping {parent}.")
+            continue
+        completed_folder = completed_dirs[0]
 
-    with open(report_txt, "w") as rpt:
-        rpt.write(f"Batch generation report (≤600 split in 4 fixed batches + 50-aa bins beyond 600)\n")
-        rpt.write(f"Parent folder: {parent}\n\n")
-        for s in summary_records:
-            rpt.write(f"  Bin {s['seq_bin']} - part {s['sub_batch']:02}: {s['n_files']} files | "
-                      f"{s['total_size_MB']:.2f} MB | Avg len {s['avg_length']:.1f} aa | "
-                      f"{s['batch_folder']}\n")
+        # Find TSV
+        main_name = os.path.basename(parent)
+        tsv_path = os.path.join(results_dir, f"{main_name}_ensemble_analysis.tsv")
+        if not os.path.exists(tsv_path):
+            print(f"⚠️  Missing TSV file: {tsv_path}. Skipping.")
+            continue
 
-    # ============================================================
-    # PLOTS
-    # ============================================================
-    if summary_records:
-        df_summary = pd.DataFrame(summary_records)
-        df_summary["x_label"] = df_summary.apply(
-            lambda x: f"{x['seq_bin']}_p{x['sub_batch']}"
-            if len(df_summary[df_summary['seq_bin'] == x['seq_bin']]) > 1
-            else f"{x['seq_bin']}",
-            axis=1
-        )
-
-        # --- Total size plot ---
-        plt.figure(figsize=(12, 5))
-        plt.bar(df_summary["x_label"], df_summary["total_size_MB"])
-        plt.xticks(rotation=90, fontsize=7)
-        plt.ylabel("Total size (MB)")
-        plt.title("Total batch size per sequence-length range")
-        plt.tight_layout()
-        plt.savefig(os.path.join(output_base, "batch_sizes_by_length.png"), dpi=200)
-        plt.close()
-
-        # --- Count plot ---
-        plt.figure(figsize=(12, 5))
-        plt.bar(df_summary["x_label"], df_summary["n_files"])
-        plt.xticks(rotation=90, fontsize=7)
-        plt.ylabel("# of PDBs")
-        plt.title("Number of PDBs per batch")
-        plt.tight_layout()
-        plt.savefig(os.path.join(output_base, "batch_counts_by_length.png"), dpi=200)
-        plt.close()
-
-    print(f"\n✅ Done! Output saved in: {output_base}")
-
-print("\n🎉 All parent folders processed successfully.")
+        os.makedirs(output_base, exist_ok=True)
+        log = open_log(output_base)
+        log.info("parent_start", f"📄  Ensemble TSV: {tsv_path}\n📂  PDB source:  {completed_folder}",
+                 parent=parent, tsv=tsv_path, source=completed_folder)
+
+        # Load TSV
+        df = pd.read_csv(tsv_path, sep="\t")
+        df["source_pdb_folder"] = completed_folder
+        df = df.sort_values("avg_length").reset_index(drop=True)
+
+        with metrics.timer("batch_step_seconds", step="plan"):
+            if planner == "packed":
+                plan = make_packed_batches(df, output_base, max_mb=max_mb, max_files=max_files, max_span=max_span)
+            else:
+                plan = make_length_batches(df, output_base)
+            assignment, summary = summarize_batches(plan, parent)
+        metrics.count("pdbs_total", len(plan), result="planned")
+        imbalance = print_imbalance(summary["total_size_MB"] if len(summary) else [])
+
+        # ============================================================
+        # SAVE RESULTS
+        # ============================================================
+        assignment_tsv = os.path.join(output_base, "batch_assignment_by_length.tsv")
+        summary_tsv = os.path.join(output_base, "batch_summary_by_length.tsv")
+        report_txt = os.path.join(output_base, "batch_report_by_length.txt")
+
+        assignment.to_csv(assignment_tsv, sep="\t", index=False)
+        summary.to_csv(summary_tsv, sep="\t", index=False)
+
+        log_plan(log, summary, parent, planner, max_mb, max_files, max_span, imbalance)
+        with open(report_txt, "w") as rpt:
+            rpt.writelines(render_report(log.records))
+
+        # ============================================================
+        # PLACE FILES
+        # ============================================================
+        if plan_only:
+            log.info("plan_only", f"\n📝 Plan only: assignment written to {assignment_tsv}, no files placed",
+                     assignment=assignment_tsv)
+        else:
+            log.info("materialize", "\n--- Placing files in batch folders ---", strategy=strategy)
+            with metrics.timer("batch_step_seconds", step="materialize"):
+                materialize_batches(plan, output_base, log, strategy=strategy)
+
+        # ============================================================
+        # PLOTS
+        # ============================================================
+        if len(summary):
+            df_summary = summary.copy()
+            parts_per_bin = df_summary.groupby("seq_bin")["seq_bin"].transform("size")
+            df_summary["x_label"] = df_summary["seq_bin"].where(
+                parts_per_bin == 1, df_summary["seq_bin"] + "_p" + df_summary["sub_batch"].astype(str)
+            )
+
+            # --- Total size plot ---
+            plt.figure(figsize=(12, 5))
+            plt.bar(df_summary["x_label"], df_summary["total_size_MB"])
+            plt.xticks(rotation=90, fontsize=7)
+            plt.ylabel("Total size (MB)")
+            plt.title("Total batch size per sequence-length range")
+            plt.tight_layout()
+            plt.savefig(os.path.join(output_base, "batch_sizes_by_length.png"), dpi=200)
+            plt.close()
+
+            # --- Count plot ---
+            plt.figure(figsize=(12, 5))
+            plt.bar(df_summary["x_label"], df_summary["n_files"])
+            plt.xticks(rotation=90, fontsize=7)
+            plt.ylabel("# of PDBs")
+            plt.title("Number of PDBs per batch")
+            plt.tight_layout()
+            plt.savefig(os.path.join(output_base, "batch_counts_by_length.png"), dpi=200)
+            plt.close()
+
+        log.info("parent_end", f"\n✅ Done! Output saved in: {output_base}", output=output_base)
+        log.close()
+
+    print("\n🎉 All parent folders processed successfully.")
+
+
+def add_arguments(parser):
+    parser.add_argument("--planner", choices=["length", "packed"], default=PLANNER,
+                        help=f"length: 4 batches ≤600 aa + 50-aa bins; packed: size-balanced batches (default: {PLANNER})")
+    parser.add_argument("--max-mb", type=float, default=MAX_BATCH_MB,
+                        help=f"packed: maximum total size of a batch in MB (default: {MAX_BATCH_MB})")
+    parser.add_argument("--max-files", type=int, default=MAX_BATCH_FILES,
+                        help=f"packed: maximum PDBs per batch (default: {MAX_BATCH_FILES})")
+    parser.add_argument("--max-length-span", type=float, default=MAX_LENGTH_SPAN,
+                        help=f"packed: maximum length range within a batch in aa, 0 = no limit (default: {MAX_LENGTH_SPAN})")
+    parser.add_argument("--plan-only", action="store_true",
+                        help="Write the assignment/summary/report and plots without placing any file")
+    parser.add_argument("--strategy", choices=["auto"] + list(MATERIALIZE_OPS), default=MATERIALIZE,
+                        help=f"How PDBs are placed in the batch folders (default: {MATERIALIZE})")
+    parser.add_argument("--undo", action="store_true",
+                        help="Roll back the files placed by previous runs (undo journal)")
+    add_log_arguments(parser, EVENT_LOG_NAME)
+    metrics.add_metrics_arguments(parser)
+
+
+def run(args):
+    with metrics.session(args, "batches_generation"):
+        main(planner=args.planner, max_mb=args.max_mb, max_files=args.max_files,
+             max_span=args.max_length_span or None, plan_only=args.plan_only, strategy=args.strategy,
+             undo=args.undo, event_log=args.event_log, log_level=args.log_level, quiet=args.quiet,
+             verbose=args.verbose)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Split analyzed PDB ensembles into upload batches.")
+    add_arguments(parser)
+    run(parser.parse_args())
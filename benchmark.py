@@ -0,0 +1,623 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Deposition benchmarks
+---------------------
+Measures each stage of the deposition workflow on synthetic IDP ensembles, against
+local mock UniProt / DisProt / PED servers, so runs are comparable across commits
+and machines without touching the real services.
+
+    synth       write synthetic ensemble PDBs (configurable length, models, chains)
+    run         time the stages and append the results to BENCHMARK_RESULTS
+    compare     print the last runs side by side, with the change between the last two
+
+Stages (--stages, default all):
+
+    construct   chain sequences of the first model (construct.py)
+    analyze     size and first-model length (anylisis_ensembles.analyze_pdb)
+    index       full ensemble scan (ensemble_index.scan_ensemble)
+    planner     packed and length batch plans of --planner-rows synthetic rows
+    generate    json_generation.py against the UniProt / DisProt mocks
+    submit      Job-description-PED.py against the PED mock
+    constructs  construct-post-PED.py against the PED mock
+    pipeline    deposit_pipeline.py against all the mocks
+
+Every stage runs in a fresh process, so the reported peak RSS is the stage's own
+(process pools started by a stage are reported separately). Throughput is files/s
+and MB/s of PDB data. Mock latency is injectable (--latency, per request); the mocks
+get the HOST_RATES limits of the real services unless --no-rate-limit is given.
+Script output is discarded unless --verbose is given.
+
+Usage:
+    python benchmark.py synth <folder> [--files N] [--length 50-2500] [--models N] [--chains N]
+    python benchmark.py run [--folder DIR] [--stages analyze,index] [--latency 0.05] [--label TEXT]
+    python benchmark.py compare [--last N]
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import random
+import argparse
+import platform
+import resource
+import tempfile
+import threading
+import subprocess
+import contextlib
+import multiprocessing
+from datetime import datetime
+from urllib.parse import urlparse, parse_qs
+from concurrent.futures import ProcessPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+
+# === CONFIGURATION ===
+BENCHMARK_RESULTS = "benchmark_results.jsonl"   # one JSON record per run
+BENCHMARK_FOLDER = "benchmark_data"             # synthetic PDBs (reused while the parameters match)
+STAGES = ["construct", "analyze", "index", "planner", "generate", "submit", "constructs", "pipeline"]
+
+SYNTH_FILES = 40
+SYNTH_LENGTH = (50, 2500)   # residues per chain, drawn uniformly per file
+SYNTH_MODELS = 20
+SYNTH_CHAINS = 1
+SYNTH_SEED = 0
+PLANNER_ROWS = 100000
+MOCK_LATENCY = 0.0          # seconds added to every mock response
+
+AMINO_ACIDS = ["ALA", "ARG", "ASN", "ASP", "CYS", "GLN", "GLU", "GLY", "HIS", "ILE",
+               "LEU", "LYS", "MET", "PHE", "PRO", "SER", "THR", "TRP", "TYR", "VAL"]
+BACKBONE_BONDS = [1.46, 1.52, 1.33]   # N-CA, CA-C, C-N(next) in Å
+CHAIN_IDS = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+SPEC_NAME = "benchmark_spec.json"     # parameters of a synthetic folder
+
+
+# === SYNTHETIC ENSEMBLES ===
+def backbone_trace(n_residues, rng):
+    """
+    Random-coil backbone: (N, CA, C, O, CB) coordinates of n_residues residues,
+    shape (n_residues, 5, 3). Bonds have their ideal lengths, so consecutive
+    residues are connected (C-N 1.33 Å) for the peptide builders.
+    """
+    steps = rng.normal(size=(3 * n_residues, 3))
+    steps /= np.linalg.norm(steps, axis=1, keepdims=True)
+    steps *= np.tile(BACKBONE_BONDS, n_residues)[:, None]
+    chain = np.vstack([np.zeros((1, 3)), np.cumsum(steps, axis=0)[:-1]]).reshape(n_residues, 3, 3)
+
+    side = rng.normal(size=(n_residues, 2, 3))
+    side /= np.linalg.norm(side, axis=2, keepdims=True)
+    oxygen = chain[:, 2] + 1.23 * side[:, 0]
+    beta = chain[:, 1] + 1.53 * side[:, 1]
+    return np.concatenate([chain, oxygen[:, None], beta[:, None]], axis=1)
+
+
+def write_ensemble(path, length, n_models=SYNTH_MODELS, n_chains=SYNTH_CHAINS, seed=SYNTH_SEED):
+    """
+    Writes a synthetic ensemble PDB: n_models MODEL blocks of n_chains chains of
+    `length` residues (backbone + CB). Models are perturbed copies of the first one.
+    Returns the file size in bytes.
+    """
+    rng = np.random.default_rng(seed)
+    prefixes = []     # atom line text from the atom name to the residue number
+    elements = []
+    coords = []
+    chain_ends = set()  # index of the last atom of each chain (followed by TER)
+    for c in range(n_chains):
+        chain_id = CHAIN_IDS[c % len(CHAIN_IDS)]
+        residues = rng.choice(AMINO_ACIDS, size=length)
+        trace = backbone_trace(length, rng) + [40.0 * c, 0.0, 0.0]
+        keep = np.ones((length, 5), dtype=bool)
+        keep[residues == "GLY", 4] = False  # glycines have no CB
+        for i, resname in enumerate(residues):
+            for name in ("N", "CA", "C", "O", "CB")[:5 if keep[i, 4] else 4]:
+                prefixes.append(f"  {name:<3} {resname} {chain_id}{i + 1:4d}    ")
+                elements.append(name[0])
+        coords.append(trace[keep])
+        chain_ends.add(len(prefixes) - 1)
+    coords = np.vstack(coords)
+
+    with open(path, "w") as f:
+        for model in range(1, n_models + 1):
+            xyz = coords if model == 1 else coords + rng.normal(scale=0.5, size=coords.shape)
+            lines = [f"MODEL     {model:4d}\n"]
+            for j, (prefix, element, (x, y, z)) in enumerate(zip(prefixes, elements, xyz)):
+                lines.append(f"ATOM  {j + 1:5d}{prefix}{x:8.3f}{y:8.3f}{z:8.3f}  1.00  0.00           {element}\n")
+                if j in chain_ends:
+                    lines.append("TER\n")
+            lines.append("ENDMDL\n")
+            f.write("".join(lines))
+        f.write("END\n")
+    return os.path.getsize(path)
+
+
+def synth_filename(i, n_models):
+    """Accession-like UniProt ID (the first field, as in the real names) and alternating IDPCG / IDPForge workflows."""
+    workflow = "idpcg" if i % 2 == 0 else "idpforge"
+    return f"BM{i:05d}_{workflow}_n{n_models}.pdb"
+
+
+def synthesize(folder, n_files=SYNTH_FILES, length=SYNTH_LENGTH, n_models=SYNTH_MODELS,
+               n_chains=SYNTH_CHAINS, seed=SYNTH_SEED):
+    """
+    Writes n_files synthetic ensembles to folder, unless it already holds the same set
+    (same parameters in SPEC_NAME). Returns the parameters.
+    """
+    spec = {"files": n_files, "length": list(length), "models": n_models, "chains": n_chains, "seed": seed}
+    spec_path = os.path.join(folder, SPEC_NAME)
+    if os.path.exists(spec_path):
+        with open(spec_path) as f:
+            if json.load(f) == spec:
+                print(f"♻️  Reusing {n_files} synthetic ensembles in {folder}")
+                return spec
+    elif os.path.isdir(folder) and any(f.endswith(".pdb") for f in os.listdir(folder)):
+        raise ValueError(f"{folder} holds PDBs that were not written by this script")
+    os.makedirs(folder, exist_ok=True)
+    for f in os.listdir(folder):
+        if f.endswith(".pdb"):
+            os.remove(os.path.join(folder, f))
+
+    rng = random.Random(seed)
+    lengths = [rng.randint(length[0], length[1]) for _ in range(n_files)]
+    start = time.perf_counter()
+    total = 0
+    for i, n in enumerate(lengths):
+        total += write_ensemble(os.path.join(folder, synth_filename(i, n_models)), n,
+                                n_models=n_models, n_chains=n_chains, seed=seed + i)
+    with open(spec_path, "w") as f:
+        json.dump(spec, f)
+    print(f"🧬 {n_files} synthetic ensembles ({length[0]}-{length[1]} aa, {n_models} models, "
+          f"{n_chains} chains): {total / 1024**2:.1f} MB in {time.perf_counter() - start:.1f} s")
+    return spec
+
+
+# === MOCK SERVERS ===
+class MockHandler(BaseHTTPRequestHandler):
+    """JSON API mock; `latency` seconds are added to every response."""
+    protocol_version = "HTTP/1.1"
+    latency = 0.0
+
+    def log_message(self, *args):
+        pass
+
+    def read_body(self):
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            size = 0
+            while True:
+                n = int(self.rfile.readline().strip(), 16)
+                if n == 0:
+                    self.rfile.readline()
+                    return size
+                size += len(self.rfile.read(n))
+                self.rfile.readline()
+        data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        return data
+
+    def send_json(self, code, obj):
+        body = json.dumps(obj).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        self.send_json(*self.get(urlparse(self.path)))
+
+    def do_POST(self):
+        body = self.read_body()
+        time.sleep(self.latency)
+        self.send_json(*self.post(self.path, body))
+
+    def get(self, url):
+        return 404, {}
+
+    def post(self, path, body):
+        return 404, {}
+
+
+def uniprot_entry(accession):
+    return {"primaryAccession": accession,
+            "proteinDescription": {"recommendedName": {"fullName": {"value": f"Synthetic protein {accession}"}}}}
+
+
+class UniProtMock(MockHandler):
+    """Every accession is an active entry."""
+
+    def get(self, url):
+        if url.path == "/uniprotkb/stream":
+            accessions = re.findall(r"accession:(\w+)", parse_qs(url.query)["query"][0])
+            return 200, {"results": [uniprot_entry(a) for a in accessions]}
+        m = re.match(r"/uniprotkb/(\w+)\.json$", url.path)
+        if m:
+            return 200, uniprot_entry(m.group(1))
+        return 404, {}
+
+
+class DisProtMock(MockHandler):
+    """Accessions with an even number are in DisProt."""
+
+    def get(self, url):
+        m = re.match(r"/api/\D*(\d+)$", url.path)
+        if m and int(m.group(1)) % 2 == 0:
+            return 200, {"disprot_id": f"DP{int(m.group(1)):05d}"}
+        return 404, {}
+
+
+class PEDMock(MockHandler):
+    """Drafts, descriptions, ensemble uploads (finished at once) and constructs."""
+    drafts = None   # draft_id -> uploaded bytes; set per server
+    lock = None
+
+    def post(self, path, body):
+        if path.endswith("/drafts"):
+            with self.lock:
+                draft_id = f"PEDB{len(self.drafts) + 1:05d}"
+                self.drafts[draft_id] = 0
+            return 200, {"draft_id": draft_id}
+        m = re.match(r".*/drafts/(\w+)/(description|ensembles|chains)$", path)
+        if not m or m.group(1) not in self.drafts:
+            return 404, {"error": "not found"}
+        draft_id, kind = m.groups()
+        if kind == "ensembles":
+            self.drafts[draft_id] = body if isinstance(body, int) else len(body)
+            return 200, {"job": {"job_id": f"job-{draft_id}", "status": "job queued"}}
+        return 200, {"ok": True}
+
+    def get(self, url):
+        m = re.match(r".*/drafts/(\w+)/ensembles/e001$", url.path)
+        if m and m.group(1) in self.drafts:
+            return 200, {"job": {"job_id": f"job-{m.group(1)}", "status": "job finished normally"}}
+        return 404, {}
+
+
+def start_mock(handler, latency=MOCK_LATENCY):
+    """Starts a mock server on a free local port; returns (server, base_url)."""
+    attributes = {"latency": latency}
+    if handler is PEDMock:
+        attributes.update(drafts={}, lock=threading.Lock())
+    server = ThreadingHTTPServer(("127.0.0.1", 0), type(handler.__name__, (handler,), attributes))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+# === STAGES (run in a fresh process each) ===
+def pdb_paths(folder):
+    return [os.path.join(folder, f) for f in sorted(os.listdir(folder)) if f.endswith(".pdb")]
+
+
+def use_mocks(urls, rate_limit):
+    """Points description.py at the mocks (with the real services' rate limits) and disables the metadata cache."""
+    import http_utils
+    import description
+    import metadata_cache
+    description.UNIPROT_URL = urls["uniprot"]
+    description.DISPROT_URL = urls["disprot"]
+    metadata_cache.CACHE_PATH = ""
+    for mock, host in (("uniprot", "rest.uniprot.org"), ("disprot", "disprot.org")):
+        http_utils.HOST_RATES[urlparse(urls[mock]).netloc] = http_utils.HOST_RATES[host] if rate_limit else 1e9
+
+
+def write_inputs(paths, desc_folder=None, construct_folder=None):
+    """Description / construct JSONs of the PDBs, as json_generation.py writes them (not timed)."""
+    from description import create_description_json
+    from construct import get_chain_sequences_and_last_residues, create_construct_json
+    for path in paths:
+        base = os.path.splitext(os.path.basename(path))[0]
+        uniprot_id = base.split("_")[0]
+        if desc_folder:
+            os.makedirs(desc_folder, exist_ok=True)
+            with open(os.path.join(desc_folder, f"{base}.json"), "w") as f:
+                json.dump(create_description_json(uniprot_id), f, indent=4)
+        if construct_folder:
+            os.makedirs(construct_folder, exist_ok=True)
+            construct = create_construct_json(get_chain_sequences_and_last_residues(path),
+                                              uniprot_id, f"Synthetic protein {uniprot_id}")
+            with open(os.path.join(construct_folder, f"{base}_const.json"), "w") as f:
+                json.dump(construct, f, indent=4)
+
+
+def stage_construct(paths, workdir, urls, options):
+    from construct import get_chain_sequences_and_last_residues
+    start = time.perf_counter()
+    for path in paths:
+        get_chain_sequences_and_last_residues(path)
+    return time.perf_counter() - start
+
+
+def stage_analyze(paths, workdir, urls, options):
+    from anylisis_ensembles import analyze_pdb
+    start = time.perf_counter()
+    for path in paths:
+        analyze_pdb(path)
+    return time.perf_counter() - start
+
+
+def stage_index(paths, workdir, urls, options):
+    from ensemble_index import scan_ensemble
+    start = time.perf_counter()
+    for path in paths:
+        scan_ensemble(path)
+    return time.perf_counter() - start
+
+
+def stage_planner(paths, workdir, urls, options):
+    import pandas as pd
+    import batches_generation as bg
+    rng = np.random.default_rng(SYNTH_SEED)
+    n = options["planner_rows"]
+    df = pd.DataFrame({
+        "file": [f"BM{i:07d}.pdb" for i in range(n)],
+        "size_MB": rng.lognormal(3, 1.5, n),
+        "avg_length": rng.integers(SYNTH_LENGTH[0], SYNTH_LENGTH[1] + 1, n),
+        "source_pdb_folder": workdir,
+    }).sort_values("avg_length").reset_index(drop=True)
+    output_base = os.path.join(workdir, "batches_by_length")
+    start = time.perf_counter()
+    for plan in (bg.make_packed_batches(df, output_base), bg.make_length_batches(df, output_base)):
+        bg.summarize_batches(plan, workdir)
+    return time.perf_counter() - start
+
+
+def stage_generate(paths, workdir, urls, options):
+    import json_generation
+    use_mocks(urls, options["rate_limit"])
+    json_generation.pdb_folders = [options["folder"]]
+    json_generation.base_desc_folder = os.path.join(workdir, "json_description")
+    json_generation.base_construct_folder = os.path.join(workdir, "json_construct")
+    json_generation.summary_path = os.path.join(workdir, "summary_json_generation.txt")
+    json_generation.merged_list_path = os.path.join(workdir, "merged_pdb_list.txt")
+    start = time.perf_counter()
+    json_generation.main(workers=options["workers"], force=True,
+                         event_log=os.path.join(workdir, "json_generation_events.jsonl"))
+    return time.perf_counter() - start
+
+
+def stage_submit(paths, workdir, urls, options):
+    from ped_deposit import load_script
+    job = load_script("Job-description-PED.py")
+    job.url = urls["ped"]
+    job.pdb_folder = options["folder"]
+    job.desc_folder = os.path.join(workdir, "desc")
+    job.log_file = os.path.join(workdir, "job_tracking_log.csv")
+    job.tracking_db = os.path.join(workdir, "job_tracking.sqlite")
+    write_inputs(paths, desc_folder=job.desc_folder)
+    start = time.perf_counter()
+    job.main()
+    return time.perf_counter() - start
+
+
+def stage_constructs(paths, workdir, urls, options):
+    import requests
+    from ped_deposit import load_script
+    from tracking_store import open_store
+    post = load_script("construct-post-PED.py")
+    post.url = urls["ped"]
+    post.construct_folder = os.path.join(workdir, "const")
+    post.log_file = os.path.join(workdir, "job_tracking_log.csv")
+    post.tracking_db = os.path.join(workdir, "job_tracking.sqlite")
+    write_inputs(paths, construct_folder=post.construct_folder)
+    store = open_store(post.tracking_db, post.log_file)
+    for path in paths:
+        draft_id = requests.post(f"{urls['ped']}/drafts", timeout=60).json()["draft_id"]
+        store.add({"filename": os.path.basename(path), "draft_id": draft_id, "status": "job finished normally"})
+    start = time.perf_counter()
+    post.main()
+    return time.perf_counter() - start
+
+
+def stage_pipeline(paths, workdir, urls, options):
+    from ped_deposit import load_script
+    use_mocks(urls, options["rate_limit"])
+    pipeline = load_script("deposit_pipeline.py")
+    pipeline.url = urls["ped"]
+    pipeline.pdb_folders = [options["folder"]]
+    pipeline.log_file = os.path.join(workdir, "job_tracking_log.csv")
+    pipeline.tracking_db = os.path.join(workdir, "job_tracking.sqlite")
+    start = time.perf_counter()
+    pipeline.main(workers=options["workers"])
+    return time.perf_counter() - start
+
+
+def run_stage(stage, urls, options):
+    """Runs one stage in this (fresh) process; returns its measurements."""
+    paths = pdb_paths(options["folder"])
+    workdir = tempfile.mkdtemp(prefix=f"bench_{stage}_")
+    try:
+        with contextlib.ExitStack() as stack:
+            if not options["verbose"]:
+                devnull = stack.enter_context(open(os.devnull, "w"))
+                stack.enter_context(contextlib.redirect_stdout(devnull))
+            seconds = globals()[f"stage_{stage}"](paths, workdir, urls, options)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    n_files = options["planner_rows"] if stage == "planner" else len(paths)
+    n_bytes = None if stage == "planner" else sum(os.path.getsize(p) for p in paths)
+    return {
+        "files": n_files,
+        "mb": None if n_bytes is None else round(n_bytes / 1024**2, 3),
+        "seconds": round(seconds, 4),
+        "files_per_s": round(n_files / seconds, 2) if seconds > 0 else None,
+        "mb_per_s": round(n_bytes / 1024**2 / seconds, 2) if n_bytes is not None and seconds > 0 else None,
+        # ru_maxrss is in KiB on Linux, bytes on macOS
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                             / (1024**2 if sys.platform == "darwin" else 1024), 1),
+        "children_peak_rss_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+                                      / (1024**2 if sys.platform == "darwin" else 1024), 1),
+    }
+
+
+# === RESULTS ===
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_results(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def print_run(record):
+    def fmt(value, width):
+        return f"{value:>{width}.2f}" if value is not None else f"{'-':>{width}}"
+
+    print(f"\n📊 {record['time']}  commit {record['commit']}  {record['label'] or ''}")
+    print(f"  {'stage':<11} {'files':>7} {'MB':>9} {'s':>8} {'files/s':>10} {'MB/s':>9} {'RSS MB':>8}")
+    for stage, r in record["stages"].items():
+        if "error" in r:
+            print(f"  {stage:<11} ❌ {r['error']}")
+            continue
+        print(f"  {stage:<11} {r['files']:>7} {fmt(r['mb'], 9)} {fmt(r['seconds'], 8)} "
+              f"{fmt(r['files_per_s'], 10)} {fmt(r['mb_per_s'], 9)} {fmt(r['peak_rss_mb'], 8)}")
+
+
+def change(old, new):
+    if not old or new is None:
+        return "      -"
+    return f"{(new - old) / old * 100:+6.1f}%"
+
+
+def compare(records):
+    """Prints the records side by side, with the change of the last one against the previous."""
+    for record in records:
+        print_run(record)
+    if len(records) < 2:
+        return
+    prev, last = records[-2], records[-1]
+    if prev["params"] != last["params"]:
+        print("\n⚠️  The last two runs used different parameters:")
+        print(f"  {prev['params']}\n  {last['params']}")
+    print(f"\n🔁 Change {prev['commit']} → {last['commit']}")
+    print(f"  {'stage':<11} {'files/s':>8} {'MB/s':>8} {'RSS':>8}")
+    for stage, r in last["stages"].items():
+        p = prev["stages"].get(stage)
+        if p is None or "error" in p or "error" in r:
+            continue
+        print(f"  {stage:<11} {change(p['files_per_s'], r['files_per_s'])} "
+              f"{change(p['mb_per_s'], r['mb_per_s'])} {change(p['peak_rss_mb'], r['peak_rss_mb'])}")
+
+
+# === MAIN ===
+def parse_length(text):
+    """'50-2500' or '300' -> (min, max)."""
+    try:
+        lo, _, hi = text.partition("-")
+        lo, hi = int(lo), int(hi or lo)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"length must be N or MIN-MAX, got '{text}'")
+    if not 1 <= lo <= hi:
+        raise argparse.ArgumentTypeError(f"invalid length range '{text}'")
+    return lo, hi
+
+
+def add_synth_arguments(parser):
+    parser.add_argument("--files", type=int, default=SYNTH_FILES, help=f"Ensembles (default: {SYNTH_FILES})")
+    parser.add_argument("--length", type=parse_length, default=SYNTH_LENGTH, metavar="MIN-MAX",
+                        help=f"Residues per chain (default: {SYNTH_LENGTH[0]}-{SYNTH_LENGTH[1]})")
+    parser.add_argument("--models", type=int, default=SYNTH_MODELS, help=f"Models per ensemble (default: {SYNTH_MODELS})")
+    parser.add_argument("--chains", type=int, default=SYNTH_CHAINS, help=f"Chains per model (default: {SYNTH_CHAINS})")
+    parser.add_argument("--seed", type=int, default=SYNTH_SEED)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the deposition stages on synthetic ensembles.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    synth = commands.add_parser("synth", help="Write synthetic ensemble PDBs")
+    synth.add_argument("folder")
+    add_synth_arguments(synth)
+
+    bench = commands.add_parser("run", help="Time the stages and store the results")
+    bench.add_argument("--folder", default=BENCHMARK_FOLDER,
+                       help=f"Synthetic ensembles, (re)generated if needed (default: {BENCHMARK_FOLDER})")
+    add_synth_arguments(bench)
+    bench.add_argument("--stages", default=",".join(STAGES), help="Comma-separated stages (default: all)")
+    bench.add_argument("--latency", type=float, default=MOCK_LATENCY,
+                       help=f"Seconds added to every mock response (default: {MOCK_LATENCY})")
+    bench.add_argument("--no-rate-limit", action="store_true",
+                       help="Do not apply the real services' rate limits to the UniProt / DisProt mocks")
+    bench.add_argument("--workers", type=int, default=1, help="--workers of generate and pipeline (default: 1)")
+    bench.add_argument("--planner-rows", type=int, default=PLANNER_ROWS,
+                       help=f"Rows planned by the planner stage (default: {PLANNER_ROWS})")
+    bench.add_argument("--label", help="Free text stored with the results")
+    bench.add_argument("--results", default=BENCHMARK_RESULTS, help=f"Results file (default: {BENCHMARK_RESULTS})")
+    bench.add_argument("--verbose", action="store_true", help="Show the output of the scripts")
+
+    comp = commands.add_parser("compare", help="Compare stored runs")
+    comp.add_argument("--last", type=int, default=2, help="Runs shown (default: 2)")
+    comp.add_argument("--results", default=BENCHMARK_RESULTS)
+    args = parser.parse_args(argv)
+
+    if args.command == "compare":
+        records = load_results(args.results)
+        if not records:
+            print(f"⚠️  No results in {args.results}")
+            return 1
+        compare(records[-args.last:])
+        return 0
+
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()] if args.command == "run" else []
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))} (choose from {', '.join(STAGES)})")
+
+    try:
+        spec = synthesize(args.folder, args.files, args.length, args.models, args.chains, args.seed)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return 1
+    if args.command == "synth":
+        return 0
+
+    servers = {name: start_mock(handler, args.latency)
+               for name, handler in (("uniprot", UniProtMock), ("disprot", DisProtMock), ("ped", PEDMock))}
+    urls = {name: url for name, (_, url) in servers.items()}
+    urls["ped"] += "/v1"
+    options = {"folder": os.path.abspath(args.folder), "workers": args.workers, "planner_rows": args.planner_rows,
+               "rate_limit": not args.no_rate_limit, "verbose": args.verbose}
+
+    results = {}
+    for stage in stages:
+        print(f"⏱️  {stage}...")
+        # Spawned, not forked: the stage does not inherit this process's memory
+        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            try:
+                results[stage] = pool.submit(run_stage, stage, urls, options).result()
+            except Exception as e:
+                results[stage] = {"error": f"{type(e).__name__}: {e}"}
+    for server, _ in servers.values():
+        server.shutdown()
+
+    record = {
+        "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "label": args.label,
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "host": platform.node(),
+        "cpus": os.cpu_count(),
+        "params": {**spec, "latency": args.latency, "rate_limit": not args.no_rate_limit,
+                   "workers": args.workers, "planner_rows": args.planner_rows},
+        "stages": results,
+    }
+    with open(args.results, "a") as f:
+        f.write(json.dumps(record) + "\n")
+    print_run(record)
+    print(f"\n💾 Results appended to {args.results}")
+    return 1 if any("error" in r for r in results.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
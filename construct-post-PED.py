@@ -1,39 +1,106 @@
 import requests
-import json
 import os
-import pandas as pd
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import metrics
+from http_utils import request_with_retries, mount_pool
+from tracking_store import open_store, SUBMIT_ERROR
+from json_bundle import PayloadReader
 
 url = "http://127.0.0.1:4205/v1"
-log_file = "job_tracking_log.csv"
-construct_folder = "const_files"
-
-# Load the job tracking log
-df_log = pd.read_csv(log_file)
-
-for idx, row in df_log.iterrows():
-    pdb_filename = row["filename"]
-    draft_id = row["draft_id"]
-    base_name = os.path.splitext(pdb_filename)[0]
-    construct_filename = f"{base_name}_const.json"
-    construct_path = os.path.join(construct_folder, construct_filename)
-
-    if not os.path.exists(construct_path):
-        print(f"❌ Construct file not found for {pdb_filename}: {construct_path}")
-        continue
-
-    with open(construct_path, "r") as f:
-        construct_info = json.load(f)
-
-    # POST construct info to the draft's chains endpoint
-    try:
-        response = requests.post(
-            f"{url}/drafts/{draft_id}/chains",
-            json=construct_info
-        )
+log_file = "job_tracking_log.csv"     # seeds the tracking store if it does not exist yet
+tracking_db = "job_tracking.sqlite"
+construct_folder = "const_files"      # construct JSONs or bundles (json_bundle.py)
+
+MAX_IN_FLIGHT = 8      # construct posts sent concurrently
+POST_RETRIES = 3       # retries per post on connection errors, 429 and 5xx
+CONSTRUCT_POSTED = "posted"   # construct_status of drafts already done (skipped on re-runs)
+
+session = requests.Session()  # connection pool sized to --in-flight in main()
+
+
+def post_construct(draft_id, construct_info):
+    """POSTs the construct info to the draft's chains endpoint; raises for error responses."""
+    with metrics.timer("ped_stage_seconds", stage="chains"):
+        response = request_with_retries(session, "POST", f"{url}/drafts/{draft_id}/chains",
+                                        retries=POST_RETRIES, rate_limit=False, json=construct_info, timeout=60)
         response.raise_for_status()
-        print(f"✅ Posted construct for {pdb_filename} (draft {draft_id})")
-        print(response.json())
-    except requests.RequestException as e:
-        print(f"❌ Error posting construct for {pdb_filename}: {e}")
+    return response
+
+
+def main(in_flight=MAX_IN_FLIGHT, force=False):
+    mount_pool(session, in_flight)
+    store = open_store(tracking_db, log_file)
+
+    # Drafts to post, with their construct JSON
+    pending = []
+    n_done = 0
+    constructs = PayloadReader(construct_folder, "construct")
+    for row in store.rows():
+        pdb_filename = row["filename"]
+        draft_id = row["draft_id"]
+        if not draft_id or row["status"] == SUBMIT_ERROR:
+            continue  # no draft, or its ensemble upload failed (retried by Job-description-PED.py)
+        if row["construct_status"] == CONSTRUCT_POSTED and not force:
+            n_done += 1
+            continue
+
+        base_name = os.path.splitext(pdb_filename)[0]
+        if base_name not in constructs:
+            print(f"❌ Construct file not found for {pdb_filename}: {constructs.location(base_name)}")
+            continue
+
+        pending.append((pdb_filename, draft_id, constructs.load(base_name)))
+    constructs.close()
+
+    if n_done:
+        print(f"⏭️ Skipping {n_done} drafts with constructs already posted")
+    print(f"\n🚀 Posting {len(pending)} constructs ({in_flight} in flight)")
+    start = time.time()
+    n_posted = 0
+    progress = metrics.progress(len(pending), "constructs")
+
+    # Posts run concurrently; the tracking store is only written from this thread
+    with ThreadPoolExecutor(in_flight) as pool:
+        futures = {pool.submit(post_construct, draft_id, construct_info): (pdb_filename, draft_id)
+                   for pdb_filename, draft_id, construct_info in pending}
+        for future in as_completed(futures):
+            pdb_filename, draft_id = futures[future]
+            try:
+                future.result()
+            except requests.RequestException as e:
+                print(f"❌ Error posting construct for {pdb_filename}: {e}")
+                store.update(pdb_filename, construct_status="failed")
+                metrics.count("constructs_total", result="failed")
+                progress.advance()
+                continue
+            print(f"✅ Posted construct for {pdb_filename} (draft {draft_id})")
+            store.update(pdb_filename, construct_status=CONSTRUCT_POSTED)
+            metrics.count("constructs_total", result=CONSTRUCT_POSTED)
+            progress.advance()
+            n_posted += 1
+    progress.close()
+
+    elapsed = time.time() - start
+    print(f"\n🎯 {n_posted}/{len(pending)} constructs posted in {elapsed:.1f} s "
+          f"({n_posted / elapsed if elapsed > 0 else 0:.1f} posts/s)")
+
+
+def add_arguments(parser):
+    parser.add_argument("--in-flight", type=int, default=MAX_IN_FLIGHT,
+                        help=f"Constructs posted concurrently (default: {MAX_IN_FLIGHT})")
+    parser.add_argument("--force", action="store_true",
+                        help="Post again the constructs of drafts already marked as posted")
+    metrics.add_metrics_arguments(parser)
+
+
+def run(args):
+    with metrics.session(args, "construct-post-PED"):
+        main(in_flight=args.in_flight, force=args.force)
 
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Post the construct JSONs of created drafts to PED.")
+    add_arguments(parser)
+    run(parser.parse_args())
@@ -1,27 +1,148 @@
 # construct.py
 import os
 import json
-from Bio.PDB import PDBParser, PPBuilder
+import hashlib
+import metrics
+from Bio.Data.PDBData import protein_letters_3to1, protein_letters_3to1_extended
+
+# Distancia máxima C–N para considerar dos residuos unidos (igual que PPBuilder)
+PEPTIDE_BOND_RADIUS = 1.8
+
+
+def read_first_model(pdb_path):
+    """
+    Lee solo el primer modelo del PDB (se detiene en el primer ENDMDL); ver parse_first_model.
+    """
+    with open(pdb_path, "r") as f:
+        return parse_first_model(f)
+
+
+def parse_first_model(lines):
+    """
+    Recorre las líneas de un PDB hasta el final del primer modelo y devuelve
+    {chain_id: [residue, ...]} en orden de aparición, donde cada residuo es
+    {"id": (hetero_flag, resseq, icode), "resname": str, "atoms": {name: [(altloc, xyz)]}}.
+    Solo se guardan los átomos N y C, que son los que necesita la conectividad.
+    """
+    chains = {}
+    current_key = None
+    current_residue = None
+    atoms_seen = False
+
+    for line in lines:
+        record_type = line[0:6]
+        if record_type == "ATOM  " or record_type == "HETATM":
+            atoms_seen = True
+            resname = line[17:20].strip()
+            chain_id = line[21]
+            resseq = int(line[22:26].split()[0])
+            icode = line[26]
+            if record_type == "HETATM":
+                hetero_flag = "W" if resname in ("HOH", "WAT") else "H_" + resname
+            else:
+                hetero_flag = " "
+            key = (chain_id, hetero_flag, resseq, icode, resname)
+
+            if key != current_key:
+                residues = chains.setdefault(chain_id, {})
+                res_id = (hetero_flag, resseq, icode)
+                current_residue = residues.get(res_id)
+                if current_residue is None:
+                    current_residue = {"id": res_id, "resname": resname, "atoms": {}}
+                    residues[res_id] = current_residue
+                current_key = key
+
+            name = line[12:16].strip()
+            if name == "N" or name == "C":
+                xyz = (float(line[30:38]), float(line[38:46]), float(line[46:54]))
+                current_residue["atoms"].setdefault(name, []).append((line[16], xyz))
+        elif record_type == "ENDMDL" or record_type == "END   " or record_type == "CONECT":
+            break
+        elif record_type == "MODEL " and atoms_seen:
+            # Segundo modelo sin ENDMDL previo
+            break
+
+    return {chain_id: list(residues.values()) for chain_id, residues in chains.items()}
+
+
+def hash_first_model(pdb_path):
+    """
+    Hash rápido (BLAKE2b, 128 bits) del contenido del primer modelo, hasta el primer
+    ENDMDL incluido. Sirve para detectar si un ensemble cambió sin leer todo el archivo.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    with metrics.timer("pdb_parse_seconds", step="first_model_hash"), open(pdb_path, "rb") as f:
+        for line in f:
+            h.update(line)
+            if line.startswith(b"ENDMDL"):
+                break
+    return h.hexdigest()
+
+
+def _is_amino_acid(residue):
+    return f"{residue['resname']:<3s}".upper() in protein_letters_3to1
+
+
+def _is_connected(prev_res, next_res):
+    """Test C(prev)–N(next) como PPBuilder, probando todas las posiciones alternativas."""
+    c_list = prev_res["atoms"].get("C")
+    n_list = next_res["atoms"].get("N")
+    if not c_list or not n_list:
+        return False
+    for n_altloc, (nx, ny, nz) in n_list:
+        for c_altloc, (cx, cy, cz) in c_list:
+            if n_altloc == c_altloc or n_altloc == " " or c_altloc == " ":
+                dist = ((nx - cx) ** 2 + (ny - cy) ** 2 + (nz - cz) ** 2) ** 0.5
+                if dist < PEPTIDE_BOND_RADIUS:
+                    return True
+    return False
+
+
+def build_chain_sequence(residues):
+    """
+    Concatena la secuencia de los polipéptidos de una cadena, con los mismos cortes
+    que PPBuilder (residuos no estándar o enlaces C–N rotos; los residuos aislados se omiten).
+    """
+    peptides = []
+    residue_it = iter(residues)
+    prev_res = next(residue_it, None)
+    while prev_res is not None and not _is_amino_acid(prev_res):
+        prev_res = next(residue_it, None)
+    if prev_res is None:
+        return ""
+
+    pp = None
+    for next_res in residue_it:
+        if _is_amino_acid(prev_res) and _is_amino_acid(next_res) and _is_connected(prev_res, next_res):
+            if pp is None:
+                pp = [prev_res]
+                peptides.append(pp)
+            pp.append(next_res)
+        else:
+            pp = None
+        prev_res = next_res
+
+    return "".join(
+        protein_letters_3to1_extended.get(res["resname"], "X") for pp in peptides for res in pp
+    )
+
 
 def get_chain_sequences_and_last_residues(pdb_path):
     """
-    Devuelve diccionario {chain_id: {"sequence": str, "end": int}} 
+    Devuelve diccionario {chain_id: {"sequence": str, "end": int}}
     usando la secuencia y último residuo de cada cadena en el PDB.
     """
-    parser = PDBParser(QUIET=True)
-    structure = parser.get_structure("struct", pdb_path)
-    ppb = PPBuilder()
     chain_info = {}
 
     # Tomamos solo el primer modelo
-    model = next(structure.get_models())
-    for chain in model:
-        polypeptides = ppb.build_peptides(chain)
-        seq = "".join([str(pp.get_sequence()) for pp in polypeptides])
-        residues = [res for res in chain if res.id[0] == " "]
-        if residues:
-            last_resnum = residues[-1].id[1]
-            chain_info[chain.id] = {"sequence": seq, "end": last_resnum}
+    with metrics.timer("pdb_parse_seconds", step="chains"):
+        chains = read_first_model(pdb_path)
+    for chain_id, residues in chains.items():
+        seq = build_chain_sequence(residues)
+        standard = [res for res in residues if res["id"][0] == " "]
+        if standard:
+            last_resnum = standard[-1]["id"][1]
+            chain_info[chain_id] = {"sequence": seq, "end": last_resnum}
     return chain_info
 
 def create_construct_json(chain_info, uniprot_id, protein_name):
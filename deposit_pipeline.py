@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Streaming deposition pipeline
+-----------------------------
+One-shot alternative to running json_generation.py, Job-description-PED.py and
+construct-post-PED.py one after the other. The description and construct payloads
+are built in memory and go straight to PED, through stages connected by bounded
+queues (QUEUE_SIZE items at most between two stages):
+
+    generate    metadata lookup + payloads (GENERATE_WORKERS threads; PDB parsing
+                in a process pool with --workers N > 1)
+    submit      draft creation, description post and ensemble upload (UPLOAD_WORKERS)
+    constructs  chains post (CHAINS_WORKERS)
+
+No JSON file is read back, so the description/construct folder names of the
+separate scripts do not have to match. --archive still writes the JSONs to the
+json_generation.py output folders.
+
+Progress goes to the usual tracking store: job-status-PED.py works as after
+Job-description-PED.py, and re-runs skip PDBs already deposited (a PDB whose
+draft exists but whose construct was not posted only gets its construct posted).
+A failed submission is stored as submit_error with its draft, which the next run
+(or Job-description-PED.py) reuses.
+Merged UniProt IDs are skipped, as in json_generation.py.
+
+Usage:
+    python deposit_pipeline.py [--workers N] [--upload-workers N] [--chains-workers N] [--archive] [--gzip]
+"""
+
+import os
+import sys
+import time
+import queue
+import argparse
+import threading
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+import requests
+import metrics
+from http_utils import request_with_retries, mount_pool, MultipartFileStream, UploadProgress
+from tracking_store import open_store, SUBMIT_ERROR
+from description import resolve_uniprot_names, use_templates, get_templates, TemplateError
+from ensemble_index import open_index, chain_info_from_record
+from json_generation import lookup_metadata, build_pdb_payloads, write_payloads, get_output_folders
+
+# === CONFIGURATION ===
+url = "http://127.0.0.1:4205/v1"
+log_file = "job_tracking_log.csv"     # CSV export of the tracking store
+tracking_db = "job_tracking.sqlite"
+pdb_folders = [
+    "/home/balbio/unipd/ped_deposition/pdb_sample",
+]
+
+# Ensemble index (ensemble_index.py) with the chain sequences; None parses every PDB
+ensemble_index_path = None
+
+GENERATE_WORKERS = 4   # threads doing metadata lookups and building payloads
+UPLOAD_WORKERS = 4     # PDBs in draft creation / description / upload at the same time
+CHAINS_WORKERS = 8     # construct posts in flight
+QUEUE_SIZE = 16        # payloads waiting between two stages (bounds memory use)
+STAGE_RETRIES = 3      # retries per request on connection errors, 429 and 5xx
+UPLOAD_TIMEOUT = 3600  # seconds
+GZIP_UPLOAD = False    # compress PDBs on the fly (only if the PED server accepts .pdb.gz)
+CONSTRUCT_POSTED = "posted"
+
+session = requests.Session()  # connection pool sized to the upload + chains workers in main()
+
+
+def ped_post(endpoint, **kwargs):
+    """POST to the PED API with retries; raises for error responses."""
+    response = request_with_retries(session, "POST", f"{url}/{endpoint}",
+                                    retries=STAGE_RETRIES, rate_limit=False, **kwargs)
+    response.raise_for_status()
+    return response
+
+
+def existing_job(draft_id):
+    """Job of the draft's first ensemble (e001) if the PDB was already uploaded, else None."""
+    response = request_with_retries(session, "GET", f"{url}/drafts/{draft_id}/ensembles/e001",
+                                    retries=STAGE_RETRIES, rate_limit=False, timeout=60)
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    return response.json().get("job")
+
+
+class Pipeline:
+    """
+    Stage threads connected by bounded queues. Stage workers never touch the tracking
+    store: they send events to the results queue, which the main thread consumes.
+    """
+
+    def __init__(self, uniprot_names, parse_pool=None, archive=False, gzip=GZIP_UPLOAD,
+                 generate_workers=GENERATE_WORKERS, upload_workers=UPLOAD_WORKERS, chains_workers=CHAINS_WORKERS):
+        self.uniprot_names = uniprot_names
+        self.parse_pool = parse_pool
+        self.archive = archive
+        self.gzip = gzip
+        self.results = queue.Queue()
+        self.stages = [
+            ("generate", self.generate, generate_workers),
+            ("submit", self.submit, upload_workers),
+            ("constructs", self.post_construct, chains_workers),
+        ]
+        self.inboxes = [queue.Queue(QUEUE_SIZE) for _ in self.stages]
+
+    # --- stages: each takes an item and returns it for the next stage (None drops it) ---
+    def generate(self, item):
+        pdb_folder, pdb_file = item["folder"], item["file"]
+        uniprot_id = os.path.splitext(pdb_file)[0].split("_")[0]
+        protein_name, final_id, disprot_id = lookup_metadata(uniprot_id, self.uniprot_names)
+        if final_id != uniprot_id:
+            self.results.put(("merged", item, final_id))
+            return None
+
+        pdb_path = os.path.join(pdb_folder, pdb_file)
+        record = open_index(ensemble_index_path).lookup(pdb_path) if ensemble_index_path else None
+        chain_info = chain_info_from_record(record) if record is not None else None
+        args = (pdb_folder, pdb_file, protein_name, disprot_id, chain_info)
+        if self.parse_pool is not None:
+            item["description"], item["construct"] = metrics.pool_submit(self.parse_pool, build_pdb_payloads,
+                                                                         *args).result()
+        else:
+            item["description"], item["construct"] = build_pdb_payloads(*args)
+
+        if self.archive:
+            _, desc_folder, construct_folder = get_output_folders(pdb_folder)
+            os.makedirs(desc_folder, exist_ok=True)
+            os.makedirs(construct_folder, exist_ok=True)
+            write_payloads(pdb_file, desc_folder, construct_folder, item["description"], item["construct"])
+        return item
+
+    def submit(self, item):
+        if item.get("draft_id"):
+            return item  # deposited by a previous run, only the construct is missing
+        pdb_file = item["file"]
+        pdb_path = os.path.join(item["folder"], pdb_file)
+        item["start_time"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        item["pdb_size_bytes"] = pdb_size = os.path.getsize(pdb_path)
+
+        # Draft of a failed submission, or a new one (not retried once sent: a retry
+        # could create a second draft)
+        draft_id = item.pop("failed_draft_id", None)
+        reused = bool(draft_id)
+        if not reused:
+            with metrics.timer("ped_stage_seconds", stage="draft"):
+                draft_id = ped_post("drafts", idempotent=False, timeout=60).json()["draft_id"]
+        item["draft_id"] = draft_id  # stored with the error if a later step fails
+        with metrics.timer("ped_stage_seconds", stage="description"):
+            ped_post(f"drafts/{draft_id}/description", json=item.pop("description"), timeout=60)
+
+        # The upload of a failed submission may have reached the server (e.g. timed out)
+        job = existing_job(draft_id) if reused else None
+        if job is None:
+            # Not retried once sent: a retry could create a second job
+            progress = UploadProgress(pdb_file, total=pdb_size)
+            with metrics.timer("ped_stage_seconds", stage="upload"), \
+                    MultipartFileStream("pdbfile", pdb_path, gzip=self.gzip, progress=progress) as body:
+                job = ped_post(f"drafts/{draft_id}/ensembles", data=body, idempotent=False,
+                               headers={"Content-Type": body.content_type},
+                               timeout=UPLOAD_TIMEOUT).json()["job"]
+            progress.report()
+            metrics.observe("ped_upload_size_bytes", pdb_size, buckets=metrics.SIZE_BUCKETS)
+
+        self.results.put(("submitted", item, {
+            "filename": pdb_file,
+            "draft_id": draft_id,
+            "job_id": job["job_id"],
+            "status": job["status"],
+            "start_time": item["start_time"],
+            "pdb_size_bytes": pdb_size,
+        }))
+        return item
+
+    def post_construct(self, item):
+        with metrics.timer("ped_stage_seconds", stage="chains"):
+            ped_post(f"drafts/{item['draft_id']}/chains", json=item.pop("construct"), timeout=60)
+        self.results.put(("posted", item, None))
+        return None
+
+    # --- plumbing ---
+    def _worker(self, index):
+        name, work, _ = self.stages[index]
+        inbox = self.inboxes[index]
+        outbox = self.inboxes[index + 1] if index + 1 < len(self.stages) else None
+        while True:
+            # Time waiting for input: a stage that mostly waits is not the bottleneck
+            with metrics.timer("pipeline_wait_seconds", stage=name):
+                item = inbox.get()
+            if item is None:
+                return
+            try:
+                with metrics.timer("pipeline_stage_seconds", stage=name):
+                    item = work(item)
+            except Exception as e:
+                self.results.put(("error", item, (name, e)))
+                continue
+            if item is not None and outbox is not None:
+                outbox.put(item)  # blocks while the next stage is QUEUE_SIZE items behind
+
+    def _feed(self, items):
+        """Feeds the first stage, then stops the stages in order once each one is drained."""
+        for item in items:
+            self.inboxes[0].put(item)
+        for index, (_, _, n_threads) in enumerate(self.stages):
+            for _ in range(n_threads):
+                self.inboxes[index].put(None)
+            for thread in self.threads[index]:
+                thread.join()
+        self.results.put(None)
+
+    def run(self, items):
+        """Starts the stages and yields the result events (kind, item, detail) as they come."""
+        self.threads = [[threading.Thread(target=self._worker, args=(index,), daemon=True)
+                         for _ in range(n_threads)]
+                        for index, (_, _, n_threads) in enumerate(self.stages)]
+        for stage_threads in self.threads:
+            for thread in stage_threads:
+                thread.start()
+        threading.Thread(target=self._feed, args=(items,), daemon=True).start()
+        while True:
+            event = self.results.get()
+            if event is None:
+                return
+            yield event
+
+
+def main(workers=1, archive=False, gzip=GZIP_UPLOAD, upload_workers=UPLOAD_WORKERS, chains_workers=CHAINS_WORKERS,
+         templates=None):
+    use_templates(templates)
+    mount_pool(session, upload_workers + chains_workers)
+    store = open_store(tracking_db, log_file)
+
+    # PDBs to deposit; those with a draft but no construct posted only go through the constructs stage
+    items = []
+    n_done = 0
+    for pdb_folder in pdb_folders:
+        if not os.path.exists(pdb_folder):
+            print(f"⚠️  Folder not found: {pdb_folder}")
+            continue
+        for pdb_file in sorted(f for f in os.listdir(pdb_folder) if f.endswith(".pdb")):
+            row = store.get(pdb_file)
+            if row is not None and row["construct_status"] == CONSTRUCT_POSTED:
+                n_done += 1
+                continue
+            if row is not None and row["status"] == SUBMIT_ERROR:
+                items.append({"folder": pdb_folder, "file": pdb_file, "draft_id": None,
+                              "failed_draft_id": row["draft_id"]})
+                continue
+            items.append({"folder": pdb_folder, "file": pdb_file,
+                          "draft_id": row["draft_id"] if row is not None else None})
+    if n_done:
+        print(f"⏭️ Skipping {n_done} PDBs already deposited")
+
+    uniprot_names = resolve_uniprot_names([os.path.splitext(item["file"])[0].split("_")[0] for item in items])
+
+    print(f"\n🚀 Depositing {len(items)} PDBs "
+          f"({GENERATE_WORKERS} generate / {upload_workers} upload / {chains_workers} chains workers)")
+    start = time.time()
+    counts = {"submitted": 0, "posted": 0, "merged": 0, "error": 0}
+    uploaded_bytes = 0
+    progress = metrics.progress(len(items), "PDBs")
+
+    parse_pool = (ProcessPoolExecutor(workers, initializer=use_templates, initargs=(templates,))
+                  if workers > 1 else None)
+    pipeline = Pipeline(uniprot_names, parse_pool=parse_pool, archive=archive, gzip=gzip,
+                        upload_workers=upload_workers, chains_workers=chains_workers)
+    for kind, item, detail in pipeline.run(items):
+        counts[kind] += 1
+        metrics.count("pipeline_events_total", kind=kind)
+        # An item is done once posted, merged or failed; uploads only add bytes
+        progress.advance(0 if kind == "submitted" else 1,
+                         n_bytes=detail["pdb_size_bytes"] if kind == "submitted" else 0)
+        pdb_file = item["file"]
+        if kind == "submitted":
+            # Committed after each file (safe for large batches or crashes)
+            store.add(detail)
+            uploaded_bytes += detail["pdb_size_bytes"]
+            print(f"[{pdb_file}] Draft {detail['draft_id']}: job {detail['job_id']} created")
+        elif kind == "posted":
+            store.update(pdb_file, construct_status=CONSTRUCT_POSTED)
+            print(f"✅ [{pdb_file}] Construct posted (draft {item['draft_id']})")
+        elif kind == "merged":
+            print(f"🔁❌ [{pdb_file}] Merged ID → {detail} (not deposited)")
+        else:
+            stage, error = detail
+            print(f"❌ [{pdb_file}] {stage} failed: {error}")
+            if stage == "constructs":
+                store.update(pdb_file, construct_status="failed")
+            elif stage == "submit":
+                # Recorded (with the draft, if created) so that the next run retries it
+                store.add({"filename": pdb_file, "draft_id": item.get("draft_id"), "status": SUBMIT_ERROR,
+                           "start_time": item.get("start_time"), "pdb_size_bytes": item.get("pdb_size_bytes")})
+    progress.close()
+    if parse_pool is not None:
+        parse_pool.shutdown()
+
+    elapsed = time.time() - start
+    store.export_csv(log_file)
+    print(f"\n📄 Tracking log exported to {log_file} ({len(store)} rows)")
+    print(f"🎯 {counts['submitted']} uploaded, {counts['posted']} constructs posted, "
+          f"{counts['merged']} merged IDs skipped, {counts['error']} errors in {elapsed:.1f} s "
+          f"({counts['posted'] / elapsed if elapsed > 0 else 0:.1f} PDBs/s, "
+          f"{uploaded_bytes / 1024**2 / elapsed if elapsed > 0 else 0:.1f} MB/s uploaded)")
+    return 1 if counts["error"] else 0
+
+
+def add_arguments(parser):
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Processes used to parse PDBs (default: 1, in the generate threads)")
+    parser.add_argument("--upload-workers", type=int, default=UPLOAD_WORKERS,
+                        help=f"PDBs in draft creation / upload at the same time (default: {UPLOAD_WORKERS})")
+    parser.add_argument("--chains-workers", type=int, default=CHAINS_WORKERS,
+                        help=f"Construct posts in flight (default: {CHAINS_WORKERS})")
+    parser.add_argument("--archive", action="store_true",
+                        help="Also write the JSONs to the json_generation.py output folders")
+    parser.add_argument("--gzip", action="store_true",
+                        help="Compress PDBs on the fly during upload (sent as .pdb.gz)")
+    parser.add_argument("--templates", metavar="PATH",
+                        help="Description templates file, .toml or .json (default: description_templates.toml)")
+    metrics.add_metrics_arguments(parser)
+
+
+def run(args):
+    with metrics.session(args, "deposit_pipeline"):
+        try:
+            use_templates(args.templates)
+            get_templates()
+        except (OSError, ValueError, TemplateError) as e:
+            print(f"❌ Cannot read description templates: {e}")
+            return 1
+        return main(workers=args.workers, archive=args.archive, gzip=args.gzip,
+                    upload_workers=args.upload_workers, chains_workers=args.chains_workers,
+                    templates=args.templates)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate payloads in memory and deposit PDB ensembles to PED.")
+    add_arguments(parser)
+    sys.exit(run(parser.parse_args()))
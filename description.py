@@ -1,19 +1,68 @@
+import os
+import json
+import hashlib
 import requests
+import metrics
+from metadata_cache import get_cache
+from http_utils import get_with_retries, TemporaryLookupError
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11: JSON templates only
+    tomllib = None
+
+UNIPROT_URL = "https://rest.uniprot.org"
+DISPROT_URL = "https://disprot.org"
+UNIPROT_BATCH_SIZE = 200  # accessions per search/stream request
+
+# Description templates (authors, publication fields, workflow texts), loaded once per process
+TEMPLATES_PATH = os.environ.get("PED_DESCRIPTION_TEMPLATES") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "description_templates.toml"
+)
+PER_ENTRY_FIELDS = ("title", "entry_cross_reference", "structural_ensembles_calculation")
 
 session = requests.Session()
 session.headers.update({"User-Agent": "AlphaFlex JSON Generator/1.1"})
 
+
+def _protein_name(data):
+    """Recommended full name of a UniProt entry, or the first submission name."""
+    name = (
+        data.get("proteinDescription", {})
+            .get("recommendedName", {})
+            .get("fullName", {})
+            .get("value")
+    )
+    if not name:
+        alt_name = data.get("proteinDescription", {}).get("submissionNames", [])
+        if alt_name and isinstance(alt_name, list):
+            name = alt_name[0].get("fullName", {}).get("value")
+    return name or None
+
 def get_uniprot_name(uniprot_id):
     """
     Returns (protein_name, resolved_id)
     - protein_name: None if not found
     - resolved_id: may differ if the original UniProt ID was merged or updated
+    Results (including "not found") are stored in the persistent metadata cache.
+    Raises TemporaryLookupError if UniProt keeps timing out or answering 429/5xx,
+    so the entry is retried later instead of being treated as inactive.
     """
-    url = f"https://rest.uniprot.org/uniprotkb/{uniprot_id}.json"
+    cache = get_cache()
+    if cache is not None:
+        cached = cache.get_uniprot(uniprot_id)
+        metrics.count("metadata_cache_total", service="uniprot", result="hit" if cached is not None else "miss")
+        if cached is not None:
+            return cached["name"], cached["resolved_accession"]
+
+    url = f"{UNIPROT_URL}/uniprotkb/{uniprot_id}.json"
     try:
-        response = session.get(url, timeout=5)
+        with metrics.timer("metadata_lookup_seconds", service="uniprot"):
+            response = get_with_retries(session, url, timeout=5)
         if response.status_code == 404:
             print(f"⚠️  UniProt ID not found: {uniprot_id}")
+            if cache is not None:
+                cache.put_uniprot(uniprot_id, None, uniprot_id, "NOT_FOUND")
             return None, uniprot_id
 
         response.raise_for_status()
@@ -27,49 +76,139 @@ def get_uniprot_name(uniprot_id):
                 new_id = merged_to[0]
                 print(f"↪️  UniProt ID {uniprot_id} was {reason}, merged to {new_id}")
                 # Intentamos obtener el nombre del nuevo ID
-                return get_uniprot_name(new_id)
+                name, resolved_id = get_uniprot_name(new_id)
+                # Solo se guarda si el nuevo ID se resolvió (no hubo timeout/error)
+                if cache is not None and cache.get_uniprot(new_id) is not None:
+                    cache.put_uniprot(uniprot_id, name, resolved_id, reason)
+                return name, resolved_id
             else:
                 print(f"⚠️  UniProt ID {uniprot_id} is inactive ({reason})")
+                if cache is not None:
+                    cache.put_uniprot(uniprot_id, None, uniprot_id, reason)
                 return None, uniprot_id
 
         # Si es válido, tomamos el nombre
-        name = (
-            data.get("proteinDescription", {})
-                .get("recommendedName", {})
-                .get("fullName", {})
-                .get("value")
-        )
-        if not name:
-            alt_name = data.get("proteinDescription", {}).get("submissionNames", [])
-            if alt_name and isinstance(alt_name, list):
-                name = alt_name[0].get("fullName", {}).get("value")
-
+        name = _protein_name(data)
         resolved_id = data.get("primaryAccession", uniprot_id)
-        return (name or None, resolved_id)
+        if cache is not None:
+            cache.put_uniprot(uniprot_id, name, resolved_id)
+        return (name, resolved_id)
 
-    except requests.exceptions.Timeout:
-        print(f"⏱️ Timeout while querying UniProt for {uniprot_id}")
-        return None, uniprot_id
+    except TemporaryLookupError as e:
+        print(f"⏱️ UniProt temporarily unavailable for {uniprot_id}: {e}")
+        raise
     except requests.exceptions.RequestException as e:
         print(f"❌ Error querying UniProt {uniprot_id}: {e}")
         return None, uniprot_id
 
 
+def resolve_uniprot_names(uniprot_ids, batch_size=UNIPROT_BATCH_SIZE):
+    """
+    Bulk version of get_uniprot_name.
+    Returns {uniprot_id: (protein_name, resolved_id)} for every requested ID.
+    - Active entries are fetched in chunks through the UniProt search/stream endpoint.
+    - An ID found only as a secondary accession of one entry was merged into it.
+    - IDs not found in the stream (deleted, demerged, failed chunks) fall back to
+      get_uniprot_name, which reads their inactiveReason one by one.
+    IDs that still fail temporarily are left out of the mapping, so callers retry them.
+    """
+    cache = get_cache()
+    resolved = {}
+    pending = []
+    for uniprot_id in dict.fromkeys(uniprot_ids):
+        cached = cache.get_uniprot(uniprot_id) if cache is not None else None
+        if cache is not None:
+            metrics.count("metadata_cache_total", service="uniprot", result="hit" if cached is not None else "miss")
+        if cached is not None:
+            resolved[uniprot_id] = (cached["name"], cached["resolved_accession"])
+        else:
+            pending.append(uniprot_id)
+
+    fallback = []
+    for start in range(0, len(pending), batch_size):
+        chunk = pending[start:start + batch_size]
+        print(f"🔎 Resolving UniProt IDs {start + 1}-{start + len(chunk)} of {len(pending)}")
+        try:
+            with metrics.timer("metadata_lookup_seconds", service="uniprot_stream"):
+                response = get_with_retries(
+                    session,
+                    f"{UNIPROT_URL}/uniprotkb/stream",
+                    params={
+                        "query": " OR ".join(f"accession:{acc}" for acc in chunk),
+                        "fields": "accession,protein_name",
+                        "format": "json",
+                    },
+                    timeout=60,
+                )
+                response.raise_for_status()
+                results = response.json().get("results", [])
+        except (TemporaryLookupError, requests.exceptions.RequestException, ValueError) as e:
+            print(f"❌ Error in batched UniProt query, falling back to single lookups: {e}")
+            fallback.extend(chunk)
+            continue
+
+        primary = {}    # primary accession -> entry
+        secondary = {}  # secondary accession -> [entries]
+        for entry in results:
+            primary[entry.get("primaryAccession")] = entry
+            for acc in entry.get("secondaryAccessions", []):
+                secondary.setdefault(acc, []).append(entry)
+
+        for uniprot_id in chunk:
+            if uniprot_id in primary:
+                name = _protein_name(primary[uniprot_id])
+                resolved[uniprot_id] = (name, uniprot_id)
+                if cache is not None:
+                    cache.put_uniprot(uniprot_id, name, uniprot_id)
+            elif len(secondary.get(uniprot_id, [])) == 1:
+                entry = secondary[uniprot_id][0]
+                name, new_id = _protein_name(entry), entry["primaryAccession"]
+                print(f"↪️  UniProt ID {uniprot_id} was MERGED, merged to {new_id}")
+                resolved[uniprot_id] = (name, new_id)
+                if cache is not None:
+                    cache.put_uniprot(uniprot_id, name, new_id, "MERGED")
+            else:
+                fallback.append(uniprot_id)
+
+    for uniprot_id in fallback:
+        try:
+            resolved[uniprot_id] = get_uniprot_name(uniprot_id)
+        except TemporaryLookupError:
+            pass
+
+    return {uniprot_id: resolved[uniprot_id] for uniprot_id in uniprot_ids if uniprot_id in resolved}
+
+
 def get_disprot_id(uniprot_id):
     """
     Returns DisProt ID based on UniProt ID, or None if not available.
+    Results (including "not in DisProt") are stored in the persistent metadata cache.
+    Raises TemporaryLookupError if DisProt keeps timing out or answering 429/5xx.
     """
-    url = f"https://disprot.org/api/{uniprot_id}"
+    cache = get_cache()
+    if cache is not None:
+        cached = cache.get_disprot(uniprot_id)
+        metrics.count("metadata_cache_total", service="disprot", result="hit" if cached is not None else "miss")
+        if cached is not None:
+            return cached["disprot_id"]
+
+    url = f"{DISPROT_URL}/api/{uniprot_id}"
     try:
-        response = session.get(url, timeout=5)
+        with metrics.timer("metadata_lookup_seconds", service="disprot"):
+            response = get_with_retries(session, url, timeout=5)
         if response.status_code == 404:
+            if cache is not None:
+                cache.put_disprot(uniprot_id, None)
             return None
         response.raise_for_status()
         data = response.json()
-        return data.get("disprot_id")
-    except requests.exceptions.Timeout:
-        print(f"⏱️ Timeout querying DisProt for {uniprot_id}")
-        return None
+        disprot_id = data.get("disprot_id")
+        if cache is not None:
+            cache.put_disprot(uniprot_id, disprot_id)
+        return disprot_id
+    except TemporaryLookupError as e:
+        print(f"⏱️ DisProt temporarily unavailable for {uniprot_id}: {e}")
+        raise
     except requests.exceptions.RequestException as e:
         print(f"❌ Error querying DisProt {uniprot_id}: {e}")
         return None
@@ -77,44 +216,114 @@ def get_disprot_id(uniprot_id):
         return None
 
 
-def create_description_json(uniprot_id):
+# === DESCRIPTION TEMPLATES ===
+class TemplateError(Exception):
+    pass
+
+
+_templates = None
+
+
+def _encode_field(key, value, compact=False):
+    """'"key": value' as written by json.dumps(indent=4, ensure_ascii=False) at the top level."""
+    if compact:
+        return json.dumps(key, ensure_ascii=False) + ":" + json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+    text = json.dumps(value, indent=4, ensure_ascii=False)
+    return "    " + json.dumps(key, ensure_ascii=False) + ": " + text.replace("\n", "\n    ")
+
+
+def load_templates(path):
+    """
+    Reads a template file (.toml, or .json) into {"workflows": {name: (match, fields)},
+    "default": name, "fragments": {...}, "hash": ...}. The fields of each workflow are the
+    [base] fields with its own overlaid, and every field that is not per-entry is encoded
+    once. "hash" changes whenever the generated descriptions can change (json_generation.py
+    manifest).
+    """
+    if path.endswith(".json"):
+        with open(path, "r", encoding="utf-8") as f:
+            config = json.load(f)
+    else:
+        if tomllib is None:
+            raise TemplateError("TOML templates need Python 3.11+ (tomllib); or use a JSON template file")
+        with open(path, "rb") as f:
+            config = tomllib.load(f)
+
+    base = config.get("base", {})
+    workflows = {}
+    fragments = {}  # (field, id(value)) -> (value, indented JSON, compact JSON)
+    for name, overlay in config.get("workflows", {}).items():
+        fields = dict(base)
+        fields.update((key, value) for key, value in overlay.items() if key != "match")
+        for key, value in fields.items():
+            if key not in PER_ENTRY_FIELDS:
+                fragments[key, id(value)] = (value, _encode_field(key, value), _encode_field(key, value, compact=True))
+        workflows[name] = (overlay.get("match"), fields)
+    defaults = [name for name, (match, _) in workflows.items() if match is None]
+    if not defaults:
+        raise TemplateError(f"{path}: no default workflow (a [workflows.<name>] table without 'match')")
+    # Workflows and fields in file order: both the matching and the JSON output depend on it
+    resolved = json.dumps([[name, match, fields] for name, (match, fields) in workflows.items()],
+                          ensure_ascii=False)
+    templates_hash = hashlib.blake2b(resolved.encode("utf-8"), digest_size=16).hexdigest()
+    return {"workflows": workflows, "default": defaults[0], "fragments": fragments, "hash": templates_hash}
+
+
+def get_templates():
+    global _templates
+    if _templates is None:
+        _templates = load_templates(TEMPLATES_PATH)
+    return _templates
+
+
+def use_templates(path):
+    """Selects another template file (None keeps the current one); also a process pool initializer."""
+    global TEMPLATES_PATH, _templates
+    if path and path != TEMPLATES_PATH:
+        TEMPLATES_PATH = path
+        _templates = None
+
+
+def get_workflow(pdb_file):
+    """Template workflow of a PDB file: the first one whose 'match' is in its name, else the default."""
+    templates = get_templates()
+    name_lower = pdb_file.lower()
+    for name, (match, _) in templates["workflows"].items():
+        if match is not None and match.lower() in name_lower:
+            return name
+    return templates["default"]
+
+
+def create_description_json(uniprot_id, workflow=None, protein_name=None, disprot_id=None):
     """
-    Generates the JSON dictionary template for a PDB file.
+    Generates the description of an entry: the template fields of the workflow (default
+    workflow if None) with the per-entry fields filled in. Only the top-level dict is new;
+    the template values are shared by every description and must not be modified in place.
     """
-    data = {
-        "title": [],
-        "authors": [
-            {"name": "Zi Hao Liu", "corresponding_author": False},
-            {"name": "Oufan Zhang", "corresponding_author": False},
-            {"name": "Stefano De Castro", "corresponding_author": False},
-            {"name": "Kunyang Sun", "corresponding_author": False},
-            {"name": "Teresa Head-Gordon", "corresponding_author": False},
-            {"name": "Julie Forman-Kay", "corresponding_author": False},
-        ],
-        "publication_status": "Unpublished",
-        "publication_source": "",
-        "publication_identifier": "",
-        "publication_html": "bioRxiv DOI",
-        "entry_cross_reference": [],
-        "experimental_cross_reference": [],
-        "experimental_procedure": "N/A",
-        "structural_ensembles_calculation": "",
-        "md_calculation": (
-            "Fixed backbone energy minimization simulation with the AMBER99sb "
-            "force-field through OpenMM at 300 K for a maximum of 2 ns to resolve "
-            "any sidechain clashes."
-        ),
-        "ontology_terms": [
-            {
-                "name": "Molecular dynamics",
-                "namespace": "Molecular dynamics",
-                "id": "00219",
-                "definition": (
-                    "Computational approach that simulates atom motion "
-                    "and investigates their location in space"
-                ),
-                "alias": ["molecular dynamics"],
-            }
-        ],
-    }
+    templates = get_templates()
+    workflow = workflow or templates["default"]
+    data = dict(templates["workflows"][workflow][1])
+    values = {"protein_name": protein_name or uniprot_id, "uniprot_id": uniprot_id, "workflow": workflow}
+    for key in ("title", "structural_ensembles_calculation"):
+        if isinstance(data.get(key), str):
+            data[key] = data[key].format(**values)
+    data["entry_cross_reference"] = [{"db": "disprot", "id": disprot_id}] if disprot_id else []
     return data
+
+
+def encode_description(data, compact=False):
+    """
+    JSON text of a description, the same as json.dumps(data, indent=4, ensure_ascii=False)
+    (compact: separators without spaces). Template fields are taken pre-encoded.
+    """
+    fragments = get_templates()["fragments"]
+    parts = []
+    for key, value in data.items():
+        cached = fragments.get((key, id(value)))
+        if cached is not None and cached[0] is value:
+            parts.append(cached[2] if compact else cached[1])
+        else:
+            parts.append(_encode_field(key, value, compact))
+    if compact:
+        return "{" + ",".join(parts) + "}"
+    return "{\n" + ",\n".join(parts) + "\n}" if parts else "{}"
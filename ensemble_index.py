@@ -0,0 +1,552 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Ensemble index
+--------------
+Reads every PDB ensemble once and stores what the other scripts need in a SQLite
+index, so they do not have to re-read the files:
+ - file size, mtime, content hash (BLAKE2b of the whole file)
+ - number of models and the byte range of every MODEL ... ENDMDL block
+ - first model: hash (same as construct.hash_first_model), atom count, residue
+   count (same as anylisis_ensembles.analyze_pdb), and per chain the sequence
+   (PPBuilder rules, see construct.py), residue range and residue count
+
+An entry is only used while the file keeps the size and mtime it had when indexed.
+anylisis_ensembles.py and json_generation.py take --index to read from it.
+EnsembleReader gives random access to model N (or a range of models) through mmap,
+without reading the models before it.
+
+Usage:
+    python ensemble_index.py build <pdb_folder> [...] [--workers N] [--force]
+    python ensemble_index.py show <pdb_file> [...]
+    python ensemble_index.py stats
+    python ensemble_index.py extract <pdb_file> <first>[-<last>] [-o out.pdb]   # models, 1-based
+"""
+
+import io
+import os
+import re
+import sys
+import time
+import array
+import mmap
+import bisect
+import sqlite3
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import metrics
+from construct import parse_first_model, build_chain_sequence
+
+# === CONFIGURATION ===
+INDEX_PATH = "ensemble_index.sqlite"
+READ_CHUNK_SIZE = 16 * 1024 * 1024  # bytes read (and hashed) at a time
+INDEX_WORKERS = os.cpu_count() or 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ensembles (
+    path             TEXT PRIMARY KEY,
+    size_bytes       INTEGER NOT NULL,
+    mtime_ns         INTEGER NOT NULL,
+    content_hash     TEXT NOT NULL,
+    first_model_hash TEXT NOT NULL,
+    n_models         INTEGER NOT NULL,
+    n_atoms          INTEGER NOT NULL,
+    n_residues       INTEGER NOT NULL,
+    model_offsets    BLOB NOT NULL,
+    model_ends       BLOB,
+    indexed_at       REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS chains (
+    path        TEXT NOT NULL,
+    chain_order INTEGER NOT NULL,
+    chain_id    TEXT NOT NULL,
+    sequence    TEXT NOT NULL,
+    start_resseq INTEGER,
+    end_resseq   INTEGER,
+    n_residues  INTEGER NOT NULL,
+    PRIMARY KEY (path, chain_order)
+);
+"""
+
+ENSEMBLE_COLUMNS = ["path", "size_bytes", "mtime_ns", "content_hash", "first_model_hash",
+                    "n_models", "n_atoms", "n_residues", "model_offsets", "model_ends", "indexed_at"]
+
+
+# === FIRST MODEL SCAN ===
+# Chain (col 22) + residue number (cols 23-26) of an ATOM line. The first group
+# absorbs short lines, so the key is the same as line[21:26] of the line.
+# Matching on "\nATOM" lets the regex engine jump between candidates with a
+# literal search; a first line of the file starting with ATOM is matched apart.
+ATOM_RES_RE = re.compile(rb"\nATOM[^\n]{0,17}([^\n]{0,5})")
+FIRST_ATOM_RES_RE = re.compile(rb"ATOM[^\n]{0,17}([^\n]{0,5})")
+ATOM_RECORD_RE = re.compile(rb"\n(?:ATOM  |HETATM)")
+
+
+def first_model_end(buf):
+    """
+    Byte offset where the scan of the first model stops: the start of the first
+    ENDMDL line after the first MODEL line, or the end of the buffer.
+    """
+    model = 0 if buf[:5] == b"MODEL" else buf.find(b"\nMODEL")
+    if model < 0:
+        return len(buf)
+    endmdl = buf.find(b"\nENDMDL", model)
+    return endmdl + 1 if endmdl >= 0 else len(buf)
+
+
+def count_first_model_residues(buf):
+    """
+    Residues of the first model, counted as distinct chain + residue number of the
+    ATOM lines (insertion codes and HETATM ignored). Without MODEL records, all ATOM
+    lines are used. `buf` is bytes or an mmap of the file.
+    """
+    end = first_model_end(buf)
+    raw_keys = set(ATOM_RES_RE.findall(buf, 0, end))
+    first = FIRST_ATOM_RES_RE.match(buf, 0, end)
+    if first:
+        raw_keys.add(first.group(1))
+    return len({key[:1].strip() + key[1:].strip() for key in raw_keys})
+
+
+def _first_endmdl_line_end(buf):
+    """End offset (newline included) of the first line starting with ENDMDL, or None."""
+    start = 0 if buf[:6] == b"ENDMDL" else buf.find(b"\nENDMDL")
+    if start < 0:
+        return None
+    newline = buf.find(b"\n", start + 1)
+    return newline + 1 if newline >= 0 else None
+
+
+def _first_model_complete(buf):
+    """True once `buf` holds everything the first-model scans look at."""
+    end = first_model_end(buf)
+    return end < len(buf) and _first_endmdl_line_end(buf) is not None
+
+
+# === MODEL BLOCKS ===
+class ModelBlockScanner:
+    """
+    Finds the MODEL ... ENDMDL blocks of a file fed in consecutive chunks.
+    Records the offset of every MODEL line and the end (newline included) of
+    every ENDMDL line; blocks() pairs them once the whole file has been fed.
+    """
+
+    def __init__(self):
+        self.starts = array.array("Q")
+        self.endmdl_ends = array.array("Q")
+        self.size = 0
+        self._carry = b"\n"  # last bytes fed; the file start counts as a line start
+        self._open_endmdl = False
+
+    def _find_lines(self, chunk, tag):
+        """Absolute offsets of the lines starting with `tag` that begin in or just before `chunk`."""
+        found = []
+        pos = self.size
+        # A "\n" + tag split between the previous chunks and this one
+        window = self._carry + chunk[:len(tag)]
+        i = window.find(b"\n" + tag)
+        while 0 <= i < len(self._carry):
+            if i + 1 + len(tag) > len(self._carry):
+                found.append(pos - len(self._carry) + i + 1)
+                break
+            i = window.find(b"\n" + tag, i + 1)
+        i = chunk.find(b"\n" + tag)
+        while i >= 0:
+            found.append(pos + i + 1)
+            i = chunk.find(b"\n" + tag, i + 1)
+        return found
+
+    def feed(self, chunk):
+        pos = self.size
+        if self._open_endmdl:
+            newline = chunk.find(b"\n")
+            if newline >= 0:
+                self.endmdl_ends.append(pos + newline + 1)
+                self._open_endmdl = False
+        self.starts.extend(self._find_lines(chunk, b"MODEL"))
+        for start in self._find_lines(chunk, b"ENDMDL"):
+            newline = chunk.find(b"\n", max(0, start + 1 - pos))
+            if newline >= 0:
+                self.endmdl_ends.append(pos + newline + 1)
+            else:
+                self._open_endmdl = True
+        self._carry = (self._carry + chunk[-6:])[-6:]
+        self.size += len(chunk)
+
+    def blocks(self):
+        """
+        (offsets, ends) arrays, one entry per model: from the MODEL line to the end of
+        its ENDMDL line, or to the next MODEL line (end of file) when ENDMDL is missing.
+        """
+        endmdl_ends = self.endmdl_ends
+        if self._open_endmdl:
+            endmdl_ends = endmdl_ends + array.array("Q", [self.size])
+        ends = array.array("Q")
+        for k, start in enumerate(self.starts):
+            limit = self.starts[k + 1] if k + 1 < len(self.starts) else self.size
+            j = bisect.bisect_right(endmdl_ends, start)
+            ends.append(endmdl_ends[j] if j < len(endmdl_ends) and endmdl_ends[j] <= limit else limit)
+        return self.starts, ends
+
+
+def scan_model_blocks(path):
+    """(offsets, ends) of the models of a PDB (see ModelBlockScanner), reading the whole file."""
+    scanner = ModelBlockScanner()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(READ_CHUNK_SIZE), b""):
+            scanner.feed(chunk)
+    return scanner.blocks()
+
+
+# === INDEXING ===
+def scan_ensemble(path):
+    """
+    Reads a PDB once, in READ_CHUNK_SIZE pieces, and returns its index record:
+    a dict with the ENSEMBLE_COLUMNS values plus "chains", a list of
+    {"chain_id", "sequence", "start_resseq", "end_resseq", "n_residues"}.
+    Only the first model is kept in memory (the whole file if it has no MODEL records).
+    """
+    st = os.stat(path)
+    content_hash = hashlib.blake2b(digest_size=16)
+    scanner = ModelBlockScanner()
+    head = bytearray()
+    head_done = False
+
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            content_hash.update(chunk)
+            scanner.feed(chunk)
+            if not head_done:
+                head += chunk
+                head_done = _first_model_complete(head)
+
+    head = bytes(head)
+    scan_end = first_model_end(head)
+    hash_end = _first_endmdl_line_end(head) or len(head)
+    n_atoms = len(ATOM_RECORD_RE.findall(head, 0, scan_end)) + (head[:6] in (b"ATOM  ", b"HETATM"))
+
+    chains = []
+    model = parse_first_model(io.TextIOWrapper(io.BytesIO(head)))
+    for chain_id, residues in model.items():
+        standard = [res for res in residues if res["id"][0] == " "]
+        chains.append({
+            "chain_id": chain_id,
+            "sequence": build_chain_sequence(residues),
+            "start_resseq": standard[0]["id"][1] if standard else None,
+            "end_resseq": standard[-1]["id"][1] if standard else None,
+            "n_residues": len(residues),
+        })
+
+    offsets, ends = scanner.blocks()
+    return {
+        "path": os.path.abspath(path),
+        "size_bytes": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "content_hash": content_hash.hexdigest(),
+        "first_model_hash": hashlib.blake2b(head[:hash_end], digest_size=16).hexdigest(),
+        "n_models": len(offsets) or int(n_atoms > 0),
+        "n_atoms": n_atoms,
+        "n_residues": count_first_model_residues(head),
+        "model_offsets": offsets.tobytes(),
+        "model_ends": ends.tobytes(),
+        "indexed_at": time.time(),
+        "chains": chains,
+    }
+
+
+def chain_info_from_record(record):
+    """Chains with standard residues as {chain_id: {"sequence", "end"}} (construct.py format)."""
+    return {c["chain_id"]: {"sequence": c["sequence"], "end": c["end_resseq"]}
+            for c in record["chains"] if c["end_resseq"] is not None}
+
+
+class EnsembleIndex:
+    """SQLite index of scanned ensembles, keyed by absolute path; safe to share between threads."""
+
+    def __init__(self, path=INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(ensembles)")}
+            if "model_ends" not in columns:
+                # Indexes built before block ends were stored; those entries are re-indexed
+                self._conn.execute("ALTER TABLE ensembles ADD COLUMN model_ends BLOB")
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM ensembles").fetchone()[0]
+
+    def put(self, record):
+        """Inserts (or replaces) the record of one file and its chains, and commits."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO ensembles ({', '.join(ENSEMBLE_COLUMNS)}) "
+                f"VALUES ({', '.join('?' for _ in ENSEMBLE_COLUMNS)})",
+                tuple(record[col] for col in ENSEMBLE_COLUMNS),
+            )
+            self._conn.execute("DELETE FROM chains WHERE path = ?", (record["path"],))
+            self._conn.executemany(
+                "INSERT INTO chains (path, chain_order, chain_id, sequence, start_resseq, end_resseq, n_residues) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(record["path"], i, c["chain_id"], c["sequence"], c["start_resseq"], c["end_resseq"],
+                  c["n_residues"]) for i, c in enumerate(record["chains"])],
+            )
+
+    def get(self, pdb_path):
+        """Record of a file (with "chains"), fresh or not, or None."""
+        path = os.path.abspath(pdb_path)
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM ensembles WHERE path = ?", (path,)).fetchone()
+            if row is None:
+                return None
+            chains = self._conn.execute(
+                "SELECT chain_id, sequence, start_resseq, end_resseq, n_residues FROM chains "
+                "WHERE path = ? ORDER BY chain_order", (path,)
+            ).fetchall()
+        record = dict(row)
+        record["chains"] = [dict(c) for c in chains]
+        return record
+
+    def lookup(self, pdb_path):
+        """Record of a file if it has not changed since it was indexed (same size and mtime), else None."""
+        record = self.get(pdb_path)
+        if record is None:
+            return None
+        try:
+            st = os.stat(pdb_path)
+        except OSError:
+            return None
+        if st.st_size != record["size_bytes"] or st.st_mtime_ns != record["mtime_ns"]:
+            return None
+        if record["model_ends"] is None:
+            return None
+        return record
+
+    def get_chain_info(self, pdb_path):
+        """
+        {chain_id: {"sequence", "end"}} as returned by
+        construct.get_chain_sequences_and_last_residues, or None if the file is not indexed or changed.
+        """
+        record = self.lookup(pdb_path)
+        return chain_info_from_record(record) if record is not None else None
+
+    def model_blocks(self, pdb_path):
+        """(offsets, ends) of the models of an unchanged indexed file, or None."""
+        record = self.lookup(pdb_path)
+        if record is None:
+            return None
+        offsets, ends = array.array("Q"), array.array("Q")
+        offsets.frombytes(record["model_offsets"])
+        ends.frombytes(record["model_ends"])
+        return offsets, ends
+
+    def is_fresh(self, pdb_path):
+        return self.lookup(pdb_path) is not None
+
+    def stats(self):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0), COALESCE(SUM(n_models), 0) FROM ensembles"
+            ).fetchone()
+        return {"files": row[0], "bytes": row[1], "models": row[2]}
+
+    def close(self):
+        self._conn.close()
+
+
+class EnsembleReader:
+    """
+    Random access to the models of a PDB ensemble through mmap. Model blocks come
+    from the index when the file is indexed and unchanged, otherwise the file is
+    scanned once. Models are numbered from 0, and model(i) / models(start, stop)
+    return memoryviews of the mapped file (no copy). Release the views before close().
+
+        with EnsembleReader(path, index) as reader:
+            out.write(reader.models(10, 20))
+    """
+
+    def __init__(self, pdb_path, index=None):
+        self.path = pdb_path
+        blocks = index.model_blocks(pdb_path) if index is not None else None
+        self.offsets, self.ends = blocks if blocks is not None else scan_model_blocks(pdb_path)
+        self._file = open(pdb_path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        self._view = memoryview(self._mm)
+        if not self.offsets and size:
+            # No MODEL records: the whole file is a single model
+            self.offsets, self.ends = array.array("Q", [0]), array.array("Q", [size])
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def model(self, i):
+        """Bytes of model i (MODEL line to ENDMDL line)."""
+        if not -len(self) <= i < len(self):
+            raise IndexError(f"model {i} out of range ({len(self)} models)")
+        return self._view[self.offsets[i]:self.ends[i]]
+
+    def models(self, start, stop):
+        """Bytes from model `start` to model `stop - 1`, as stored in the file."""
+        start, stop, _ = slice(start, stop).indices(len(self))
+        if start >= stop:
+            return self._view[0:0]
+        return self._view[self.offsets[start]:self.ends[stop - 1]]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.model(i)
+
+    def close(self):
+        self._view.release()
+        if isinstance(self._mm, mmap.mmap):
+            self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+_open_indexes = {}
+
+
+def open_index(path):
+    """
+    Shared EnsembleIndex per path in this process (used by process pool workers).
+    A connection inherited through fork is never reused: SQLite connections must not
+    cross processes, so a forked worker opens its own.
+    """
+    key = (os.getpid(), path)
+    if key not in _open_indexes:
+        _open_indexes[key] = EnsembleIndex(path)
+    return _open_indexes[key]
+
+
+def _scan_task(path):
+    """scan_ensemble for the process pool; errors are returned instead of raised."""
+    try:
+        with metrics.timer("pdb_parse_seconds", step="index"):
+            return path, scan_ensemble(path), None
+    except Exception as e:
+        return path, None, e
+
+
+def build(folders, index, workers=INDEX_WORKERS, force=False):
+    """Indexes the PDBs of the given folders that are new or changed. Returns (indexed, skipped, failed)."""
+    paths = []
+    for folder in folders:
+        if not os.path.exists(folder):
+            print(f"⚠️  Folder not found: {folder}")
+            continue
+        paths.extend(os.path.join(folder, f) for f in sorted(os.listdir(folder)) if f.endswith(".pdb"))
+
+    pending = paths if force else [p for p in paths if not index.is_fresh(p)]
+    skipped = len(paths) - len(pending)
+    print(f"PDBs found: {len(paths)} | up to date: {skipped} | to index: {len(pending)}")
+
+    indexed = failed = 0
+    n_bytes = 0
+    start = time.time()
+    progress = metrics.progress(len(pending), "PDBs")
+    with ProcessPoolExecutor(max(1, workers)) as pool:
+        results = (metrics.pool_map(pool, _scan_task, pending, chunksize=8) if workers > 1
+                   else map(_scan_task, pending))
+        for i, (path, record, error) in enumerate(results, start=1):
+            if error is not None:
+                failed += 1
+                metrics.count("pdbs_total", result="error")
+                progress.advance()
+                print(f"\n  ⚠️ Error indexing {os.path.basename(path)}: {error}")
+                continue
+            with metrics.timer("index_write_seconds"):
+                index.put(record)
+            metrics.count("pdbs_total", result="indexed")
+            progress.advance(n_bytes=record["size_bytes"])
+            indexed += 1
+            n_bytes += record["size_bytes"]
+            elapsed = max(time.time() - start, 1e-9)
+            print(f"  🔹 Indexed {i}/{len(pending)} ({n_bytes / 1024**2 / elapsed:.1f} MB/s)...", end="\r")
+    progress.close()
+    print()
+    return indexed, skipped, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or inspect the PDB ensemble index.")
+    parser.add_argument("--db", default=INDEX_PATH, help=f"Index file (default: {INDEX_PATH})")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_build = sub.add_parser("build", help="Index the PDBs of the given folders (new or changed files only)")
+    p_build.add_argument("folders", nargs="+")
+    p_build.add_argument("--workers", type=int, default=INDEX_WORKERS)
+    p_build.add_argument("--force", action="store_true", help="Re-index every file")
+    metrics.add_metrics_arguments(p_build)
+    p_show = sub.add_parser("show", help="Print the index record of PDB files")
+    p_show.add_argument("files", nargs="+")
+    sub.add_parser("stats", help="Print index statistics")
+    p_extract = sub.add_parser("extract", help="Write one model or a range of models (1-based, inclusive)")
+    p_extract.add_argument("file")
+    p_extract.add_argument("models", help="N or FIRST-LAST")
+    p_extract.add_argument("-o", "--output", help="Output PDB (default: stdout)")
+    args = parser.parse_args(argv)
+
+    index = EnsembleIndex(args.db)
+    if args.command == "extract":
+        first, _, last = args.models.partition("-")
+        first, last = int(first), int(last or first)
+        with EnsembleReader(args.file, index) as reader:
+            if not 1 <= first <= last <= len(reader):
+                print(f"⚠️  Models {args.models} out of range ({len(reader)} models)", file=sys.stderr)
+                return 1
+            data = reader.models(first - 1, last)
+            if args.output:
+                with open(args.output, "wb") as out:
+                    out.write(data)
+            else:
+                sys.stdout.buffer.write(data)
+                sys.stdout.flush()
+            data.release()
+        return 0
+
+    print(f"🗂️  Index: {index.path}")
+
+    if args.command == "build":
+        with metrics.session(args, "ensemble_index"):
+            indexed, skipped, failed = build(args.folders, index, workers=args.workers, force=args.force)
+        print(f"✅ Indexed: {indexed} | up to date: {skipped} | errors: {failed}")
+        return 1 if failed else 0
+    elif args.command == "show":
+        for pdb_file in args.files:
+            record = index.get(pdb_file)
+            if record is None:
+                print(f"{pdb_file}: not indexed")
+                continue
+            state = "" if index.is_fresh(pdb_file) else " (changed since indexed)"
+            print(f"{record['path']}{state}")
+            print(f"  size: {record['size_bytes']} bytes | models: {record['n_models']} | "
+                  f"atoms (first model): {record['n_atoms']} | residues: {record['n_residues']}")
+            print(f"  content hash: {record['content_hash']} | first model hash: {record['first_model_hash']}")
+            for c in record["chains"]:
+                print(f"  chain {c['chain_id']!r}: residues {c['start_resseq']}-{c['end_resseq']} "
+                      f"({c['n_residues']}) {c['sequence']}")
+    elif args.command == "stats":
+        stats = index.stats()
+        print(f"Files: {stats['files']} | size: {stats['bytes'] / 1024**3:.2f} GB | models: {stats['models']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
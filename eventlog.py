@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Structured event log
+--------------------
+JSON-lines event log shared by the workflow scripts. Every event is one line:
+
+    {"ts": "2026-01-31T12:00:00.123", "level": "info", "event": "pdb_generated", "pdb": "...", ...}
+
+Events are queued and written by a background thread, in large buffered writes,
+so the scripts never wait on a (networked) filesystem. An event can also carry a
+console message, printed right away (in order with the other output of the
+script) if its level is shown:
+
+ - level: minimum level written to the log file (--log-level, default debug)
+ - console: info and above by default; --verbose adds debug (per-file lines),
+   --quiet keeps warnings and errors only
+
+The events of a run are also kept in memory (EventLog.records), and the
+human-readable summaries (json_generation.py summary, batch report) are rendered
+from them at the end of the run.
+
+Usage:
+    python eventlog.py <events.jsonl> [--level warning] [--event pdb_error] [--json]
+"""
+
+import sys
+import json
+import time
+import atexit
+import queue
+import argparse
+import threading
+from datetime import datetime
+
+# === CONFIGURATION ===
+LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40}
+LOG_LEVEL = "debug"           # minimum level written to the log file
+BUFFER_SIZE = 1024 * 1024     # bytes buffered before the log file is written
+FLUSH_INTERVAL = 2.0          # seconds between log file flushes
+MAX_BATCH = 1000              # events written per wake-up of the writer thread
+
+_STOP = object()
+
+
+class EventLog:
+    """
+    Buffered, asynchronous JSON-lines event log with console messages.
+    log(level, event, msg=None, **fields): fields are the JSON fields of the event;
+    msg is the console text (not printed when None).
+    """
+
+    def __init__(self, path=None, level=LOG_LEVEL, quiet=False, verbose=False, stream=None, keep=True):
+        self.path = path
+        self.level = LEVELS[level]
+        self.console_level = LEVELS["warning" if quiet else "debug" if verbose else "info"]
+        self.stream = stream  # None: sys.stdout at the time of the message
+        self.records = [] if keep else None
+        self._file = open(path, "a", encoding="utf-8", buffering=BUFFER_SIZE) if path else None
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        if self._file is not None:
+            self._thread = threading.Thread(target=self._writer, daemon=True)
+            self._thread.start()
+            # Pending events are written even if the script stops on an exception
+            atexit.register(self.close)
+
+    def log(self, level, event, msg=None, **fields):
+        record = {"ts": time.time(), "level": level, "event": event, **fields}
+        if self.records is not None:
+            self.records.append(record)
+        severity = LEVELS[level]
+        if self._file is not None and severity >= self.level:
+            self._queue.put(record)
+        if msg is not None and severity >= self.console_level:
+            print(msg, file=self.stream)
+        return record
+
+    def debug(self, event, msg=None, **fields):
+        return self.log("debug", event, msg, **fields)
+
+    def info(self, event, msg=None, **fields):
+        return self.log("info", event, msg, **fields)
+
+    def warning(self, event, msg=None, **fields):
+        return self.log("warning", event, msg, **fields)
+
+    def error(self, event, msg=None, **fields):
+        return self.log("error", event, msg, **fields)
+
+    # --- writer thread ---
+    def _writer(self):
+        last_flush = time.monotonic()
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < MAX_BATCH:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = _STOP in batch
+            lines = [format_record(record) for record in batch if record is not _STOP]
+            if lines:
+                self._file.write("\n".join(lines) + "\n")
+            if stop or time.monotonic() - last_flush >= FLUSH_INTERVAL:
+                self._file.flush()
+                last_flush = time.monotonic()
+            if stop:
+                return
+
+    def close(self):
+        """Writes the pending events and closes the log file."""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._file.close()
+        atexit.unregister(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def format_record(record):
+    """JSON line of an event, with the timestamp as local ISO time (ms)."""
+    ts = datetime.fromtimestamp(record["ts"]).isoformat(timespec="milliseconds")
+    return json.dumps(dict(record, ts=ts), ensure_ascii=False, default=str)
+
+
+def read_events(path):
+    """Events of a JSON-lines log (e.g. to render a summary again)."""
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def add_log_arguments(parser, default_path):
+    """--event-log / --log-level / --quiet / --verbose options shared by the scripts."""
+    parser.add_argument("--event-log", metavar="PATH", default=default_path,
+                        help=f"JSON-lines event log, appended to; '' disables it (default: {default_path})")
+    parser.add_argument("--log-level", choices=list(LEVELS), default=LOG_LEVEL,
+                        help=f"Minimum level written to the event log (default: {LOG_LEVEL})")
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument("--quiet", action="store_true", help="Only print warnings and errors")
+    output.add_argument("--verbose", action="store_true", help="Also print a line per file")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Filter the events of a JSON-lines event log.")
+    parser.add_argument("path")
+    parser.add_argument("--level", choices=list(LEVELS), default="debug", help="Minimum level shown")
+    parser.add_argument("--event", action="append", help="Only these event types (repeatable)")
+    parser.add_argument("--json", action="store_true", help="Print the events as JSON lines")
+    args = parser.parse_args(argv)
+
+    for record in read_events(args.path):
+        if LEVELS.get(record.get("level"), 0) < LEVELS[args.level]:
+            continue
+        if args.event and record.get("event") not in args.event:
+            continue
+        if args.json:
+            print(json.dumps(record, ensure_ascii=False))
+        else:
+            fields = " ".join(f"{k}={v}" for k, v in record.items() if k not in ("ts", "level", "event", "msg"))
+            print(f"{record['ts']} {record['level'].upper():<7} {record['event']} {fields}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Rate-limited HTTP GET with retries
+----------------------------------
+Shared by the metadata lookups in description.py and the PED submission scripts.
+Every request:
+ - takes a token from a per-host token bucket (HOST_RATES, requests/second)
+ - holds one of MAX_CONCURRENT_PER_HOST slots while in flight
+ - is retried with exponential backoff on timeouts, connection errors, 429 and 5xx,
+   honoring the Retry-After header when the server sends one
+
+When the retries are exhausted TemporaryLookupError is raised, so callers can tell
+"temporarily failed" (retry later, do not cache) apart from "not found" (404).
+
+MultipartFileStream streams a file upload from disk (optionally gzip-compressed on
+the fly), so memory use during an upload does not depend on the file size.
+"""
+
+import os
+import time
+import uuid
+import zlib
+import random
+import threading
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+import metrics
+
+# === CONFIGURATION ===
+HOST_RATES = {
+    "rest.uniprot.org": 10.0,
+    "disprot.org": 5.0,
+}
+DEFAULT_RATE = 5.0            # requests/second for hosts not listed above
+MAX_CONCURRENT_PER_HOST = 8
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0            # seconds, doubled after each attempt
+BACKOFF_MAX = 60.0
+RETRY_STATUS = {429, 500, 502, 503, 504}
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # bytes read from disk at a time
+PROGRESS_INTERVAL = 5.0           # seconds between upload progress lines
+
+
+class TemporaryLookupError(requests.exceptions.RequestException):
+    """The remote service could not be reached or kept failing (timeouts, 429, 5xx)."""
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, up to `burst` stored."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a token is available. Tokens are reserved, so waiters are served in order."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+
+
+_buckets = {}
+_slots = {}
+_registry_lock = threading.Lock()
+
+
+def _host_limits(host):
+    with _registry_lock:
+        if host not in _buckets:
+            _buckets[host] = TokenBucket(HOST_RATES.get(host, DEFAULT_RATE))
+            _slots[host] = threading.BoundedSemaphore(MAX_CONCURRENT_PER_HOST)
+        return _buckets[host], _slots[host]
+
+
+def retry_after_seconds(response):
+    """Seconds requested by a Retry-After header (delta-seconds or HTTP date), or None."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+def backoff_delay(attempt):
+    """Exponential backoff with a little jitter."""
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def mount_pool(session, maxsize):
+    """Mounts HTTP(S) adapters on session keeping up to maxsize connections per host (one per worker)."""
+    for prefix in ("http://", "https://"):
+        session.mount(prefix, HTTPAdapter(pool_connections=1, pool_maxsize=maxsize))
+    return session
+
+
+def request_not_sent(error):
+    """True if a requests error happened before the request reached the server (connection failed)."""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, urllib3.exceptions.NewConnectionError)
+
+
+def request_with_retries(session, method, url, retries=MAX_RETRIES, rate_limit=True, idempotent=True, **kwargs):
+    """
+    Sends `method` `url` through `session`, retrying timeouts, connection errors, 429 and 5xx.
+    With rate_limit=True the per-host rate and concurrency limits are applied.
+    idempotent=False is for requests that must not be applied twice (e.g. creating a
+    draft): they are only retried when the server did not process them (connection
+    failed, 429), not after a read timeout or a 5xx.
+    File objects passed in `files` (and a seekable `data` body) are rewound before
+    every attempt, so an interrupted upload is sent again from the file on disk.
+    Returns the response for any non-retryable status (2xx, 404, other 4xx).
+    Raises TemporaryLookupError once `retries` retries have failed.
+    """
+    host = urlparse(url).netloc
+    bucket, slots = _host_limits(host) if rate_limit else (None, None)
+    last_error = None
+    for attempt in range(retries + 1):
+        for f in list((kwargs.get("files") or {}).values()) + [kwargs.get("data")]:
+            if hasattr(f, "seek"):
+                f.seek(0)
+        delay = None
+        try:
+            if rate_limit:
+                with metrics.timer("http_rate_limit_wait_seconds", host=host):
+                    bucket.acquire()
+                with slots, metrics.timer("http_request_seconds", host=host, method=method):
+                    response = session.request(method, url, **kwargs)
+            else:
+                with metrics.timer("http_request_seconds", host=host, method=method):
+                    response = session.request(method, url, **kwargs)
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+            last_error = e
+            metrics.count("http_errors_total", host=host, error=type(e).__name__)
+            if not idempotent and not request_not_sent(e):
+                break
+        else:
+            metrics.count("http_responses_total", host=host, status=response.status_code)
+            if response.status_code not in RETRY_STATUS:
+                return response
+            last_error = f"HTTP {response.status_code}"
+            delay = retry_after_seconds(response)
+            if not idempotent and response.status_code != 429:
+                break
+
+        if attempt < retries:
+            if delay is None:
+                delay = backoff_delay(attempt)
+            metrics.count("http_retries_total", host=host)
+            with metrics.timer("http_backoff_seconds", host=host):
+                time.sleep(delay)
+
+    raise TemporaryLookupError(f"{method} {url}: {last_error} (after {attempt + 1} attempts)")
+
+
+def get_with_retries(session, url, params=None, timeout=5, retries=MAX_RETRIES):
+    """Rate-limited GET with retries (see request_with_retries)."""
+    return request_with_retries(session, "GET", url, retries=retries, params=params, timeout=timeout)
+
+
+class UploadProgress:
+    """Prints bytes sent and throughput of an upload every PROGRESS_INTERVAL seconds."""
+
+    def __init__(self, label, total=None, interval=PROGRESS_INTERVAL):
+        self.label = label
+        self.total = total
+        self.interval = interval
+        self.reset()
+
+    def reset(self):
+        self.sent = 0
+        self.start = self.last = time.monotonic()
+
+    def __call__(self, n_bytes):
+        self.sent += n_bytes
+        now = time.monotonic()
+        if now - self.last >= self.interval:
+            self.last = now
+            self.report()
+
+    def report(self):
+        elapsed = max(time.monotonic() - self.start, 1e-9)
+        total = f"/{self.total / 1024**2:.1f}" if self.total else ""
+        print(f"   ⬆️  {self.label}: {self.sent / 1024**2:.1f}{total} MB "
+              f"({self.sent / 1024**2 / elapsed:.1f} MB/s)")
+
+
+class MultipartFileStream:
+    """
+    File-like multipart/form-data body with a single file field, read from disk in
+    UPLOAD_CHUNK_SIZE pieces. Same body as requests' files={field: open(path, "rb")},
+    but never held in memory. Pass it as data= with headers={"Content-Type": body.content_type}.
+    With gzip=True the file is compressed on the fly and sent as <filename>.gz; the
+    length is then unknown and requests uses chunked transfer encoding.
+    Rewinding with seek(0) restarts the upload from the beginning of the file.
+    """
+
+    def __init__(self, field, path, filename=None, gzip=False, progress=None):
+        self.path = path
+        self.gzip = gzip
+        self.progress = progress
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={self.boundary}"
+        filename = filename or os.path.basename(path)
+        part_headers = f'Content-Disposition: form-data; name="{field}"; filename="{filename}{".gz" if gzip else ""}"\r\n'
+        if gzip:
+            part_headers += "Content-Type: application/gzip\r\n"
+        self._head = f"--{self.boundary}\r\n{part_headers}\r\n".encode()
+        self._tail = f"\r\n--{self.boundary}--\r\n".encode()
+        if not gzip:
+            # requests reads `len` to send Content-Length instead of chunked encoding
+            self.len = len(self._head) + os.path.getsize(path) + len(self._tail)
+        self._file = None
+        self._chunks = None
+        self._buffer = b""
+        self._offset = 0
+
+    def _generate(self):
+        yield self._head
+        compressor = zlib.compressobj(wbits=31) if self.gzip else None  # wbits=31: gzip container
+        while True:
+            chunk = self._file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            if self.progress is not None:
+                self.progress(len(chunk))
+            metrics.count("http_upload_bytes_total", len(chunk))
+            yield compressor.compress(chunk) if compressor else chunk
+        if compressor:
+            yield compressor.flush()
+        yield self._tail
+
+    def seek(self, offset, whence=0):
+        if offset != 0 or whence != 0:
+            raise OSError("MultipartFileStream can only be rewound to the start")
+        self.close()
+        if self.progress is not None and hasattr(self.progress, "reset"):
+            self.progress.reset()
+
+    def read(self, size=-1):
+        if self._file is None:
+            self._file = open(self.path, "rb")
+            self._chunks = self._generate()
+        parts = []
+        while size != 0:
+            if self._offset >= len(self._buffer):
+                chunk = next(self._chunks, None)
+                if chunk is None:
+                    break
+                self._buffer, self._offset = chunk, 0
+                continue
+            end = len(self._buffer) if size < 0 else min(len(self._buffer), self._offset + size)
+            parts.append(self._buffer[self._offset:end])
+            if size > 0:
+                size -= end - self._offset
+            self._offset = end
+        return b"".join(parts)
+
+    def __iter__(self):
+        while True:
+            data = self.read(UPLOAD_CHUNK_SIZE)
+            if not data:
+                return
+            yield data
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        self._file = None
+        self._chunks = None
+        self._buffer = b""
+        self._offset = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
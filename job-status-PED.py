@@ -0,0 +1,148 @@
+import requests
+import time
+import heapq
+import argparse
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import metrics
+from http_utils import request_with_retries, mount_pool, TokenBucket
+from tracking_store import open_store, SUBMIT_ERROR
+
+url = "http://127.0.0.1:4205/v1"
+log_file = "job_tracking_log.csv"     # CSV export of the tracking store
+tracking_db = "job_tracking.sqlite"
+
+MAX_WORKERS = 16          # concurrent status requests
+MAX_RPS = 20.0            # status requests per second (all jobs together)
+MIN_INTERVAL = 10.0       # seconds between polls of a job, at first
+MAX_INTERVAL = 600.0      # ... growing up to this for long jobs
+BACKOFF_FACTOR = 1.5      # interval growth after each poll without status change
+EXPORT_INTERVAL = 60.0    # seconds between CSV exports while polling
+MAX_ERRORS = 5            # consecutive failed polls after which a job is given up (until the next run)
+
+# A job is not polled any more once its status contains one of these
+TERMINAL_KEYWORDS = ("finished", "deleted")
+# Status stored for drafts/ensembles the server no longer has (404, 410)
+GONE_STATUS = "deleted (not found on server)"
+
+session = requests.Session()  # connection pool sized to --workers in main()
+
+
+def is_terminal(status):
+    return bool(status) and any(k in str(status).lower() for k in TERMINAL_KEYWORDS)
+
+
+def get_job_status(draft_id):
+    """Current job status of the draft's first ensemble (e001)."""
+    with metrics.timer("ped_stage_seconds", stage="status"):
+        response = request_with_retries(session, "GET", f"{url}/drafts/{draft_id}/ensembles/e001",
+                                        retries=1, rate_limit=False, timeout=30)
+        response.raise_for_status()
+    return response.json().get("job", {}).get("status")
+
+
+def main(once=False, workers=MAX_WORKERS, max_rps=MAX_RPS):
+    mount_pool(session, workers)
+    store = open_store(tracking_db, log_file)
+    jobs = {row["filename"]: row for row in store.rows()
+            if row["draft_id"] and row["status"] != SUBMIT_ERROR and not is_terminal(row["status"])}
+    print(f"🔭 Polling {len(jobs)} non-terminal jobs "
+          f"({workers} workers, ≤{max_rps:g} requests/s)")
+
+    # Heap of (next poll time, filename); every job is polled once right away
+    now = time.monotonic()
+    schedule = [(now, filename) for filename in jobs]
+    heapq.heapify(schedule)
+    intervals = {filename: MIN_INTERVAL for filename in jobs}
+    errors = {filename: 0 for filename in jobs}  # consecutive failed polls
+    bucket = TokenBucket(max_rps)
+    finished = 0
+    given_up = []
+    last_export = time.monotonic()
+    progress = metrics.progress(len(jobs), "jobs")
+
+    with ThreadPoolExecutor(workers) as pool:
+        in_flight = {}
+        while schedule or in_flight:
+            # Send every due poll, within the worker and rate limits
+            while schedule and schedule[0][0] <= time.monotonic() and len(in_flight) < workers:
+                _, filename = heapq.heappop(schedule)
+                bucket.acquire()
+                in_flight[pool.submit(get_job_status, jobs[filename]["draft_id"])] = filename
+
+            timeout = max(0.0, schedule[0][0] - time.monotonic()) if schedule else None
+            if not in_flight:
+                time.sleep(timeout)
+                continue
+            done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                filename = in_flight.pop(future)
+                row = jobs[filename]
+                try:
+                    status = future.result()
+                    errors[filename] = 0
+                except (requests.exceptions.RequestException, ValueError) as e:
+                    response = getattr(e, "response", None)
+                    if response is not None and response.status_code in (404, 410):
+                        status = GONE_STATUS  # terminal: the draft or its ensemble was deleted
+                    else:
+                        print(f"❌ {filename} (draft {row['draft_id']}): {e}")
+                        status = row["status"]
+                        errors[filename] += 1
+
+                metrics.count("status_polls_total", status=status)
+                if status != row["status"]:
+                    print(f"[{datetime.now().strftime('%H:%M:%S')}] {filename} (draft {row['draft_id']}): "
+                          f"{row['status']} → {status}")
+                    row["status"] = status
+                    store.update(filename, status=status)
+                    intervals[filename] = MIN_INTERVAL
+                else:
+                    intervals[filename] = min(MAX_INTERVAL, intervals[filename] * BACKOFF_FACTOR)
+
+                if is_terminal(status):
+                    finished += 1
+                    progress.advance()
+                    if "deleted" in status.lower():
+                        print(f"⚠️ Job of {filename} was deleted.")
+                elif errors[filename] >= MAX_ERRORS:
+                    # Status kept in the store, so the next run polls the job again
+                    print(f"⚠️ Giving up on {filename} after {MAX_ERRORS} failed polls (status kept: {status})")
+                    metrics.count("status_polls_given_up_total")
+                    given_up.append(filename)
+                    progress.advance()
+                elif not once:
+                    heapq.heappush(schedule, (time.monotonic() + intervals[filename], filename))
+
+            if time.monotonic() - last_export > EXPORT_INTERVAL:
+                store.export_csv(log_file)
+                last_export = time.monotonic()
+                print(f"📊 {finished}/{len(jobs)} jobs in a terminal state")
+
+    progress.close()
+    store.export_csv(log_file)
+    print(f"\n✅ {finished}/{len(jobs)} jobs in a terminal state. Tracking log exported to {log_file}")
+    if given_up:
+        print(f"⚠️ {len(given_up)} jobs given up after {MAX_ERRORS} failed polls: {', '.join(given_up)}")
+
+
+def add_arguments(parser):
+    parser.add_argument("--once", action="store_true",
+                        help="Poll every non-terminal job once and exit")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS,
+                        help=f"Concurrent status requests (default: {MAX_WORKERS})")
+    parser.add_argument("--max-rps", type=float, default=MAX_RPS,
+                        help=f"Maximum status requests per second (default: {MAX_RPS:g})")
+    metrics.add_metrics_arguments(parser)
+
+
+def run(args):
+    with metrics.session(args, "job-status-PED"):
+        main(once=args.once, workers=args.workers, max_rps=args.max_rps)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Poll the status of submitted PED ensemble jobs.")
+    add_arguments(parser)
+    run(parser.parse_args())
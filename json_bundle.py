@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+JSON bundles
+------------
+Compact alternative to one indent=4 JSON file per ensemble: all the descriptions
+(or constructs) of an output folder go into one JSON-lines bundle, with an offset
+index next to it, so a folder of N ensembles is 4 files instead of 2N.
+
+    json_description/<folder>/descriptions.jsonl       {"name": "<PDB base name>", "data": {...}} per line
+    json_description/<folder>/descriptions.jsonl.idx   {"compression": null, "entries": {"<name>": [offset, length]}}
+    json_construct/<folder>/constructs.jsonl (+ .idx)
+
+With compression "zstd" (needs the zstandard package) the bundle is
+descriptions.jsonl.zst and every record is an independent zstd frame, so any
+entry is still read with a single seek. Bundles are append-only: a regenerated
+PDB gets a new record and the index points to it. Shards write their own
+bundles (descriptions.shard-0-of-4.jsonl).
+
+PayloadReader reads the payloads of a folder from its bundles or from the
+per-PDB JSON files, whichever exists. When several bundles have the same entry,
+the one with the newest index wins; when a PDB has both a bundle entry and a JSON
+file (folder regenerated in the other output format), the newer of the index and
+the file wins.
+
+Usage:
+    python json_bundle.py list json_description/<folder>
+    python json_bundle.py show json_description/<folder> <PDB base name>
+"""
+
+import os
+import sys
+import json
+import glob
+import argparse
+import metrics
+from sharding import shard_path
+
+try:
+    import zstandard
+except ImportError:  # optional, only needed for zstd bundles
+    zstandard = None
+
+# === CONFIGURATION ===
+# kind -> (bundle name, suffix of the per-PDB JSON files)
+KINDS = {
+    "description": ("descriptions", ".json"),
+    "construct": ("constructs", "_const.json"),
+}
+COMPRESSIONS = [None, "zstd"]
+ZSTD_LEVEL = 10
+INDEX_SUFFIX = ".idx"
+
+_compressor = None
+_decompressor = None
+
+
+class BundleError(Exception):
+    pass
+
+
+def check_compression(compression):
+    """Raises BundleError if the compression is unknown or its package is missing."""
+    if compression not in COMPRESSIONS:
+        raise BundleError(f"Unknown bundle compression: {compression}")
+    if compression == "zstd" and zstandard is None:
+        raise BundleError("zstd bundles need the zstandard package (pip install zstandard)")
+
+
+def bundle_path(folder, kind, compression=None, shard=None):
+    """Path of the bundle written by a run (shard) into folder."""
+    name, _ = KINDS[kind]
+    path = shard_path(os.path.join(folder, f"{name}.jsonl"), shard)
+    return path + ".zst" if compression == "zstd" else path
+
+
+def file_path(folder, kind, name):
+    """Path of the per-PDB JSON file of an entry."""
+    return os.path.join(folder, name + KINDS[kind][1])
+
+
+# === RECORDS ===
+def encode_record(name, payload, compression=None, encoded=None):
+    """
+    One bundle record (compact JSON line, or a zstd frame of it). encoded: the payload
+    already encoded as compact JSON (e.g. description.encode_description).
+    """
+    global _compressor
+    if encoded is None:
+        encoded = json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+    line = '{"name":' + json.dumps(name, ensure_ascii=False) + ',"data":' + encoded + "}"
+    record = (line + "\n").encode("utf-8")
+    if compression == "zstd":
+        if _compressor is None:
+            _compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+        record = _compressor.compress(record)
+    return record
+
+
+def decode_record(record, compression=None):
+    """Returns (name, payload) of a bundle record."""
+    global _decompressor
+    if compression == "zstd":
+        if zstandard is None:
+            raise BundleError("Reading zstd bundles needs the zstandard package (pip install zstandard)")
+        if _decompressor is None:
+            _decompressor = zstandard.ZstdDecompressor()
+        record = _decompressor.decompress(record)
+    entry = json.loads(record)
+    return entry["name"], entry["data"]
+
+
+# === INDEX ===
+def read_index(path):
+    """{"compression": ..., "entries": {name: [offset, length]}}; empty if missing or unreadable."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+        return {"compression": index.get("compression"), "entries": index.get("entries", {})}
+    except (OSError, ValueError):
+        return {"compression": None, "entries": {}}
+
+
+def bundle_entries(folder, kind):
+    """
+    {name: (bundle path, compression, offset, length)} over every bundle of a kind in
+    folder; entries of newer indexes replace those of older ones.
+    """
+    name, _ = KINDS[kind]
+    index_paths = glob.glob(os.path.join(glob.escape(folder), f"{name}*{INDEX_SUFFIX}"))
+    entries = {}
+    for index_path in sorted(index_paths, key=os.path.getmtime):
+        index = read_index(index_path)
+        path = index_path[:-len(INDEX_SUFFIX)]
+        for entry, (offset, length) in index["entries"].items():
+            entries[entry] = (path, index["compression"], offset, length)
+    return entries
+
+
+# === WRITER ===
+class BundleWriter:
+    """
+    Appends records to a bundle. Only one process may write a bundle at a time (runs
+    write their own shard bundle); the index is saved by save() and close().
+    truncate=True starts a new bundle (e.g. --force regenerates everything).
+    """
+
+    def __init__(self, folder, kind, compression=None, shard=None, truncate=False):
+        check_compression(compression)
+        self.compression = compression
+        self.path = bundle_path(folder, kind, compression, shard)
+        self.index_path = self.path + INDEX_SUFFIX
+        if truncate:
+            for path in (self.path, self.index_path):
+                if os.path.exists(path):
+                    os.remove(path)
+        self.entries = read_index(self.index_path)["entries"]
+        self._file = open(self.path, "ab")
+        # Records past the indexed ones (interrupted run) are not referenced, just skipped
+        self._offset = self._file.seek(0, os.SEEK_END)
+
+    def append(self, name, record):
+        """Appends an encoded record (encode_record); returns a 'bundle#name' reference."""
+        self._file.write(record)
+        self.entries[name] = [self._offset, len(record)]
+        self._offset += len(record)
+        return f"{self.path}#{name}"
+
+    def save(self):
+        """Flushes the bundle and writes its index atomically (temporary file + rename)."""
+        self._file.flush()
+        tmp_path = self.index_path + ".tmp"
+        with metrics.timer("bundle_index_write_seconds"):
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"compression": self.compression, "entries": self.entries}, f, separators=(",", ":"))
+            os.replace(tmp_path, self.index_path)
+
+    def close(self):
+        self.save()
+        self._file.close()
+
+
+# === READER ===
+class PayloadReader:
+    """
+    Description or construct payloads of an output folder, from bundles or per-PDB JSON
+    files (the newer of the two if a PDB has both).
+    """
+
+    def __init__(self, folder, kind):
+        self.folder = folder
+        self.kind = kind
+        self.entries = bundle_entries(folder, kind) if os.path.isdir(folder) else {}
+        self._files = {}  # bundle path -> open file
+        self._index_mtimes = {}  # bundle path -> mtime of its index
+
+    def _in_bundle(self, name):
+        """True if the entry is read from a bundle: it has no JSON file, or the file is older than the index."""
+        if name not in self.entries:
+            return False
+        try:
+            file_mtime = os.path.getmtime(file_path(self.folder, self.kind, name))
+        except OSError:
+            return True
+        path = self.entries[name][0]
+        if path not in self._index_mtimes:
+            self._index_mtimes[path] = os.path.getmtime(path + INDEX_SUFFIX)
+        return self._index_mtimes[path] >= file_mtime
+
+    def __contains__(self, name):
+        return name in self.entries or os.path.exists(file_path(self.folder, self.kind, name))
+
+    def location(self, name):
+        """Where an entry is (or would be) read from, for messages."""
+        if self._in_bundle(name):
+            return f"{self.entries[name][0]}#{name}"
+        return file_path(self.folder, self.kind, name)
+
+    def load(self, name):
+        """Payload of an entry; raises OSError if there is none."""
+        if not self._in_bundle(name):
+            with open(file_path(self.folder, self.kind, name), "r", encoding="utf-8") as f:
+                return json.load(f)
+        path, compression, offset, length = self.entries[name]
+        if path not in self._files:
+            self._files[path] = open(path, "rb")
+        f = self._files[path]
+        f.seek(offset)
+        record_name, payload = decode_record(f.read(length), compression)
+        if record_name != name:
+            raise BundleError(f"Index of {path} is out of date ({name} at offset {offset} is {record_name})")
+        return payload
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect the JSON bundles of an output folder.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("list", help="Entries of the folder bundles")
+    p.add_argument("folder")
+    p.add_argument("--kind", choices=list(KINDS), help="Only this kind (default: the one found)")
+    p = sub.add_parser("show", help="Print the JSON of one entry, as in the per-PDB files")
+    p.add_argument("folder")
+    p.add_argument("name", help="PDB file name without .pdb")
+    p.add_argument("--kind", choices=list(KINDS))
+    args = parser.parse_args(argv)
+
+    kinds = [args.kind] if args.kind else [k for k in KINDS if bundle_entries(args.folder, k)]
+    if not kinds:
+        print(f"⚠️  No bundles found in {args.folder}")
+        return 1
+
+    for kind in kinds:
+        with PayloadReader(args.folder, kind) as reader:
+            if args.command == "list":
+                for name, (path, compression, offset, length) in sorted(reader.entries.items()):
+                    print(f"{name}\t{os.path.basename(path)}\t{offset}\t{length}")
+            elif args.name in reader:
+                print(json.dumps(reader.load(args.name), indent=4, ensure_ascii=False))
+            else:
+                print(f"❌ {args.name} not found in {reader.location(args.name)}")
+                return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
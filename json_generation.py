@@ -1,8 +1,17 @@
 import os
 import json
+import argparse
 from datetime import datetime
-from description import create_description_json, get_uniprot_name, get_disprot_id
-from construct import get_chain_sequences_and_last_residues, create_construct_json
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import metrics
+from eventlog import EventLog, add_log_arguments, LOG_LEVEL
+from description import (create_description_json, encode_description, get_workflow, get_uniprot_name, get_disprot_id,
+                         resolve_uniprot_names, use_templates, get_templates, TemplateError)
+from metadata_cache import get_cache
+from construct import get_chain_sequences_and_last_residues, create_construct_json, hash_first_model
+from ensemble_index import open_index, chain_info_from_record
+from json_bundle import BundleWriter, BundleError, bundle_entries, encode_record, check_compression
+from sharding import select_shard, shard_path, shard_paths, add_shard_arguments, SHARD_BY
 
 # === CONFIGURATION ===
 pdb_folders = [
@@ -12,199 +21,693 @@ pdb_folders = [
 base_desc_folder = "json_description"
 base_construct_folder = "json_construct"
 summary_path = "summary_json_generation.txt"
-
-# === VARIABLES ===
-summary_lines = []
-summary_lines.append("=== JSON Generation Summary ===\n")
-summary_lines.append(f"Date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-summary_lines.append(f"Output folders: {base_desc_folder} | {base_construct_folder}\n\n")
-
-total_pdbs = 0
-total_processed = 0
-merged_entries = []  # merged IDs (skipped)
-
-# === MAIN LOOP ===
-for folder_idx, pdb_folder in enumerate(pdb_folders, start=1):
-    if not os.path.exists(pdb_folder):
-        warning = f"⚠️  Folder not found: {pdb_folder}\n"
-        print(warning)
-        summary_lines.append(warning)
-        continue
-
+merged_list_path = "merged_pdb_list.txt"
+# JSON-lines event log (eventlog.py), appended to; the summary is rendered from the events
+event_log_path = "json_generation_events.jsonl"
+
+# Ensemble index (ensemble_index.py) to take chain sequences and first-model hashes
+# from, instead of parsing the PDBs; None parses every PDB
+ensemble_index_path = None
+
+# Output layout: "files" (an indent=4 JSON per PDB for descriptions and constructs) or
+# "bundle" (one compact JSON-lines bundle per output folder, see json_bundle.py);
+# bundles can be zstd-compressed (BUNDLE_COMPRESSION = "zstd", needs zstandard)
+OUTPUT_FORMAT = "files"
+BUNDLE_COMPRESSION = None
+
+# Description templates file (see description_templates.toml); None uses
+# description.TEMPLATES_PATH ($PED_DESCRIPTION_TEMPLATES or description_templates.toml)
+templates_path = None
+
+# Concurrent UniProt/DisProt requests used when --workers > 1
+LOOKUP_THREADS = 8
+
+# Per-folder manifest of generated JSONs (stored in the description folder).
+# Bump GENERATOR_VERSION when the JSON content changes, to regenerate everything
+# (a change of the description templates is detected from their hash).
+MANIFEST_NAME = "manifest.json"
+GENERATOR_VERSION = "1"
+MANIFEST_SAVE_EVERY = 200
+
+
+# === HELPERS ===
+def lookup_metadata(uniprot_id, uniprot_names=None):
+    """
+    Returns (protein_name, final_id, disprot_id) for a UniProt ID.
+    uniprot_names: optional {uniprot_id: (protein_name, final_id)} from resolve_uniprot_names.
+    DisProt is only queried for valid, non-merged IDs.
+    """
+    if uniprot_names is not None and uniprot_id in uniprot_names:
+        protein_name, final_id = uniprot_names[uniprot_id]
+    else:
+        protein_name, final_id = get_uniprot_name(uniprot_id)
+    disprot_id = None
+    if final_id == uniprot_id and protein_name is not None:
+        disprot_id = get_disprot_id(uniprot_id)
+    return protein_name, final_id, disprot_id
+
+
+def build_pdb_payloads(pdb_folder, pdb_file, protein_name, disprot_id, chain_info=None):
+    """
+    Parses one PDB and returns its (description, construct) payloads, as written to the
+    JSON files (also posted directly by deposit_pipeline.py).
+    protein_name=None generates the "By Sequence" construct used for inactive IDs.
+    chain_info (from the ensemble index) avoids parsing the PDB.
+    """
+    pdb_base = os.path.splitext(pdb_file)[0]
+    original_id = pdb_base.split("_")[0]
+    pdb_path = os.path.join(pdb_folder, pdb_file)
+
+    # Template of the workflow (description_templates.toml) with the per-entry fields filled in
+    data_desc = create_description_json(original_id, get_workflow(pdb_file), protein_name,
+                                        disprot_id if protein_name is not None else None)
+
+    if chain_info is None:
+        chain_info = get_chain_sequences_and_last_residues(pdb_path)
+    if protein_name is None:
+        data_construct = [{
+            "chain_name": chain,
+            "fragments": [{
+                "description": f"{original_id}",
+                "source_sequence": info.get("sequence", ""),
+                "definition_type": "By Sequence"
+            }]
+        } for chain, info in chain_info.items()]
+    else:
+        data_construct = create_construct_json(chain_info, original_id, protein_name)
+    return data_desc, data_construct
+
+
+def write_pdb_jsons(pdb_folder, pdb_file, desc_folder, construct_folder, protein_name, disprot_id,
+                    chain_info=None):
+    """
+    Parses one PDB and writes its description and construct JSONs (see build_pdb_payloads).
+    Returns (desc_path, construct_path).
+    """
+    data_desc, data_construct = build_pdb_payloads(pdb_folder, pdb_file, protein_name, disprot_id, chain_info)
+    return write_payloads(pdb_file, desc_folder, construct_folder, data_desc, data_construct)
+
+
+def write_payloads(pdb_file, desc_folder, construct_folder, data_desc, data_construct):
+    """Writes the description and construct JSONs of a PDB; returns (desc_path, construct_path)."""
+    pdb_base = os.path.splitext(pdb_file)[0]
+    desc_path = os.path.join(desc_folder, f"{pdb_base}.json")
+    construct_path = os.path.join(construct_folder, f"{pdb_base}_const.json")
+
+    with metrics.timer("json_write_seconds"):
+        with open(desc_path, "w", encoding="utf-8") as f:
+            f.write(encode_description(data_desc))
+        with open(construct_path, "w", encoding="utf-8") as f:
+            json.dump(data_construct, f, indent=4, ensure_ascii=False)
+
+    return desc_path, construct_path
+
+
+def process_pdb(pdb_folder, pdb_file, desc_folder, construct_folder, protein_name, disprot_id,
+                index_path=None, output_format="files", compression=None):
+    """
+    write_pdb_jsons plus the manifest fields of the input file.
+    With index_path, chain info and first-model hash come from the ensemble index
+    when the file is indexed and unchanged.
+    Returns (desc_path, construct_path, file_entry). With output_format="bundle" nothing
+    is written: the encoded bundle records are returned instead of the paths.
+    """
+    pdb_path = os.path.join(pdb_folder, pdb_file)
+    st = os.stat(pdb_path)
+    record = open_index(index_path).lookup(pdb_path) if index_path else None
+    chain_info = chain_info_from_record(record) if record is not None else None
+
+    if output_format == "bundle":
+        # Encoded (and compressed) in the worker; the main process appends them to the bundles
+        pdb_base = os.path.splitext(pdb_file)[0]
+        data_desc, data_construct = build_pdb_payloads(pdb_folder, pdb_file, protein_name, disprot_id, chain_info)
+        desc_path, construct_path = (
+            encode_record(pdb_base, data_desc, compression, encoded=encode_description(data_desc, compact=True)),
+            encode_record(pdb_base, data_construct, compression),
+        )
+    else:
+        desc_path, construct_path = write_pdb_jsons(
+            pdb_folder, pdb_file, desc_folder, construct_folder, protein_name, disprot_id, chain_info
+        )
+    file_entry = {
+        "path": os.path.abspath(pdb_path),
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "first_model_hash": record["first_model_hash"] if record is not None else hash_first_model(pdb_path),
+    }
+    return desc_path, construct_path, file_entry
+
+
+# === MANIFEST ===
+def read_manifest(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f).get("files", {})
+    except (OSError, ValueError):
+        return {}
+
+
+def load_manifest(desc_folder, shard=None):
+    """
+    Returns {pdb_file: entry} from the folder manifest (empty if missing or unreadable).
+    A shard also sees the entries of its own, not yet merged, shard manifest.
+    """
+    manifest = read_manifest(os.path.join(desc_folder, MANIFEST_NAME))
+    if shard is not None:
+        manifest.update(read_manifest(shard_path(os.path.join(desc_folder, MANIFEST_NAME), shard)))
+    return manifest
+
+
+def save_manifest(desc_folder, manifest, shard=None):
+    """Writes the manifest (or the shard manifest) atomically (temporary file + rename)."""
+    path = shard_path(os.path.join(desc_folder, MANIFEST_NAME), shard)
+    tmp_path = path + ".tmp"
+    with metrics.timer("manifest_write_seconds"):
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"generator_version": GENERATOR_VERSION, "files": manifest}, f, indent=1, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+
+def find_up_to_date(pdb_folder, pdb_files, manifest, desc_folder, construct_folder, verify=False, pool=None,
+                    bundled=None, templates_hash=None):
+    """
+    Returns the set of PDB files whose JSONs are up to date: same size and mtime as in
+    the manifest, same generator version and description templates (templates_hash)
+    and both JSONs present. Only os.stat is used, unless verify=True, which also
+    re-hashes the first model of those files.
+    bundled: names present in the description and construct bundles (bundle output),
+    checked instead of the JSON files.
+    """
+    candidates = []
+    for pdb_file in pdb_files:
+        entry = manifest.get(pdb_file)
+        if entry is None or entry.get("generator_version") != GENERATOR_VERSION:
+            continue
+        if templates_hash is not None and entry.get("templates_hash") != templates_hash:
+            continue
+        try:
+            st = os.stat(os.path.join(pdb_folder, pdb_file))
+        except OSError:
+            continue
+        if st.st_size != entry["size"] or st.st_mtime_ns != entry["mtime_ns"]:
+            continue
+        pdb_base = os.path.splitext(pdb_file)[0]
+        if bundled is not None:
+            if pdb_base not in bundled:
+                continue
+        elif not (os.path.exists(os.path.join(desc_folder, f"{pdb_base}.json"))
+                  and os.path.exists(os.path.join(construct_folder, f"{pdb_base}_const.json"))):
+            continue
+        candidates.append(pdb_file)
+
+    if not verify:
+        return set(candidates)
+
+    paths = [os.path.join(pdb_folder, f) for f in candidates]
+    hashes = (metrics.pool_map(pool, hash_first_model, paths, chunksize=16) if pool is not None
+              else map(hash_first_model, paths))
+    return {f for f, h in zip(candidates, hashes) if h == manifest[f]["first_model_hash"]}
+
+
+def find_metadata_changed(pdb_files, manifest, lookup):
+    """
+    Returns the PDB files whose UniProt name, merge or DisProt ID is not the one recorded
+    in the manifest. lookup(uniprot_id) returns (protein_name, final_id, disprot_id);
+    files whose lookup fails keep their JSONs.
+    """
+    changed = set()
+    for pdb_file in pdb_files:
+        entry = manifest[pdb_file]
+        uniprot_id = os.path.splitext(pdb_file)[0].split("_")[0]
+        try:
+            protein_name, final_id, disprot_id = lookup(uniprot_id)
+        except Exception:
+            continue
+        if (final_id != uniprot_id or protein_name != entry.get("protein_name")
+                or disprot_id != entry.get("disprot_id")):
+            changed.add(pdb_file)
+    return changed
+
+
+# === MAIN ===
+def get_output_folders(pdb_folder):
+    """Returns (subfolder_name, desc_folder, construct_folder) for an input folder."""
     parts = pdb_folder.split("ped_deposition/")
     subpath = parts[1].strip("/") if len(parts) > 1 else os.path.basename(pdb_folder)
     subfolder_name = subpath.replace("/", "_")
-
-    desc_folder = os.path.join(base_desc_folder, subfolder_name)
-    construct_folder = os.path.join(base_construct_folder, subfolder_name)
-    os.makedirs(desc_folder, exist_ok=True)
-    os.makedirs(construct_folder, exist_ok=True)
-
-    print(f"\n📂 [{folder_idx}/{len(pdb_folders)}] Processing folder: {pdb_folder}")
-    print(f"   → JSON files will be saved under '{subfolder_name}'")
-
-    pdb_files = [f for f in os.listdir(pdb_folder) if f.endswith(".pdb")]
-    n_found = len(pdb_files)
-    n_success = 0
-    failed_files = []
-
-    summary_lines.append(f"[{subfolder_name}]\n")
-    summary_lines.append(f"  Path: {pdb_folder}\n")
-    summary_lines.append(f"  PDBs found: {n_found}\n")
-
-    total_pdbs += n_found
-
-    for idx, pdb_file in enumerate(pdb_files, start=1):
-        pdb_base = os.path.splitext(pdb_file)[0]
-        original_id = pdb_base.split("_")[0]
-
-        print(f"\n  🧩 [{idx}/{n_found}] {pdb_file}")
-        print(f"      UniProt ID detected: {original_id}")
-
-        try:
-            # Get name and final ID (handles merges and deletions)
-            protein_name, final_id = get_uniprot_name(original_id)
-
-            # If merged → SKIP
-            if final_id != original_id:
-                msg = f"      🔁❌ Merged ID: {original_id} → {final_id} (JSON not generated)"
-                print(msg)
-                summary_lines.append(f"    {msg}\n")
-                merged_entries.append((original_id, final_id))
+    return (subfolder_name,
+            os.path.join(base_desc_folder, subfolder_name),
+            os.path.join(base_construct_folder, subfolder_name))
+
+
+def main(workers=1, batch_uniprot=True, force=False, verify=False, index_path=ensemble_index_path,
+         shard=None, shard_by=SHARD_BY, event_log=event_log_path, log_level=LOG_LEVEL, quiet=False, verbose=False,
+         output_format=OUTPUT_FORMAT, compression=BUNDLE_COMPRESSION, templates=templates_path):
+    if output_format == "bundle":
+        check_compression(compression)
+    use_templates(templates)
+    log = EventLog(shard_path(event_log, shard) if event_log else None,
+                   level=log_level, quiet=quiet, verbose=verbose)
+    try:
+        generate(log, workers=workers, batch_uniprot=batch_uniprot, force=force, verify=verify,
+                 index_path=index_path, shard=shard, shard_by=shard_by, output_format=output_format,
+                 compression=compression, templates=templates)
+        write_summary(log, shard)
+    finally:
+        log.close()
+
+
+def generate(log, workers=1, batch_uniprot=True, force=False, verify=False, index_path=ensemble_index_path,
+             shard=None, shard_by=SHARD_BY, output_format=OUTPUT_FORMAT, compression=BUNDLE_COMPRESSION,
+             templates=templates_path):
+    """Generates the JSONs of every folder, reporting each folder and PDB as events of log."""
+    log.info("run_start", date=datetime.now().strftime('%Y-%m-%d %H:%M:%S'), n_folders=len(pdb_folders),
+             shard=f"{shard[0]}/{shard[1]} ({shard_by})" if shard is not None else None,
+             desc_folder=base_desc_folder, construct_folder=base_construct_folder)
+
+    # Recorded per manifest entry: JSONs rendered from other templates are regenerated
+    templates_hash = get_templates()["hash"]
+
+    # Parallel mode: UniProt/DisProt lookups run in a thread pool and PDB parsing +
+    # JSON writing in a process pool. Results are consumed in file order, so the
+    # summary is identical to the serial run.
+    parallel = workers > 1
+    if parallel:
+        lookup_pool = ThreadPoolExecutor(LOOKUP_THREADS)
+        # Workers load the same description templates (once each)
+        pdb_pool = ProcessPoolExecutor(workers, initializer=use_templates, initargs=(templates,))
+        lookups = {}  # UniProt ID -> Future, shared across folders
+
+    # Up-to-date PDBs (manifest) are found first, so they need no metadata lookup
+    folder_plans = []
+    for pdb_folder in pdb_folders:
+        if not os.path.exists(pdb_folder):
+            folder_plans.append(None)
+            continue
+        subfolder_name, desc_folder, construct_folder = get_output_folders(pdb_folder)
+        pdb_files = [f for f in os.listdir(pdb_folder) if f.endswith(".pdb")]
+        pdb_files = select_shard(pdb_files, pdb_folder, shard, by=shard_by, index_path=index_path)
+        manifest = {} if force else load_manifest(desc_folder, shard)
+        bundled = None
+        if output_format == "bundle":
+            bundled = (bundle_entries(desc_folder, "description").keys()
+                       & bundle_entries(construct_folder, "construct").keys())
+        up_to_date = find_up_to_date(pdb_folder, pdb_files, manifest, desc_folder, construct_folder,
+                                     verify=verify, pool=pdb_pool if parallel else None, bundled=bundled,
+                                     templates_hash=templates_hash)
+        folder_plans.append((pdb_files, manifest, up_to_date))
+
+    # The metadata of up-to-date PDBs is compared with the manifest through the metadata
+    # cache (network lookups only for expired entries); without cache it is not checked
+    check_metadata = get_cache() is not None
+
+    # All UniProt IDs are resolved up front in batched requests
+    uniprot_names = None
+    if batch_uniprot:
+        all_ids = []
+        for plan in folder_plans:
+            if plan is not None:
+                pdb_files, _, up_to_date = plan
+                all_ids.extend(os.path.splitext(f)[0].split("_")[0]
+                               for f in pdb_files if check_metadata or f not in up_to_date)
+        uniprot_names = resolve_uniprot_names(all_ids)
+
+    def lookup(uniprot_id):
+        if parallel:
+            if uniprot_id not in lookups:
+                lookups[uniprot_id] = lookup_pool.submit(lookup_metadata, uniprot_id, uniprot_names)
+            return lookups[uniprot_id].result()
+        return lookup_metadata(uniprot_id, uniprot_names)
+
+    # Up-to-date PDBs whose protein name, merge or DisProt ID changed are regenerated
+    if check_metadata:
+        for plan in folder_plans:
+            if plan is None:
                 continue
-
-            # Identify workflow
-            if "_idpcg_" in pdb_file.lower():
-                title_prefix = "AF-IDPCG"
-                workflow = "IDPConformerGenerator"
-            elif "forge_" in pdb_file.lower():
-                title_prefix = "AF-IDPForge"
-                workflow = "IDPForge"
+            _, manifest, up_to_date = plan
+            if parallel:
+                for pdb_file in up_to_date:
+                    original_id = os.path.splitext(pdb_file)[0].split("_")[0]
+                    if original_id not in lookups:
+                        lookups[original_id] = lookup_pool.submit(lookup_metadata, original_id, uniprot_names)
+            up_to_date.difference_update(find_metadata_changed(sorted(up_to_date), manifest, lookup))
+
+    n_pending = sum(len(plan[0]) - len(plan[2]) for plan in folder_plans if plan is not None)
+    progress = metrics.progress(n_pending, "PDBs")
+    for folder_idx, (pdb_folder, plan) in enumerate(zip(pdb_folders, folder_plans), start=1):
+        if plan is None:
+            log.warning("folder_missing", f"⚠️  Folder not found: {pdb_folder}\n", path=pdb_folder)
+            continue
+
+        subfolder_name, desc_folder, construct_folder = get_output_folders(pdb_folder)
+        os.makedirs(desc_folder, exist_ok=True)
+        os.makedirs(construct_folder, exist_ok=True)
+
+        all_pdb_files, manifest, up_to_date = plan
+        n_found = len(all_pdb_files)
+        n_skipped = len(up_to_date)
+        pdb_files = [f for f in all_pdb_files if f not in up_to_date]
+        n_success = 0
+
+        msg = (f"\n📂 [{folder_idx}/{len(pdb_folders)}] Processing folder: {pdb_folder}\n"
+               f"   → JSON files will be saved under '{subfolder_name}'")
+        if n_skipped:
+            msg += f"\n   ⏭️  {n_skipped} PDBs up to date (skipped)"
+        log.info("folder_start", msg, path=pdb_folder, subfolder=subfolder_name, found=n_found, skipped=n_skipped)
+        metrics.count("pdbs_total", n_skipped, result="skipped")
+
+        # Manifest entries of PDBs that no longer exist or must be regenerated are dropped
+        manifest = {f: e for f, e in manifest.items() if f in up_to_date}
+
+        bundles = None
+        if output_format == "bundle":
+            bundles = (BundleWriter(desc_folder, "description", compression, shard, truncate=force),
+                       BundleWriter(construct_folder, "construct", compression, shard, truncate=force))
+
+        def save_outputs():
+            # Bundle indexes first, so the manifest never lists entries they do not have
+            if bundles is not None:
+                for bundle in bundles:
+                    bundle.save()
+            save_manifest(desc_folder, manifest, shard)
+
+        writes = {}  # PDB file -> Future
+        if parallel:
+            for pdb_file in pdb_files:
+                original_id = os.path.splitext(pdb_file)[0].split("_")[0]
+                if original_id not in lookups:
+                    lookups[original_id] = lookup_pool.submit(lookup_metadata, original_id, uniprot_names)
+            # Each PDB is sent to the process pool as soon as its metadata is known
+            for pdb_file in pdb_files:
+                original_id = os.path.splitext(pdb_file)[0].split("_")[0]
+                try:
+                    protein_name, final_id, disprot_id = lookups[original_id].result()
+                except Exception:
+                    continue  # reported below, in file order
+                if final_id == original_id:
+                    writes[pdb_file] = metrics.pool_submit(
+                        pdb_pool, process_pdb, pdb_folder, pdb_file, desc_folder, construct_folder,
+                        protein_name, disprot_id, index_path, output_format, compression
+                    )
+
+        def get_written(pdb_file, protein_name, disprot_id):
+            if parallel:
+                desc_path, construct_path, file_entry = writes[pdb_file].result()
             else:
-                title_prefix = "AF-Ensemble"
-                workflow = "Unknown"
-
-            # === Case 1: Inactive or deleted UniProt ID ===
-            if protein_name is None:
-                msg = f"      ⚠️  ID {original_id} inactive or not found."
-                print(msg)
-                summary_lines.append(f"    {msg}\n")
-
-                data_desc = create_description_json(original_id)
-                data_desc["title"] = f"{title_prefix} Ensemble Prediction of {original_id}"
-                data_desc["structural_ensembles_calculation"] = (
-                    f"AlphaFlex with {workflow} workflow based on the AlphaFold 2 prediction of {original_id}"
+                desc_path, construct_path, file_entry = process_pdb(
+                    pdb_folder, pdb_file, desc_folder, construct_folder, protein_name, disprot_id,
+                    index_path, output_format, compression
                 )
-
-                pdb_path = os.path.join(pdb_folder, pdb_file)
-                data_construct = [{
-                    "chain_name": chain,
-                    "fragments": [{
-                        "description": f"{original_id}",
-                        "source_sequence": info.get("sequence", ""),
-                        "definition_type": "By Sequence"
-                    }]
-                } for chain, info in get_chain_sequences_and_last_residues(pdb_path).items()]
-
-                desc_path = os.path.join(desc_folder, f"{pdb_base}.json")
-                construct_path = os.path.join(construct_folder, f"{pdb_base}_const.json")
-
-                with open(desc_path, "w", encoding="utf-8") as f:
-                    json.dump(data_desc, f, indent=4, ensure_ascii=False)
-                with open(construct_path, "w", encoding="utf-8") as f:
-                    json.dump(data_construct, f, indent=4, ensure_ascii=False)
-
-                print(f"      ✅ JSONs generated: {os.path.basename(desc_path)}, {os.path.basename(construct_path)}")
+            if bundles is not None:
+                pdb_base = os.path.splitext(pdb_file)[0]
+                desc_path = bundles[0].append(pdb_base, desc_path)
+                construct_path = bundles[1].append(pdb_base, construct_path)
+            manifest[pdb_file] = dict(
+                file_entry,
+                generator_version=GENERATOR_VERSION,
+                templates_hash=templates_hash,
+                uniprot_id=os.path.splitext(pdb_file)[0].split("_")[0],
+                protein_name=protein_name,
+                disprot_id=disprot_id,
+            )
+            if len(manifest) % MANIFEST_SAVE_EVERY == 0:
+                save_outputs()
+            return desc_path, construct_path
+
+        for idx, pdb_file in enumerate(pdb_files, start=1):
+            pdb_base = os.path.splitext(pdb_file)[0]
+            original_id = pdb_base.split("_")[0]
+
+            try:
+                # Get name and final ID (handles merges and deletions)
+                if parallel:
+                    protein_name, final_id, disprot_id = lookups[original_id].result()
+                else:
+                    protein_name, final_id, disprot_id = lookup_metadata(original_id, uniprot_names)
+
+                # If merged → SKIP
+                if final_id != original_id:
+                    log.warning("pdb_merged", f"      🔁❌ Merged ID: {original_id} → {final_id} (JSON not generated)",
+                                pdb=pdb_file, uniprot_id=original_id, final_id=final_id)
+                    metrics.count("pdbs_total", result="merged")
+                    continue
+
+                # === Case 1: Inactive or deleted UniProt ID ===
+                if protein_name is None:
+                    log.warning("pdb_inactive", f"      ⚠️  ID {original_id} inactive or not found.",
+                                pdb=pdb_file, uniprot_id=original_id)
+
+                # === Case 2: Valid UniProt ID ===
+                desc_path, construct_path = get_written(pdb_file, protein_name, disprot_id)
+                log.debug("pdb_generated",
+                          f"  🧩 [{idx}/{len(pdb_files)}] {pdb_file} ({protein_name or original_id}"
+                          f"{', ' + disprot_id if disprot_id else ''}) → "
+                          f"{os.path.basename(desc_path)}, {os.path.basename(construct_path)}",
+                          pdb=pdb_file, uniprot_id=original_id, protein_name=protein_name, disprot_id=disprot_id,
+                          inactive=protein_name is None, desc_path=desc_path, construct_path=construct_path)
                 n_success += 1
-                total_processed += 1
+                metrics.count("pdbs_total", result="generated")
+
+            except Exception as e:
+                log.error("pdb_error", f"      ❌ Error processing {pdb_file}: {e}", pdb=pdb_file, error=str(e))
+                metrics.count("pdbs_total", result="error")
+            finally:
+                progress.advance()
+
+        save_outputs()
+        if bundles is not None:
+            for bundle in bundles:
+                bundle.close()
+        log.info("folder_end", f"   ✅ {n_success}/{n_found - n_skipped} PDBs processed",
+                 path=pdb_folder, subfolder=subfolder_name,
+                 generated=n_success, pending=n_found - n_skipped)
+
+    progress.close()
+    if parallel:
+        lookup_pool.shutdown()
+        pdb_pool.shutdown()
+
+
+# === SUMMARY ===
+def render_summary(records):
+    """
+    Text summary of a run (summary_json_generation.txt) from its events, as
+    (summary lines, merged entries).
+    """
+    summary_lines = []
+    totals = dict(found=0, generated=0, skipped=0)
+    merged_entries = []  # merged IDs (skipped)
+    failed_files = []
+    n_folders = 0
+
+    for record in records:
+        event = record["event"]
+        if event == "run_start":
+            n_folders = record["n_folders"]
+            summary_lines.append("=== JSON Generation Summary ===\n")
+            summary_lines.append(f"Date: {record['date']}\n")
+            if record["shard"] is not None:
+                summary_lines.append(f"Shard: {record['shard']}\n")
+            summary_lines.append(f"Output folders: {record['desc_folder']} | {record['construct_folder']}\n\n")
+        elif event == "folder_missing":
+            summary_lines.append(f"⚠️  Folder not found: {record['path']}\n")
+        elif event == "folder_start":
+            summary_lines.append(f"[{record['subfolder']}]\n")
+            summary_lines.append(f"  Path: {record['path']}\n")
+            summary_lines.append(f"  PDBs found: {record['found']}\n")
+            if record["skipped"]:
+                summary_lines.append(f"  Skipped (up to date): {record['skipped']}\n")
+            totals["found"] += record["found"]
+            totals["skipped"] += record["skipped"]
+            failed_files = []
+        elif event == "pdb_merged":
+            summary_lines.append(f"          🔁❌ Merged ID: {record['uniprot_id']} → {record['final_id']} "
+                                 f"(JSON not generated)\n")
+            merged_entries.append((record["uniprot_id"], record["final_id"]))
+        elif event == "pdb_inactive":
+            summary_lines.append(f"          ⚠️  ID {record['uniprot_id']} inactive or not found.\n")
+        elif event == "pdb_generated":
+            if not record["inactive"]:
+                summary_lines.append(f"    ✅ {record['pdb']} processed successfully.\n")
+        elif event == "pdb_error":
+            summary_lines.append(f"          ❌ Error processing {record['pdb']}: {record['error']}\n")
+            failed_files.append(f"{record['pdb']} → {record['error']}")
+        elif event == "folder_end":
+            totals["generated"] += record["generated"]
+            summary_lines.append(f"  Successfully processed: {record['generated']}/{record['pending']}\n")
+            if failed_files:
+                summary_lines.append("  Errors:\n")
+                for f in failed_files:
+                    summary_lines.append(f"    - {f}\n")
+            summary_lines.append("\n")
+
+    summary_lines.append("=== Overall Summary ===\n")
+    summary_lines.append(f"Total folders processed: {n_folders}\n")
+    summary_lines.append(f"Total PDBs found: {totals['found']}\n")
+    summary_lines.append(f"Total JSONs successfully generated: {totals['generated']}\n")
+    summary_lines.append(f"Total skipped as up to date: {totals['skipped']}\n")
+    summary_lines.append(f"Total merged entries skipped: {len(merged_entries)}\n")
+    summary_lines.append(f"Total with errors: "
+                         f"{totals['found'] - totals['generated'] - totals['skipped'] - len(merged_entries)}\n")
+
+    # 🧩 Merged entries section (table)
+    if merged_entries:
+        summary_lines.append("\n=== Skipped merged UniProt entries ===\n")
+        summary_lines.append("The following input PDBs were skipped because their UniProt IDs have been merged into new entries:\n\n")
+        summary_lines.append("PDB File Name".ljust(40) + " | New UniProt ID\n")
+        summary_lines.append("-" * 40 + " | " + "-" * 14 + "\n")
+        for orig, new in merged_entries:
+            summary_lines.append(f"{orig}_idpcg_n100.pdb".ljust(40) + f" | {new}\n")
+    return summary_lines, merged_entries
+
+
+def write_summary(log, shard=None):
+    """Writes the summary and the merged PDB list rendered from the events of log."""
+    summary_lines, merged_entries = render_summary(log.records)
+    merged_pdb_files = [f"{orig}_idpcg_n100.pdb" for orig, _ in merged_entries]
+
+    # Guardar resumen general
+    with open(shard_path(summary_path, shard), "w", encoding="utf-8") as f:
+        f.writelines(summary_lines)
+
+    # Guardar lista de PDBs mergeados (si hay)
+    if merged_pdb_files:
+        with open(shard_path(merged_list_path, shard), "w", encoding="utf-8") as f:
+            for pdb in merged_pdb_files:
+                f.write(f"{pdb}\n")
+        log.info("merged_list_written", f"\n📁 Merged PDB file list saved in: {shard_path(merged_list_path, shard)}",
+                 path=shard_path(merged_list_path, shard), merged=len(merged_pdb_files))
+
+    msg = (f"\n📜 Summary saved in: {shard_path(summary_path, shard)}\n"
+           f"🎯 JSONs generated in: {base_desc_folder} and {base_construct_folder}")
+    if merged_entries:
+        msg += "\n\n🔁 Skipped merged UniProt entries:\n" + "".join(summary_lines[-len(merged_entries) - 2:]).rstrip("\n")
+    log.info("summary_written", msg, path=shard_path(summary_path, shard))
+
+
+# === SHARDS ===
+def merge_shards(n_shards):
+    """
+    Combines the outputs of shards 0..N-1: the shard manifests of every output folder
+    into its manifest, the shard summaries into one summary (per-shard folder sections
+    and summed totals) and the merged-ID lists into one list.
+    """
+    summaries = shard_paths(summary_path, n_shards)
+    missing = [p for p in summaries if not os.path.exists(p)]
+    if missing:
+        print(f"⚠️  Missing shard summaries, not merged: {', '.join(missing)}")
+        return 1
+
+    for pdb_folder in pdb_folders:
+        _, desc_folder, _ = get_output_folders(pdb_folder)
+        shard_manifests = [p for p in shard_paths(os.path.join(desc_folder, MANIFEST_NAME), n_shards)
+                           if os.path.exists(p)]
+        if not shard_manifests:
+            continue
+        manifest = load_manifest(desc_folder)
+        for path in shard_manifests:
+            manifest.update(read_manifest(path))
+        save_manifest(desc_folder, manifest)
+        for path in shard_manifests:
+            os.remove(path)
+        print(f"🗂️  {desc_folder}: {len(shard_manifests)} shard manifests merged ({len(manifest)} PDBs)")
+
+    sections, totals, merged_rows = [], {}, []
+    for i, path in enumerate(summaries):
+        with open(path, "r", encoding="utf-8") as f:
+            body, _, overall = f.read().partition("=== Overall Summary ===\n")
+        overall, _, merged_table = overall.partition("\n=== Skipped merged UniProt entries ===\n")
+        # Folder sections follow the header, which ends with a blank line
+        sections.append(f"--- Shard {i}/{n_shards} ---\n" + body.split("\n\n", 1)[-1].rstrip("\n") + "\n\n")
+        for line in overall.splitlines():
+            key, _, value = line.rpartition(": ")
+            if not (key.startswith("Total") and value.isdigit()):
                 continue
-
-            # === Case 2: Valid UniProt ID ===
-            disprot_id = get_disprot_id(original_id)
-            print(f"      Protein: {protein_name}")
-            if disprot_id:
-                print(f"      DisProt ID: {disprot_id}")
-
-            # Normal JSONs
-            data_desc = create_description_json(original_id)
-            data_desc["title"] = f"{title_prefix} Ensemble Prediction of {protein_name}"
-            data_desc["structural_ensembles_calculation"] = (
-                f"AlphaFlex with {workflow} workflow based on the AlphaFold 2 prediction of {original_id}"
-            )
-            if disprot_id:
-                data_desc["entry_cross_reference"] = [{"db": "disprot", "id": disprot_id}]
-
-            pdb_path = os.path.join(pdb_folder, pdb_file)
-            chain_info = get_chain_sequences_and_last_residues(pdb_path)
-            data_construct = create_construct_json(chain_info, original_id, protein_name)
-
-            desc_path = os.path.join(desc_folder, f"{pdb_base}.json")
-            construct_path = os.path.join(construct_folder, f"{pdb_base}_const.json")
-
-            with open(desc_path, "w", encoding="utf-8") as f:
-                json.dump(data_desc, f, indent=4, ensure_ascii=False)
-            with open(construct_path, "w", encoding="utf-8") as f:
-                json.dump(data_construct, f, indent=4, ensure_ascii=False)
-
-            print(f"      ✅ Full JSONs generated: {os.path.basename(desc_path)}, {os.path.basename(construct_path)}")
-            summary_lines.append(f"    ✅ {pdb_file} processed successfully.\n")
-
-            n_success += 1
-            total_processed += 1
-
-        except Exception as e:
-            error_msg = f"      ❌ Error processing {pdb_file}: {e}"
-            print(error_msg)
-            summary_lines.append(f"    {error_msg}\n")
-            failed_files.append(f"{pdb_file} → {e}")
-
-    summary_lines.append(f"  Successfully processed: {n_success}/{n_found}\n")
-    if failed_files:
-        summary_lines.append("  Errors:\n")
-        for f in failed_files:
-            summary_lines.append(f"    - {f}\n")
-    summary_lines.append("\n")
-
-# === FINAL SUMMARY ===
-summary_lines.append("=== Overall Summary ===\n")
-summary_lines.append(f"Total folders processed: {len(pdb_folders)}\n")
-summary_lines.append(f"Total PDBs found: {total_pdbs}\n")
-summary_lines.append(f"Total JSONs successfully generated: {total_processed}\n")
-summary_lines.append(f"Total merged entries skipped: {len(merged_entries)}\n")
-summary_lines.append(f"Total with errors: {total_pdbs - total_processed - len(merged_entries)}\n")
-
-# 🧩 Merged entries section (table)
-merged_pdb_files = []
-if merged_entries:
-    summary_lines.append("\n=== Skipped merged UniProt entries ===\n")
-    summary_lines.append("The following input PDBs were skipped because their UniProt IDs have been merged into new entries:\n\n")
-    summary_lines.append("PDB File Name".ljust(40) + " | New UniProt ID\n")
-    summary_lines.append("-" * 40 + " | " + "-" * 14 + "\n")
-
-    for orig, new in merged_entries:
-        pdb_file_name = f"{orig}_idpcg_n100.pdb"
-        summary_lines.append(pdb_file_name.ljust(40) + f" | {new}\n")
-        merged_pdb_files.append(pdb_file_name)
-
-# Guardar resumen general
-with open(summary_path, "w", encoding="utf-8") as f:
-    f.writelines(summary_lines)
-
-# Guardar lista de PDBs mergeados (si hay)
-if merged_pdb_files:
-    merged_list_path = "merged_pdb_list.txt"
-    with open(merged_list_path, "w", encoding="utf-8") as f:
-        for pdb in merged_pdb_files:
-            f.write(f"{pdb}\n")
-    print(f"\n📁 Merged PDB file list saved in: {merged_list_path}")
-
-print("\n📜 Summary saved in:", summary_path)
-print("🎯 JSONs generated in:", base_desc_folder, "and", base_construct_folder)
-
-if merged_entries:
-    print("\n🔁 Skipped merged UniProt entries:")
-    print("PDB File Name".ljust(40) + " | New UniProt ID")
-    print("-" * 40 + " | " + "-" * 14)
-    for orig, new in merged_entries:
-        pdb_file_name = f"{orig}_idpcg_n100.pdb"
-        print(pdb_file_name.ljust(40) + f" | {new}")
+            if key == "Total folders processed":
+                # Every shard goes through all the folders
+                totals[key] = max(totals.get(key, 0), int(value))
+            else:
+                totals[key] = totals.get(key, 0) + int(value)
+        merged_rows += [line for line in merged_table.splitlines()[4:] if " | " in line]
+
+    summary_lines = ["=== JSON Generation Summary ===\n",
+                     f"Date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n",
+                     f"Merged from {n_shards} shards\n",
+                     f"Output folders: {base_desc_folder} | {base_construct_folder}\n\n"]
+    summary_lines += sections
+    summary_lines.append("=== Overall Summary ===\n")
+    summary_lines += [f"{key}: {value}\n" for key, value in totals.items()]
+    if merged_rows:
+        summary_lines.append("\n=== Skipped merged UniProt entries ===\n")
+        summary_lines.append("The following input PDBs were skipped because their UniProt IDs have been merged into new entries:\n\n")
+        summary_lines.append("PDB File Name".ljust(40) + " | New UniProt ID\n")
+        summary_lines.append("-" * 40 + " | " + "-" * 14 + "\n")
+        summary_lines += [f"{row}\n" for row in merged_rows]
+    with open(summary_path, "w", encoding="utf-8") as f:
+        f.writelines(summary_lines)
+
+    merged_pdb_files = []
+    for path in shard_paths(merged_list_path, n_shards):
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                merged_pdb_files += [line for line in f if line.strip()]
+    if merged_pdb_files:
+        with open(merged_list_path, "w", encoding="utf-8") as f:
+            f.writelines(merged_pdb_files)
+        print(f"📁 Merged PDB file list saved in: {merged_list_path}")
+
+    print(f"📜 Summary of {n_shards} shards saved in: {summary_path}")
+    return 0
+
+
+def add_arguments(parser):
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Processes used to parse PDBs and write JSONs (default: 1, serial)")
+    parser.add_argument("--no-batch-uniprot", action="store_true",
+                        help="Query UniProt one ID at a time instead of batched search/stream requests")
+    parser.add_argument("--force", action="store_true",
+                        help="Regenerate every PDB, ignoring the manifest")
+    parser.add_argument("--verify", action="store_true",
+                        help="Also re-hash the first model of PDBs whose size/mtime are unchanged")
+    parser.add_argument("--index", metavar="DB", default=ensemble_index_path,
+                        help="Take chain sequences and hashes from this ensemble index (see ensemble_index.py)")
+    parser.add_argument("--output-format", choices=["files", "bundle"], default=OUTPUT_FORMAT,
+                        help="files: an indent=4 JSON per PDB; bundle: one JSON-lines bundle per output folder "
+                             f"(default: {OUTPUT_FORMAT})")
+    parser.add_argument("--compress", choices=["zstd"], default=BUNDLE_COMPRESSION,
+                        help="Compress bundle records (needs the zstandard package)")
+    parser.add_argument("--templates", metavar="PATH", default=templates_path,
+                        help="Description templates file, .toml or .json (default: description_templates.toml)")
+    add_shard_arguments(parser)
+    add_log_arguments(parser, event_log_path)
+    metrics.add_metrics_arguments(parser)
+
+
+def run(args):
+    with metrics.session(args, "json_generation"):
+        if args.merge_shards:
+            return merge_shards(args.merge_shards)
+        if args.compress and args.output_format != "bundle":
+            print("❌ --compress only applies to --output-format bundle")
+            return 1
+        try:
+            check_compression(args.compress)
+        except BundleError as e:
+            print(f"❌ {e}")
+            return 1
+        try:
+            use_templates(args.templates)
+            get_templates()
+        except (OSError, ValueError, TemplateError) as e:
+            print(f"❌ Cannot read description templates: {e}")
+            return 1
+        main(workers=args.workers, batch_uniprot=not args.no_batch_uniprot, force=args.force, verify=args.verify,
+             index_path=args.index, shard=args.shard, shard_by=args.shard_by, event_log=args.event_log,
+             log_level=args.log_level, quiet=args.quiet, verbose=args.verbose, output_format=args.output_format,
+             compression=args.compress, templates=args.templates)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate PED description and construct JSONs from PDB ensembles.")
+    add_arguments(parser)
+    run(parser.parse_args())
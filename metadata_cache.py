@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Persistent UniProt / DisProt metadata cache
+-------------------------------------------
+Single-file SQLite store used by description.py so that re-runs make no network
+calls for accessions already seen. Each UniProt entry keeps the resolved name,
+the resolved (merged) accession and the inactive reason; each DisProt entry keeps
+the DisProt ID. "Not found" results are cached too, with a shorter TTL.
+Timeouts and connection errors are never cached.
+
+Usage:
+    python metadata_cache.py warm <pdb_folder> [...]   # pre-fetch accessions from PDB names
+    python metadata_cache.py show [ACCESSION ...]      # inspect entries (offline)
+    python metadata_cache.py stats                     # counts, expired entries (offline)
+    python metadata_cache.py purge                     # drop expired entries
+
+Configuration (environment):
+    PED_METADATA_CACHE                 path of the cache file ("" disables the cache)
+    PED_METADATA_CACHE_TTL_DAYS        TTL of found entries (default 30)
+    PED_METADATA_CACHE_NEGATIVE_DAYS   TTL of not-found entries (default 7)
+"""
+
+import os
+import sys
+import time
+import sqlite3
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# === CONFIGURATION ===
+CACHE_PATH = os.environ.get("PED_METADATA_CACHE", "metadata_cache.sqlite")
+TTL_DAYS = float(os.environ.get("PED_METADATA_CACHE_TTL_DAYS", 30))
+NEGATIVE_TTL_DAYS = float(os.environ.get("PED_METADATA_CACHE_NEGATIVE_DAYS", 7))
+BUSY_TIMEOUT = 30  # seconds to wait for a write lock held by another process (shards, warm)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS uniprot (
+    accession          TEXT PRIMARY KEY,
+    name               TEXT,
+    resolved_accession TEXT NOT NULL,
+    inactive_reason    TEXT,
+    fetched_at         REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS disprot (
+    accession  TEXT PRIMARY KEY,
+    disprot_id TEXT,
+    fetched_at REAL NOT NULL
+);
+"""
+
+
+class MetadataCache:
+    """SQLite cache of UniProt and DisProt lookups, safe to share between threads."""
+
+    def __init__(self, path=CACHE_PATH, ttl_days=TTL_DAYS, negative_ttl_days=NEGATIVE_TTL_DAYS):
+        self.path = path
+        self.ttl = ttl_days * 86400
+        self.negative_ttl = negative_ttl_days * 86400
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            # WAL: readers in other processes do not block the writer (and vice versa)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+
+    def _is_fresh(self, fetched_at, found):
+        ttl = self.ttl if found else self.negative_ttl
+        return time.time() - fetched_at < ttl
+
+    def _get(self, table, accession):
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT * FROM {table} WHERE accession = ?", (accession,)
+            ).fetchone()
+        return dict(row) if row is not None else None
+
+    def _put(self, table, values):
+        columns = ", ".join(values)
+        placeholders = ", ".join("?" for _ in values)
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {table} ({columns}) VALUES ({placeholders})",
+                tuple(values.values()),
+            )
+
+    # --- UniProt ---
+    def get_uniprot(self, accession):
+        """Returns {"name", "resolved_accession", "inactive_reason", ...} or None if missing/expired."""
+        entry = self._get("uniprot", accession)
+        if entry is None or not self._is_fresh(entry["fetched_at"], entry["name"] is not None):
+            return None
+        return entry
+
+    def put_uniprot(self, accession, name, resolved_accession, inactive_reason=None):
+        self._put("uniprot", {
+            "accession": accession,
+            "name": name,
+            "resolved_accession": resolved_accession,
+            "inactive_reason": inactive_reason,
+            "fetched_at": time.time(),
+        })
+
+    # --- DisProt ---
+    def get_disprot(self, accession):
+        """Returns {"disprot_id", ...} (disprot_id may be None) or None if missing/expired."""
+        entry = self._get("disprot", accession)
+        if entry is None or not self._is_fresh(entry["fetched_at"], entry["disprot_id"] is not None):
+            return None
+        return entry
+
+    def put_disprot(self, accession, disprot_id):
+        self._put("disprot", {
+            "accession": accession,
+            "disprot_id": disprot_id,
+            "fetched_at": time.time(),
+        })
+
+    # --- Inspection / maintenance ---
+    def entries(self, accessions=None):
+        """Yields (accession, uniprot_entry, disprot_entry), expired entries included."""
+        with self._lock:
+            if accessions is None:
+                accessions = [row[0] for row in self._conn.execute(
+                    "SELECT accession FROM uniprot UNION SELECT accession FROM disprot ORDER BY 1"
+                )]
+        for accession in accessions:
+            yield accession, self._get("uniprot", accession), self._get("disprot", accession)
+
+    def stats(self):
+        stats = {}
+        for table, found_col in (("uniprot", "name"), ("disprot", "disprot_id")):
+            with self._lock:
+                rows = [dict(r) for r in self._conn.execute(f"SELECT * FROM {table}")]
+            stats[table] = {
+                "total": len(rows),
+                "found": sum(r[found_col] is not None for r in rows),
+                "not_found": sum(r[found_col] is None for r in rows),
+                "expired": sum(not self._is_fresh(r["fetched_at"], r[found_col] is not None) for r in rows),
+            }
+        return stats
+
+    def purge_expired(self):
+        """Deletes expired entries and returns how many were removed."""
+        now = time.time()
+        removed = 0
+        with self._lock, self._conn:
+            for table, found_col in (("uniprot", "name"), ("disprot", "disprot_id")):
+                removed += self._conn.execute(
+                    f"DELETE FROM {table} WHERE "
+                    f"({found_col} IS NOT NULL AND fetched_at < ?) OR ({found_col} IS NULL AND fetched_at < ?)",
+                    (now - self.ttl, now - self.negative_ttl),
+                ).rowcount
+        return removed
+
+    def close(self):
+        self._conn.close()
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Returns the shared cache at CACHE_PATH, or None if caching is disabled."""
+    global _default_cache
+    if not CACHE_PATH:
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = MetadataCache(CACHE_PATH)
+    return _default_cache
+
+
+# === COMMAND LINE ===
+def accessions_from_folders(folders):
+    """UniProt accessions taken from PDB file names (<accession>_<...>.pdb), sorted and unique."""
+    accessions = set()
+    for folder in folders:
+        if not os.path.exists(folder):
+            print(f"⚠️  Folder not found: {folder}")
+            continue
+        for f in os.listdir(folder):
+            if f.endswith(".pdb"):
+                accessions.add(os.path.splitext(f)[0].split("_")[0])
+    return sorted(accessions)
+
+
+def warm(accessions, threads=8):
+    """Fetches every accession not already cached (UniProt name, then DisProt for valid IDs)."""
+    from description import get_uniprot_name, get_disprot_id
+    from http_utils import TemporaryLookupError
+
+    def fetch(accession):
+        try:
+            name, resolved_id = get_uniprot_name(accession)
+            if name is not None and resolved_id == accession:
+                get_disprot_id(accession)
+        except TemporaryLookupError:
+            return False
+        return True
+
+    total = len(accessions)
+    failed = 0
+    with ThreadPoolExecutor(threads) as pool:
+        for i, ok in enumerate(pool.map(fetch, accessions), start=1):
+            failed += not ok
+            print(f"  🔹 Warming cache ({i}/{total})...", end="\r")
+    print()
+    if failed:
+        print(f"⚠️  {failed} accessions failed temporarily and were not cached; run warm again to retry.")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect or pre-warm the UniProt/DisProt metadata cache.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_warm = sub.add_parser("warm", help="Fetch metadata for the accessions of the PDBs in the given folders")
+    p_warm.add_argument("folders", nargs="+")
+    p_warm.add_argument("--threads", type=int, default=8)
+    p_show = sub.add_parser("show", help="Print cached entries")
+    p_show.add_argument("accessions", nargs="*")
+    sub.add_parser("stats", help="Print cache statistics")
+    sub.add_parser("purge", help="Delete expired entries")
+    args = parser.parse_args(argv)
+
+    cache = get_cache()
+    if cache is None:
+        print("⚠️  Metadata cache disabled (PED_METADATA_CACHE is empty).")
+        return 1
+    print(f"🗄️  Cache: {cache.path}")
+
+    if args.command == "warm":
+        accessions = accessions_from_folders(args.folders)
+        missing = [a for a in accessions if cache.get_uniprot(a) is None]
+        print(f"Accessions found: {len(accessions)} | not cached: {len(missing)}")
+        warm(missing, threads=args.threads)
+    elif args.command == "show":
+        print("Accession".ljust(12) + " | " + "Resolved".ljust(12) + " | " + "Reason".ljust(16)
+              + " | " + "DisProt".ljust(10) + " | Name")
+        for accession, uni, dis in cache.entries(args.accessions or None):
+            print(accession.ljust(12) + " | "
+                  + (uni["resolved_accession"] if uni else "-").ljust(12) + " | "
+                  + ((uni["inactive_reason"] or "") if uni else "-").ljust(16) + " | "
+                  + ((dis["disprot_id"] or "") if dis else "-").ljust(10) + " | "
+                  + ((uni["name"] or "") if uni else "-"))
+    elif args.command == "stats":
+        for table, values in cache.stats().items():
+            print(f"{table}: " + ", ".join(f"{k}={v}" for k, v in values.items()))
+    elif args.command == "purge":
+        print(f"Removed {cache.purge_expired()} expired entries.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
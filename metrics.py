@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Run metrics
+-----------
+Lightweight instrumentation shared by the workflow scripts: counters and
+histograms identified by a name and optional labels, and timers (context
+managers) that record durations into histograms.
+
+    with metrics.timer("pdb_parse_seconds", step="chains"):
+        ...
+    metrics.count("http_responses_total", host=host, status=200)
+    metrics.observe("upload_size_bytes", n_bytes, buckets=metrics.SIZE_BUCKETS)
+
+Metrics are off unless enabled (--metrics PATH, or the PED_METRICS environment
+variable): timer() then returns a shared no-op context manager and count() /
+observe() return at once, so instrumented code pays one global check per call.
+At the end of the run they are exported as Prometheus text (.prom / .txt) or
+JSON (any other extension), and the slowest steps are printed.
+
+Work done in process pools is recorded in the worker processes: pool_map and
+pool_submit run tasks there with metrics on and merge them back into this process.
+
+--progress prints a live line (stderr) with done/total, rates and ETA.
+
+Usage:
+    python json_generation.py --metrics run_metrics.json --progress
+    python metrics.py run_metrics.json          # print the steps of an exported JSON
+"""
+
+import os
+import sys
+import json
+import time
+import bisect
+import argparse
+import threading
+import contextlib
+from datetime import datetime
+from functools import partial
+from concurrent.futures import Future
+
+# === CONFIGURATION ===
+METRICS_PATH = os.environ.get("PED_METRICS") or None
+TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)  # seconds
+SIZE_BUCKETS = tuple(2 ** k for k in range(10, 36, 2))  # bytes, 1 KiB .. 32 GiB
+PROGRESS_INTERVAL = 1.0   # seconds between progress line updates
+SUMMARY_TOP = 15          # timers printed at the end of a run
+
+_enabled = False
+_progress_enabled = False
+_lock = threading.Lock()
+_counters = {}     # (name, labels) -> value
+_histograms = {}   # (name, labels) -> Histogram
+_null = contextlib.nullcontext()
+
+
+class Histogram:
+    """Count, sum, min, max and per-bucket counts (value <= bucket bound) of observed values."""
+    __slots__ = ("bounds", "counts", "count", "sum", "min", "max")
+
+    def __init__(self, bounds):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)  # last one: above every bound
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, data):
+        if tuple(data["buckets"]) != self.bounds:
+            raise ValueError("cannot merge histograms with different buckets")
+        self.counts = [a + b for a, b in zip(self.counts, data["counts"])]
+        self.count += data["count"]
+        self.sum += data["sum"]
+        for attr, pick in (("min", min), ("max", max)):
+            if data[attr] is not None:
+                current = getattr(self, attr)
+                setattr(self, attr, data[attr] if current is None else pick(current, data[attr]))
+
+    def to_dict(self):
+        return {"buckets": list(self.bounds), "counts": list(self.counts), "count": self.count,
+                "sum": self.sum, "min": self.min, "max": self.max}
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def enabled():
+    return _enabled
+
+
+def enable(on=True):
+    global _enabled
+    _enabled = on
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+# === RECORDING ===
+def count(name, n=1, **labels):
+    """Adds n to a counter."""
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + n
+
+
+def observe(name, value, buckets=TIME_BUCKETS, **labels):
+    """Adds a value to a histogram."""
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram(buckets)
+        histogram.add(value)
+
+
+class _Timer:
+    __slots__ = ("name", "labels", "start")
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe(self.name, time.perf_counter() - self.start,
+                **(dict(self.labels, error=exc_type.__name__) if exc_type is not None else self.labels))
+        return False
+
+
+def timer(name, **labels):
+    """Context manager recording its duration (seconds) in a histogram; failed blocks get an error label."""
+    if not _enabled:
+        return _null
+    return _Timer(name, labels)
+
+
+# === SNAPSHOTS / PROCESS POOLS ===
+def snapshot():
+    """Current metrics as a JSON-ready dict."""
+    with _lock:
+        return {
+            "counters": [{"name": name, "labels": dict(labels), "value": value}
+                         for (name, labels), value in sorted(_counters.items())],
+            "histograms": [dict(h.to_dict(), name=name, labels=dict(labels))
+                           for (name, labels), h in sorted(_histograms.items())],
+        }
+
+
+def merge(data):
+    """Adds the metrics of a snapshot (e.g. from a pool worker) to this process's."""
+    with _lock:
+        for c in data["counters"]:
+            key = _key(c["name"], c["labels"])
+            _counters[key] = _counters.get(key, 0) + c["value"]
+        for h in data["histograms"]:
+            key = _key(h["name"], h["labels"])
+            if key not in _histograms:
+                _histograms[key] = Histogram(h["buckets"])
+            _histograms[key].merge(h)
+
+
+def _collect(fn, args):
+    """Runs fn(*args) in a pool worker with metrics on; returns (result, metrics of the call)."""
+    enable()
+    reset()
+    result = fn(*args)
+    return result, snapshot()
+
+
+def _collect_one(fn, arg):
+    return _collect(fn, (arg,))
+
+
+def _merged_results(results):
+    for result, data in results:
+        merge(data)
+        yield result
+
+
+def pool_map(pool, fn, iterable, chunksize=1):
+    """pool.map(fn, iterable) that brings back the metrics recorded by fn in the workers."""
+    if not _enabled:
+        return pool.map(fn, iterable, chunksize=chunksize)
+    return _merged_results(pool.map(partial(_collect_one, fn), iterable, chunksize=chunksize))
+
+
+def pool_submit(pool, fn, *args):
+    """pool.submit(fn, *args) that brings back the metrics recorded by fn in the worker."""
+    if not _enabled:
+        return pool.submit(fn, *args)
+    outer = Future()
+
+    def unwrap(inner):
+        try:
+            result, data = inner.result()
+        except BaseException as e:
+            outer.set_exception(e)
+            return
+        merge(data)
+        outer.set_result(result)
+
+    pool.submit(_collect, fn, args).add_done_callback(unwrap)
+    return outer
+
+
+# === EXPORT ===
+def _prom_labels(labels, extra=None):
+    items = list(labels.items()) + (list(extra.items()) if extra else [])
+    if not items:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in items)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + "}"
+
+
+def to_prometheus(data):
+    """Prometheus text exposition format of a snapshot."""
+    lines = []
+    typed = set()
+    for c in data["counters"]:
+        if c["name"] not in typed:
+            typed.add(c["name"])
+            lines.append(f"# TYPE {c['name']} counter")
+        lines.append(f"{c['name']}{_prom_labels(c['labels'])} {c['value']}")
+    for h in data["histograms"]:
+        name = h["name"]
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {name} histogram")
+        cumulative = 0
+        for bound, n in zip(h["buckets"] + ["+Inf"], h["counts"]):
+            cumulative += n
+            lines.append(f"{name}_bucket{_prom_labels(h['labels'], {'le': bound})} {cumulative}")
+        lines.append(f"{name}_sum{_prom_labels(h['labels'])} {h['sum']}")
+        lines.append(f"{name}_count{_prom_labels(h['labels'])} {h['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def export(path, run_info=None):
+    """Writes the metrics to path (Prometheus text for .prom/.txt, else JSON), atomically."""
+    data = snapshot()
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        if path.endswith((".prom", ".txt")):
+            f.write(to_prometheus(data))
+        else:
+            json.dump(dict(run_info or {}, **data), f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def summary(data, top=SUMMARY_TOP):
+    """Lines with the timers taking the most total time: count, total, mean and max."""
+    timers = sorted((h for h in data["histograms"] if h["name"].endswith("_seconds")),
+                    key=lambda h: -h["sum"])[:top]
+    if not timers:
+        return []
+    lines = [f"  {'step':<58} {'count':>8} {'total s':>9} {'mean ms':>9} {'max ms':>9}"]
+    for h in timers:
+        label = h["name"] + "".join(f" {k}={v}" for k, v in h["labels"].items())
+        lines.append(f"  {label[:58]:<58} {h['count']:>8} {h['sum']:>9.2f} "
+                     f"{h['sum'] / h['count'] * 1000:>9.1f} {h['max'] * 1000:>9.1f}")
+    return lines
+
+
+@contextlib.contextmanager
+def session(args, script):
+    """
+    Enables metrics (args.metrics) and the progress line (args.progress) for one
+    run of a script; on exit, even after an error, exports and summarizes the metrics.
+    """
+    global _progress_enabled
+    path = getattr(args, "metrics", None)
+    _progress_enabled = bool(getattr(args, "progress", False))
+    if not path:
+        yield
+        return
+
+    enable()
+    reset()
+    started = datetime.now()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        enable(False)
+        run_info = {"script": script, "argv": sys.argv[1:], "start_time": started.strftime("%Y-%m-%d %H:%M:%S"),
+                    "elapsed_seconds": round(time.perf_counter() - start, 3)}
+        export(path, run_info)
+        lines = summary(snapshot())
+        if lines:
+            print("\n⏱️  Time per step:")
+            print("\n".join(lines))
+        print(f"📈 Metrics written to {path}")
+
+
+def add_metrics_arguments(parser):
+    """--metrics / --progress options shared by the workflow scripts."""
+    parser.add_argument("--metrics", metavar="PATH", default=METRICS_PATH,
+                        help="Export timers and counters of the run to PATH (.prom/.txt: Prometheus text, "
+                             "else JSON) (default: $PED_METRICS)")
+    parser.add_argument("--progress", action="store_true",
+                        help="Show a live progress line with rates and ETA (stderr)")
+
+
+# === PROGRESS ===
+class Progress:
+    """Live progress line on stderr: done/total, items/s, MB/s and ETA, updated every PROGRESS_INTERVAL s."""
+
+    def __init__(self, total, unit="files", interval=PROGRESS_INTERVAL, stream=None):
+        self.total = total
+        self.unit = unit
+        self.interval = interval
+        self.stream = stream or sys.stderr
+        self.done = 0
+        self.bytes = 0
+        self.shown = None  # done count of the last line written
+        self.start = self.last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def advance(self, n=1, n_bytes=0):
+        with self._lock:
+            self.done += n
+            self.bytes += n_bytes
+            now = time.monotonic()
+            if now - self.last >= self.interval or self.done >= self.total:
+                self.last = now
+                self._write(now)
+
+    def _write(self, now):
+        elapsed = max(now - self.start, 1e-9)
+        rate = self.done / elapsed
+        eta = (self.total - self.done) / rate if rate > 0 else None
+        line = f"⏳ {self.done}/{self.total} {self.unit} ({self.done / self.total * 100 if self.total else 100:.0f}%) " \
+               f"{rate:.1f} {self.unit}/s"
+        if self.bytes:
+            line += f", {self.bytes / 1024**2 / elapsed:.1f} MB/s"
+        line += f", ETA {time.strftime('%H:%M:%S', time.gmtime(eta)) if eta is not None else '--:--:--'}"
+        self.stream.write(f"\r{line}  ")
+        self.stream.flush()
+        self.shown = self.done
+
+    def close(self):
+        with self._lock:
+            if self.shown != self.done:
+                self._write(time.monotonic())
+            self.stream.write("\n")
+            self.stream.flush()
+
+
+class _NoProgress:
+    def advance(self, n=1, n_bytes=0):
+        pass
+
+    def close(self):
+        pass
+
+
+def progress(total, unit="files"):
+    """A Progress line if --progress is on for this run, else a no-op."""
+    return Progress(total, unit) if _progress_enabled else _NoProgress()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Print the time per step of an exported metrics JSON.")
+    parser.add_argument("path")
+    parser.add_argument("--top", type=int, default=SUMMARY_TOP)
+    args = parser.parse_args(argv)
+
+    with open(args.path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    print(f"📈 {data.get('script', '?')} {' '.join(data.get('argv', []))} "
+          f"({data.get('start_time', '?')}, {data.get('elapsed_seconds', 0):.1f} s)")
+    print("\n".join(summary(data, args.top)) or "  No timers recorded")
+    for c in data["counters"]:
+        print(f"  {c['name']}{_prom_labels(c['labels'])} {c['value']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+PED deposition CLI
+------------------
+Single entry point for the deposition workflow. Each subcommand runs one of the
+scripts, with the folders, server URL and tracking files taken from a TOML (or
+YAML) config file instead of the values hardcoded in the script:
+
+    analyze     anylisis_ensembles.py     size / sequence length of the ensembles
+    batch       batches_generation.py     split analyzed ensembles into upload batches
+    generate    json_generation.py        description and construct JSONs
+    submit      Job-description-PED.py    drafts, descriptions and ensemble uploads
+    constructs  construct-post-PED.py     post the constructs of created drafts
+    status      job-status-PED.py         poll the status of submitted jobs
+    pipeline    deposit_pipeline.py       generate + submit + constructs in one streaming run
+
+Config file: one table per subcommand plus [common], applied to every subcommand.
+A key is either a setting of the script (a plain value assigned at the top of the
+script, e.g. folders, parent_folders, pdb_folders, url, log_file, MAX_BATCH_MB) or
+one of the subcommand's options (the option name with "_" instead of "-", e.g.
+workers, max_length_span, plan_only). Options given on the command line win over
+the file. Unknown keys are errors ([common] keys must be a setting of some script).
+
+    [common]
+    url = "http://127.0.0.1:4205/v1"
+    log_file = "cat3/job_tracking_log.csv"
+    tracking_db = "cat3/job_tracking.sqlite"
+
+    [analyze]
+    folders = ["/data/ped_deposition/AlphaFlex-IDPCG_cat3/completed_cat3"]
+    workers = 8
+
+    [batch]
+    parent_folders = ["/data/ped_deposition/AlphaFlex-IDPCG_cat3"]
+    planner = "packed"
+
+Several categories can run at the same time with one config file each (with their
+own tracking files).
+
+Usage:
+    python ped_deposit.py [--config ped_deposit.toml] <subcommand> [options]
+    python ped_deposit.py --config cat3.toml batch --plan-only
+    python ped_deposit.py <subcommand> --help
+"""
+
+import os
+import sys
+import ast
+import argparse
+import importlib.util
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    tomllib = None
+
+# === CONFIGURATION ===
+CONFIG_PATH = os.environ.get("PED_DEPOSIT_CONFIG")  # default config file
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# subcommand -> (script, description)
+COMMANDS = {
+    "analyze": ("anylisis_ensembles.py", "Analyze size and sequence length of PDB ensembles."),
+    "batch": ("batches_generation.py", "Split analyzed PDB ensembles into upload batches."),
+    "generate": ("json_generation.py", "Generate PED description and construct JSONs from PDB ensembles."),
+    "submit": ("Job-description-PED.py", "Create PED drafts, post descriptions and upload PDB ensembles."),
+    "constructs": ("construct-post-PED.py", "Post the construct JSONs of created drafts to PED."),
+    "status": ("job-status-PED.py", "Poll the status of submitted PED ensemble jobs."),
+    "pipeline": ("deposit_pipeline.py", "Generate payloads in memory and deposit PDB ensembles to PED."),
+}
+
+
+class ConfigError(Exception):
+    pass
+
+
+def load_config(path):
+    """Reads a TOML or YAML (.yaml/.yml, needs PyYAML) config file into a dict."""
+    if not path:
+        return {}
+    if path.endswith((".yaml", ".yml")):
+        try:
+            import yaml
+        except ImportError:
+            raise ConfigError("PyYAML is needed to read YAML configs (pip install pyyaml); or use TOML")
+        with open(path, "r", encoding="utf-8") as f:
+            config = yaml.safe_load(f) or {}
+    else:
+        if tomllib is None:
+            raise ConfigError("TOML configs need Python 3.11+ (tomllib); or use YAML")
+        with open(path, "rb") as f:
+            config = tomllib.load(f)
+    for section, values in config.items():
+        if not isinstance(values, dict):
+            raise ConfigError(f"'{section}' must be a table of settings")
+    unknown = set(config) - set(COMMANDS) - {"common"}
+    if unknown:
+        raise ConfigError(f"Unknown config sections: {', '.join(sorted(unknown))}")
+    return config
+
+
+def load_script(filename):
+    """
+    Imports a workflow script by file name (some are not valid module names). Scripts
+    only define functions and settings at import; nothing runs until run()/main().
+    """
+    name = os.path.splitext(filename)[0].replace("-", "_")
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.spec_from_file_location(name, os.path.join(SCRIPT_DIR, filename))
+    module = importlib.util.module_from_spec(spec)
+    # Registered before running it, so process pools can pickle its functions
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def is_plain(value):
+    """True for config-file values: strings, numbers, booleans, None and lists/dicts of them."""
+    if isinstance(value, (list, tuple)):
+        return all(is_plain(v) for v in value)
+    if isinstance(value, dict):
+        return all(isinstance(k, str) and is_plain(v) for k, v in value.items())
+    return value is None or isinstance(value, (str, int, float))
+
+
+def script_settings(module):
+    """
+    Settings of a script: the names it assigns at top level (not imported ones) whose
+    value is plain data. Modules, functions and objects such as the requests session
+    are not settings.
+    """
+    with open(module.__file__, "r", encoding="utf-8") as f:
+        tree = ast.parse(f.read(), module.__file__)
+    names = set()
+    for node in tree.body:
+        if isinstance(node, ast.Assign):
+            names.update(t.id for t in node.targets if isinstance(t, ast.Name))
+        elif isinstance(node, ast.AnnAssign) and isinstance(node.target, ast.Name):
+            names.add(node.target.id)
+    return {name for name in names if not name.startswith("_") and is_plain(getattr(module, name, None))}
+
+
+def configure(module, command, config):
+    """
+    Applies the [common] and [<command>] settings to the script module and returns
+    the remaining keys of [<command>], which must be options of the subcommand.
+    Raises ConfigError for [common] keys that are not a setting of any script.
+    """
+    settings = script_settings(module)
+    # [common] keys that are not settings of this script must be settings of another one
+    others = [filename for other, (filename, _) in COMMANDS.items() if other != command]
+    unknown = [key for key in config.get("common", {})
+               if key not in settings and not any(key in script_settings(load_script(f)) for f in others)]
+    if unknown:
+        raise ConfigError(f"Unknown settings in [common]: {', '.join(sorted(unknown))}")
+
+    for key, value in config.get("common", {}).items():
+        if key in settings:
+            setattr(module, key, value)
+
+    options = {}
+    for key, value in config.get(command, {}).items():
+        if key in settings:
+            setattr(module, key, value)
+        else:
+            options[key] = value
+    return options
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="PED deposition workflow.",
+        epilog="Subcommands: " + "; ".join(f"{c}: {d}" for c, (_, d) in COMMANDS.items()),
+    )
+    parser.add_argument("--config", default=CONFIG_PATH,
+                        help="TOML/YAML config file (default: $PED_DEPOSIT_CONFIG)")
+    parser.add_argument("command", choices=list(COMMANDS))
+    parser.add_argument("args", nargs=argparse.REMAINDER, help="Options of the subcommand")
+    args = parser.parse_args(argv)
+
+    try:
+        config = load_config(args.config)
+    except (OSError, ValueError, ConfigError) as e:
+        print(f"❌ Cannot read config {args.config}: {e}")
+        return 1
+
+    filename, description = COMMANDS[args.command]
+    module = load_script(filename)
+    try:
+        options = configure(module, args.command, config)
+    except ConfigError as e:
+        print(f"❌ {e} ({args.config})")
+        return 1
+
+    # Built after configure(), so option defaults reflect the configured settings
+    sub = argparse.ArgumentParser(prog=f"{parser.prog} {args.command}", description=description)
+    if hasattr(module, "add_arguments"):
+        module.add_arguments(sub)
+    unknown = set(options) - set(vars(sub.parse_args([])))
+    if unknown:
+        print(f"❌ Unknown settings in [{args.command}] of {args.config}: {', '.join(sorted(unknown))}")
+        return 1
+    sub.set_defaults(**options)
+    sub_args = sub.parse_args(args.args)
+
+    if hasattr(module, "run"):
+        return module.run(sub_args) or 0
+    return module.main() or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Work sharding
+-------------
+Deterministic partitioning of a set of PDB files across N independent runs
+(e.g. the tasks of a Slurm array), used by the --shard i/N option of
+anylisis_ensembles.py, json_generation.py and Job-description-PED.py.
+Shards are numbered 0..N-1, so i can be $SLURM_ARRAY_TASK_ID.
+
+ - hash: a file goes to shard blake2b(filename) mod N. Stable across machines,
+   Python versions and runs, and independent of the other files in the set.
+ - size: greedy size balancing (largest file first, to the least-loaded shard).
+   Sizes come from the ensemble index when given, otherwise from os.stat. Every
+   shard computes the same assignment from the same file set.
+
+Each file belongs to exactly one shard. Per-shard outputs get a ".shard-i-of-N"
+suffix (see shard_path), and each script's --merge-shards N combines them.
+
+Usage:
+    python sharding.py <pdb_folder> --shards N [--by hash|size] [--index DB]   # preview
+"""
+
+import os
+import sys
+import heapq
+import hashlib
+import argparse
+
+# === CONFIGURATION ===
+SHARD_BY = "hash"
+
+
+def parse_shard(text):
+    """'i/N' -> (i, N), with 0 <= i < N. Usable as an argparse type."""
+    try:
+        i, n = (int(x) for x in text.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"shard must be i/N, got '{text}'")
+    if n < 1 or not 0 <= i < n:
+        raise argparse.ArgumentTypeError(f"shard index must be in 0..N-1, got '{text}'")
+    return i, n
+
+
+def shard_path(path, shard):
+    """Per-shard variant of an output path: results.tsv -> results.shard-0-of-4.tsv."""
+    if shard is None:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard-{shard[0]}-of-{shard[1]}{ext}"
+
+
+def shard_paths(path, n):
+    """Paths written by the N shards of a run, in shard order."""
+    return [shard_path(path, (i, n)) for i in range(n)]
+
+
+def hash_shard(name, n):
+    """Shard of a file name (stable; not Python's salted hash())."""
+    digest = hashlib.blake2b(os.path.basename(name).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % n
+
+
+def balanced_shards(names, sizes, n):
+    """
+    {name: shard} with the total size of the shards balanced (LPT). Ties are broken by
+    name and shard number, so the result only depends on the (name, size) pairs.
+    """
+    loads = [(0, i) for i in range(n)]
+    assignment = {}
+    for size, name in sorted(zip(sizes, names), key=lambda x: (-x[0], x[1])):
+        load, i = heapq.heappop(loads)
+        assignment[name] = i
+        heapq.heappush(loads, (load + size, i))
+    return assignment
+
+
+def file_sizes(paths, index_path=None):
+    """
+    File sizes in bytes, from the ensemble index where it has the file unchanged, else
+    os.stat. The index connection is private and closed here (not the shared open_index
+    one), since the caller may fork a process pool afterwards.
+    """
+    index = None
+    if index_path:
+        from ensemble_index import EnsembleIndex
+        index = EnsembleIndex(index_path)
+    try:
+        sizes = []
+        for path in paths:
+            record = index.lookup(path) if index is not None else None
+            sizes.append(record["size_bytes"] if record is not None else os.path.getsize(path))
+    finally:
+        if index is not None:
+            index.close()
+    return sizes
+
+
+def select_shard(files, folder, shard, by=SHARD_BY, index_path=None):
+    """
+    Files of `folder` (names, in their original order) that belong to `shard`;
+    all of them if shard is None.
+    """
+    if shard is None:
+        return list(files)
+    i, n = shard
+    if by == "size":
+        sizes = file_sizes([os.path.join(folder, f) for f in files], index_path)
+        assignment = balanced_shards(files, sizes, n)
+        return [f for f in files if assignment[f] == i]
+    return [f for f in files if hash_shard(f, n) == i]
+
+
+def add_shard_arguments(parser):
+    """--shard / --shard-by / --merge-shards options shared by the sharded scripts."""
+    parser.add_argument("--shard", type=parse_shard, metavar="i/N",
+                        help="Only process shard i of N (0-based), writing per-shard outputs")
+    parser.add_argument("--shard-by", choices=["hash", "size"], default=SHARD_BY,
+                        help=f"Partitioning: hash of the file name, or size-balanced (default: {SHARD_BY})")
+    parser.add_argument("--merge-shards", type=int, metavar="N",
+                        help="Combine the outputs of shards 0..N-1 into the unsharded outputs and exit")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Preview the partition of a PDB folder into shards.")
+    parser.add_argument("folder")
+    parser.add_argument("--shards", type=int, required=True)
+    parser.add_argument("--by", choices=["hash", "size"], default=SHARD_BY)
+    parser.add_argument("--index", metavar="DB", help="Ensemble index with the file sizes")
+    args = parser.parse_args(argv)
+
+    files = sorted(f for f in os.listdir(args.folder) if f.endswith(".pdb"))
+    sizes = dict(zip(files, file_sizes([os.path.join(args.folder, f) for f in files], args.index)))
+    for i in range(args.shards):
+        selected = select_shard(files, args.folder, (i, args.shards), args.by, args.index)
+        print(f"Shard {i}/{args.shards}: {len(selected)} PDBs, "
+              f"{sum(sizes[f] for f in selected) / 1024**2:.1f} MB")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
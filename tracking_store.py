@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+PED submission tracking store
+-----------------------------
+SQLite (WAL) store of submitted ensembles, replacing the full rewrite of
+job_tracking_log.csv after every file. One row per PDB file, committed as soon as
+the file is submitted, with indexed lookup by filename and draft_id.
+The CSV layout is kept as an export, so other tools can still read
+job_tracking_log.csv. The construct upload state of each draft (construct_status,
+set by construct-post-PED.py) is only kept in the store.
+
+Usage:
+    python tracking_store.py export [--csv job_tracking_log.csv]
+    python tracking_store.py import [--csv job_tracking_log.csv]
+    python tracking_store.py stats
+"""
+
+import os
+import csv
+import sys
+import sqlite3
+import argparse
+import threading
+
+# === CONFIGURATION ===
+TRACKING_DB = "job_tracking.sqlite"
+LOG_CSV = "job_tracking_log.csv"
+
+# Column order of job_tracking_log.csv
+CSV_COLUMNS = ["filename", "draft_id", "job_id", "status", "start_time", "pdb_size_bytes"]
+# Store-only columns (not in the CSV export): construct upload state of the draft
+EXTRA_COLUMNS = ["construct_status"]
+# Status of files whose submission failed (draft_id set if the draft was created);
+# the next submission run retries them, reusing the draft
+SUBMIT_ERROR = "submit_error"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    filename       TEXT PRIMARY KEY,
+    draft_id       TEXT,
+    job_id         TEXT,
+    status         TEXT,
+    start_time     TEXT,
+    pdb_size_bytes INTEGER,
+    construct_status TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_draft_id ON jobs (draft_id);
+"""
+
+
+class TrackingStore:
+    """Submission log keyed by PDB filename; safe to share between threads."""
+
+    def __init__(self, path=TRACKING_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+            # Stores created before construct_status existed
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+            for col in EXTRA_COLUMNS:
+                if col not in columns:
+                    self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {col} TEXT")
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+    def __contains__(self, filename):
+        return self.get(filename) is not None
+
+    def get(self, filename):
+        """Row of a PDB file as a dict, or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE filename = ?", (filename,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def get_by_draft(self, draft_id):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE draft_id = ?", (draft_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def add(self, row):
+        """Inserts (or replaces) the row of one file and commits it."""
+        values = {col: row.get(col) for col in CSV_COLUMNS + EXTRA_COLUMNS}
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO jobs ({', '.join(values)}) VALUES ({', '.join('?' for _ in values)})",
+                tuple(values.values()),
+            )
+
+    def update(self, filename, **fields):
+        """Updates some columns of an existing row and commits."""
+        assignments = ", ".join(f"{col} = ?" for col in fields)
+        with self._lock, self._conn:
+            self._conn.execute(f"UPDATE jobs SET {assignments} WHERE filename = ?",
+                               (*fields.values(), filename))
+
+    def rows(self):
+        """All rows in insertion order."""
+        with self._lock:
+            return [dict(r) for r in self._conn.execute("SELECT * FROM jobs ORDER BY rowid")]
+
+    def export_csv(self, csv_path=LOG_CSV):
+        """Writes the job_tracking_log.csv layout atomically (temporary file + rename)."""
+        tmp_path = csv_path + ".tmp"
+        with open(tmp_path, "w", newline="") as f:
+            writer = csv.writer(f, lineterminator="\n")
+            writer.writerow(CSV_COLUMNS)
+            for row in self.rows():
+                writer.writerow(["" if row[col] is None else row[col] for col in CSV_COLUMNS])
+        os.replace(tmp_path, csv_path)
+
+    def import_csv(self, csv_path=LOG_CSV):
+        """Adds the rows of an existing job_tracking_log.csv; returns how many were read."""
+        with open(csv_path, newline="") as f:
+            rows = list(csv.DictReader(f))
+        with self._lock, self._conn:
+            for row in rows:
+                size = row.get("pdb_size_bytes")
+                self._conn.execute(
+                    f"INSERT OR IGNORE INTO jobs ({', '.join(CSV_COLUMNS)}) VALUES ({', '.join('?' for _ in CSV_COLUMNS)})",
+                    tuple(int(float(size)) if col == "pdb_size_bytes" and size else (row.get(col) or None)
+                          for col in CSV_COLUMNS),
+                )
+        return len(rows)
+
+    def merge(self, other):
+        """
+        Adds the rows of another store (e.g. a shard's). A row already here is replaced only
+        if its submission failed or the other row is a later submission (start_time); otherwise
+        it is kept, since it may have newer statuses. Returns how many rows were added or replaced.
+        """
+        merged = 0
+        for row in other.rows():
+            existing = self.get(row["filename"])
+            if (existing is None or existing["status"] == SUBMIT_ERROR
+                    or (row["start_time"] or "") > (existing["start_time"] or "")):
+                self.add(row)
+                merged += 1
+        return merged
+
+    def close(self):
+        self._conn.close()
+
+
+def open_store(db_path=TRACKING_DB, csv_path=LOG_CSV):
+    """
+    Opens the tracking store. A new store is seeded from an existing CSV log, so
+    runs started with the old pandas-based log continue where they stopped.
+    """
+    is_new = not os.path.exists(db_path)
+    store = TrackingStore(db_path)
+    if is_new and os.path.exists(csv_path):
+        n = store.import_csv(csv_path)
+        print(f"📥 Imported {n} rows from {csv_path} into {db_path}")
+    return store
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export, import or inspect the PED tracking store.")
+    parser.add_argument("command", choices=["export", "import", "stats"])
+    parser.add_argument("--db", default=TRACKING_DB)
+    parser.add_argument("--csv", default=LOG_CSV)
+    args = parser.parse_args(argv)
+
+    store = TrackingStore(args.db)
+    if args.command == "export":
+        store.export_csv(args.csv)
+        print(f"📄 Exported {len(store)} rows to {args.csv}")
+    elif args.command == "import":
+        print(f"📥 Read {store.import_csv(args.csv)} rows from {args.csv} ({len(store)} in store)")
+    elif args.command == "stats":
+        counts, construct_counts = {}, {}
+        for row in store.rows():
+            counts[row["status"]] = counts.get(row["status"], 0) + 1
+            construct_counts[row["construct_status"]] = construct_counts.get(row["construct_status"], 0) + 1
+        print(f"Rows: {len(store)}")
+        for status, n in sorted(counts.items(), key=lambda x: -x[1]):
+            print(f"  {status}: {n}")
+        print("Constructs:")
+        for status, n in sorted(construct_counts.items(), key=lambda x: -x[1]):
+            print(f"  {status or 'not posted'}: {n}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())